@@ -0,0 +1,47 @@
+#!/usr/bin/python3
+
+from extras.scripts import IntegerVar, Script
+
+from scriptutils.bbpop import MGMT_AGGREGATE_DESC
+from scriptutils.capacity import DEFAULT_WINDOW_DAYS, format_usage, get_aggregate_pool_usage, get_prefix_pool_usage, get_usage_warning
+from scriptutils.wgtunnel import PREFIX_ROLE_SLUG_OOBM, PREFIX_ROLE_SLUG_REGULAR, prefix_length_by_af
+
+# (prefix role slug, address family, prefix length handed out)
+PREFIX_POOLS = [(role, af, prefix_length_by_af[af]) for role in (PREFIX_ROLE_SLUG_REGULAR, PREFIX_ROLE_SLUG_OOBM) for af in (4, 6)]
+
+# (aggregate description, prefix length handed out)
+AGGREGATE_POOLS = [
+	(MGMT_AGGREGATE_DESC, 24),
+]
+
+
+class AddressSpaceReport (Script):
+	class Meta:
+		name = "Address space report"
+		description = "Utilisation of VPN and mgmt address pools with exhaustion forecast"
+		commit_default = False
+
+	window_days = IntegerVar (
+		description = "Number of days to derive the allocation rate from",
+		default = DEFAULT_WINDOW_DAYS,
+		min_value = 1
+	)
+
+	def run (self, data, commit):
+		window_days = data['window_days'] or DEFAULT_WINDOW_DAYS
+
+		usages = [get_prefix_pool_usage (role, af, plen, window_days) for role, af, plen in PREFIX_POOLS]
+		usages += [get_aggregate_pool_usage (desc, plen, window_days) for desc, plen in AGGREGATE_POOLS]
+
+		for usage in usages:
+			if not usage.containers:
+				self.log_warning ("No containers found for pool %s" % usage.name)
+				continue
+
+			warning = get_usage_warning (usage)
+			if warning:
+				self.log_warning (warning)
+			else:
+				self.log_success (format_usage (usage))
+
+		return "\n".join (format_usage (usage) for usage in usages)
@@ -4,42 +4,33 @@
 #  --  Mon 30 Jan 2023 11:09:11 PM CET
 #
 
-from django.utils.text import slugify
 
 from dcim.choices import LinkStatusChoices
-from dcim.models import Cable, Device, RearPort
-from extras.scripts import *
+from dcim.models import Cable, Device, RearPort, Site
+from extras.scripts import BooleanVar, IntegerVar, ObjectVar, Script, TextVar
+
+from scriptutils.cablegraph import PATH_COMPLETE
+from scriptutils.chunked import enqueue_chunks
+from scriptutils.joblog import JobLog, DEFAULT_DETAIL_LIMIT
+from scriptutils.topology import get_topology
 
 try:
 	from utilities.exceptions import AbortScript
-except ModuleNotFound:
+except ImportError:
 	class AbortScript(Exception):
 		pass
 
 
-class ConnectRearPorts(Script):
-    class Meta:
-        description = "Connect Rear ports of two devices"
-
-    device_a = ObjectVar(
-        description = "Device on A end",
-        model=Device,
-    )
-    device_b = ObjectVar(
-        description = "Device on B end",
-        model=Device,
-    )
-    connected = BooleanVar(
-        description = "Mark the cables as connected instead of planned (default)",
-    )
+def get_job_log(script, data):
+    detail_limit = data.get("log_detail_limit")
+    if detail_limit is None:
+        detail_limit = DEFAULT_DETAIL_LIMIT
 
-    commit_default = True
+    return JobLog(script, detail_limit)
 
-    def run(self, data, commit):
-        dev_a = data["device_a"]
-        dev_b = data["device_b"]
-        connected = data["connected"]
 
+class RearPortConnector:
+    def connect_rear_ports(self, dev_a, dev_b, cables_status, log):
         a_rps = RearPort.objects.filter(
             device_id = dev_a.id
         )
@@ -54,18 +45,13 @@ class ConnectRearPorts(Script):
 
         # Validate compability of port types? copper vs fiber?
 
-        # planned or connected?
-        cables_status = LinkStatusChoices.STATUS_PLANNED
-        if connected:
-            cables_status = LinkStatusChoices.STATUS_CONNECTED
-
         for i in range(a_rps_len):
             rp_a = a_rps[i]
             rp_b = b_rps[i]
 
             # check if connected to B
             if a_rps[i].link:
-                self.log_info(f"Rear port {rp_a} already connected, skipping.")
+                log.info(f"Rear port {rp_a} already connected, skipping.", key = "skipped")
                 continue
 
             c = Cable(
@@ -74,4 +60,164 @@ class ConnectRearPorts(Script):
                 status = cables_status
             )
             c.save()
-            self.log_success(f"Connected rear port {rp_a} to {rp_b}.")
+            log.success(f"Connected rear port {rp_a} to {rp_b}.", key = "connected")
+
+
+def get_cables_status(connected):
+    # planned or connected?
+    if connected:
+        return LinkStatusChoices.STATUS_CONNECTED
+
+    return LinkStatusChoices.STATUS_PLANNED
+
+
+class ConnectRearPorts(RearPortConnector, Script):
+    class Meta:
+        description = "Connect Rear ports of two devices"
+
+    device_a = ObjectVar(
+        description = "Device on A end",
+        model=Device,
+    )
+    device_b = ObjectVar(
+        description = "Device on B end",
+        model=Device,
+    )
+    connected = BooleanVar(
+        description = "Mark the cables as connected instead of planned (default)",
+    )
+    log_detail_limit = IntegerVar(
+        description = "Maximum number of per-cable log lines to keep in the job log",
+        default = DEFAULT_DETAIL_LIMIT,
+        required = False,
+    )
+    full_log = BooleanVar(
+        description = "Save the full per-cable log as a file and link it from the job log",
+    )
+
+    commit_default = True
+
+    def run(self, data, commit):
+        log = get_job_log(self, data)
+
+        self.connect_rear_ports(data["device_a"], data["device_b"], get_cables_status(data["connected"]), log)
+
+        if data.get("full_log"):
+            log.save_full_text()
+        log.flush("Connected {connected} rear ports, {skipped} skipped.")
+
+
+class ConnectRearPortsBatch(RearPortConnector, Script):
+    class Meta:
+        description = "Connect Rear ports of many device pairs, optionally in background jobs"
+
+    device_pairs = TextVar(
+        description = "One pair of device names per line: &lt;device A&gt; &lt;device B&gt;",
+    )
+    connected = BooleanVar(
+        description = "Mark the cables as connected instead of planned (default)",
+    )
+    background = BooleanVar(
+        description = "Connect every device pair in its own background job, in parallel on all workers",
+    )
+    log_detail_limit = IntegerVar(
+        description = "Maximum number of per-cable log lines to keep in the job log",
+        default = DEFAULT_DETAIL_LIMIT,
+        required = False,
+    )
+    full_log = BooleanVar(
+        description = "Save the full per-cable log as a file and link it from the job log",
+    )
+
+    commit_default = True
+
+    def parse_device_pairs(self, text):
+        pairs = []
+        names = set()
+        for line in text.splitlines():
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+
+            fields = line.split()
+            if len(fields) != 2:
+                raise AbortScript(f"Invalid device pair line '{line}', expected two device names.")
+
+            pairs.append(fields)
+            names.update(fields)
+
+        devices = {dev.name: dev for dev in Device.objects.filter(name__in = names)}
+        missing = sorted(names - set(devices))
+        if missing:
+            raise AbortScript(f"Unknown devices: {', '.join(missing)}")
+
+        return [(devices[a], devices[b]) for a, b in pairs]
+
+    # Entry point for background jobs, chunk is a list of (device A ID, device B ID, cable status) tuples
+    def connect_chunk(self, chunk):
+        log = JobLog(self)
+        for dev_a_id, dev_b_id, cables_status in chunk:
+            self.connect_rear_ports(Device.objects.get(pk = dev_a_id), Device.objects.get(pk = dev_b_id), cables_status, log)
+
+        log.flush("Connected {connected} rear ports, {skipped} skipped.")
+
+    def run(self, data, commit):
+        pairs = self.parse_device_pairs(data["device_pairs"])
+        cables_status = get_cables_status(data["connected"])
+
+        if data["background"]:
+            chunk_list = [[(dev_a.id, dev_b.id, cables_status)] for dev_a, dev_b in pairs]
+            names = {dev.id: dev.name for pair in pairs for dev in pair}
+
+            collector, jobs = enqueue_chunks(self, "connect_chunk", chunk_list, commit,
+                label_fn = lambda chunk: f"{names[chunk[0][0]]} <-> {names[chunk[0][1]]}")
+
+            self.log_success(f"Enqueued {len(jobs)} background jobs, their results will be added to this job when done (collector job {collector.id}).")
+            return
+
+        log = get_job_log(self, data)
+        for dev_a, dev_b in pairs:
+            try:
+                self.connect_rear_ports(dev_a, dev_b, cables_status, log)
+            except AbortScript as e:
+                log.failure(f"Not connecting {dev_a} to {dev_b}: {e}", key = "failed")
+
+        if data.get("full_log"):
+            log.save_full_text()
+        log.flush("Connected {connected} rear ports, {skipped} skipped, {failed} device pairs failed.")
+
+
+class VerifyCablePaths(Script):
+    class Meta:
+        description = "Verify all cable paths of a site and report broken or dangling chains"
+
+    site = ObjectVar(
+        description = "Site to verify",
+        model = Site,
+    )
+    log_detail_limit = IntegerVar(
+        description = "Maximum number of per-path log lines to keep in the job log",
+        default = DEFAULT_DETAIL_LIMIT,
+        required = False,
+    )
+    full_log = BooleanVar(
+        description = "Save all paths as a file and link it from the job log",
+    )
+
+    commit_default = False
+
+    def run(self, data, commit):
+        topology = get_topology(data["site"])
+        log = get_job_log(self, data)
+
+        # Report problems first, so they are not cut off by the detail limit
+        paths = sorted(topology.paths(), key = lambda path: path.status == PATH_COMPLETE)
+        for path in paths:
+            if path.status == PATH_COMPLETE:
+                log.success(topology.format_path(path), key = path.status)
+            else:
+                log.warning(topology.format_path(path), key = path.status)
+
+        if data.get("full_log"):
+            log.save_full_text()
+        log.flush("Found {complete} complete, {dangling} dangling, and {broken} broken cable paths.")
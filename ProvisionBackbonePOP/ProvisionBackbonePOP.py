@@ -4,82 +4,61 @@
 #  --  Tue 19 May 2020 09:29:42 PM CEST
 #
 
-from django.utils.text import slugify
-
-from dcim.choices import *
-from dcim.models import Cable, Device, DeviceRole, DeviceType, Platform, Rack, RackRole, Site
+import ipaddress
+import json
+import re
+
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import Q
+
+from dcim.choices import (
+	DeviceFaceChoices, DeviceStatusChoices, InterfaceModeChoices, InterfaceTypeChoices, LinkStatusChoices,
+	PortTypeChoices, RackStatusChoices, RackTypeChoices, RackWidthChoices,
+)
+from dcim.models import Cable, CableTermination, Device, DeviceRole, DeviceType, Platform, Rack, RackRole, Site
 from dcim.models.device_components import FrontPort, Interface, RearPort
 
-from ipam.choices import *
 from ipam.models import Aggregate, Prefix, IPAddress, Role, VLAN
 
-from extras.scripts import *
-
-
-class ProvisionBackbonePOP (Script):
-	class Meta:
-		name = "Provision Backbone POP"
-		description = "Provision a new backbone POP"
-		field_order = ['site', 'rack_name', 'rack_units', 'panel_ports', 'pole_setup']
-		commit_default = False
-
-	# Drop down for sites
-	site = ObjectVar (
-		model = Site,
-		description = "Site to be provisioned",
-	)
-
-	# Rack name
-	rack_name = StringVar (
-		description = "Name of the rack",
-		default = "R1"
-	)
-
-	# Rack units
-	rack_units = IntegerVar (
-		description = "Number of units of this rack",
-		default = 9
-	)
-
-	# BBR
-	bbr_model = ObjectVar (
-		description = "APU model",
-		model = DeviceType,
-		query_params = {
-			"manufacturer" : "pcengines",
-		}
-	)
-	bbr_asset_tag = StringVar (description = "Asset tag of backbone router")
-	bbr_serial = StringVar (description = "Serial number of backbone router")
-
-	# Switch asset tag
-	sw_asset_tag = StringVar (description = "Asset tag of switch")
-	sw_serial = StringVar (description = "Serial number of switch")
-
-	# Panel ports
-	panel_ports = IntegerVar (description = "Number of port on the patch panel (if 19\")")
-
-	# Pole setup
-	pole_setup = StringVar (description = "Space separated list of &lt;pole no&gt;:&lt;num_cables&gt;")
-
-	# BBR ID
-	node_id = IntegerVar (description = "Node ID of BBR")
-
+from extras.scripts import IntegerVar, ObjectVar, Script, StringVar, TextVar
+
+from scriptutils.bbpop import (
+	LOOPBACK_IPV4, LOOPBACK_IPV4_PREFIX, LOOPBACK_IPV6, LOOPBACK_IPV6_PREFIX,
+	MGMT_AGGREGATE_DESC, MGMT_IP_BBR, MGMT_IP_SWITCH, MGMT_PREFIX, MGMT_VLAN_BASE,
+	NODE_ID_MAX, NODE_ID_MIN,
+	get_bbr_name, get_patch_panel_name, get_surge_name, get_switch_name, loopback_node_id, parse_pole_setup,
+)
+from scriptutils.bulk import bulk_create, bulk_update
+from scriptutils.capacity import get_aggregate_pool_usage, get_usage_warning
+from scriptutils.devices import bulk_create_devices
+from scriptutils.idpool import IdPool, PoolExhaustedError
+from scriptutils.locks import lock_node_id_allocation, lock_prefix_allocation
+from scriptutils.rackunits import RackFullError, load_rack_units
+from scriptutils.refcache import ReferenceCache
+from scriptutils.wgtunnel import TUNNEL_IFACE_PREFIXES, is_tunnel_iface_name
 
 ################################################################################
-#                                 Methods                                      #
+#                              POP provisioning                                #
 ################################################################################
 
+class BackbonePOPProvisioner (ReferenceCache):
 	def find_next_free_mgmt_id (self):
-		pfx_role = Role.objects.get (name = 'Mgmt')
+		# Held until the mgmt prefix has been created and committed
+		lock_prefix_allocation ()
+
 		try:
-			mgmt_aggr = Aggregate.objects.get (description = "FFHO Management")
+			mgmt_aggr = Aggregate.objects.get (description = MGMT_AGGREGATE_DESC)
 
 			avail_pfxs = mgmt_aggr.get_available_prefixes ().iter_cidrs ()
 			for apfx in avail_pfxs:
 				if apfx.prefixlen == 24:
 					mgmt_id = int (str (apfx).split ('.')[2])
 					self.log_info ("Picked next free mgmt ID %d" % mgmt_id)
+
+					warning = get_usage_warning (get_aggregate_pool_usage (MGMT_AGGREGATE_DESC, 24))
+					if warning:
+						self.log_warning (warning)
+
 					return mgmt_id
 
 			self.log_failure ("Didn't find next free mgmt ID :'(")
@@ -89,8 +68,53 @@ class ProvisionBackbonePOP (Script):
 			raise a
 
 
+	# Re-use the mgmt ID of the site's mgmt VLAN, if there is one already, so
+	# running the script again for a POP doesn't allocate another mgmt /24.
+	def find_mgmt_id (self, site):
+		vlan = VLAN.objects.filter (site = site, role__name = 'Mgmt', vid__gt = MGMT_VLAN_BASE).order_by ('vid').first ()
+		if vlan:
+			self.log_info ("Re-using mgmt ID %d of mgmt vlan %s" % (vlan.vid - MGMT_VLAN_BASE, vlan))
+			return vlan.vid - MGMT_VLAN_BASE
+
+		return self.find_next_free_mgmt_id ()
+
+
+	# Load the node IDs in use by loopback IPs of either address family into an IdPool.
+	#
+	# The node ID lock is held until the end of the transaction, so POPs provisioned
+	# in parallel don't pick the same ID before its loopbacks have been created.
+	def load_node_ids (self):
+		lock_node_id_allocation ()
+
+		pool = IdPool (NODE_ID_MIN, NODE_ID_MAX)
+
+		loopbacks = IPAddress.objects.filter (
+			Q (address__net_host_contained = LOOPBACK_IPV4_PREFIX) |
+			Q (address__net_host_contained = LOOPBACK_IPV6_PREFIX)
+		).values_list ('address', flat = True)
+
+		for address in loopbacks:
+			node_id = loopback_node_id (str (address))
+			if node_id is not None:
+				pool.mark_used (node_id)
+
+		return pool
+
+
+	def allocate_node_ids (self, count = 1):
+		pool = self.load_node_ids ()
+		try:
+			node_ids = pool.allocate (count)
+		except PoolExhaustedError as e:
+			self.log_failure ("Can't allocate %d node IDs: %s" % (count, e))
+			raise
+
+		self.log_info ("Picked free node ID(s) %s" % ", ".join (str (x) for x in node_ids))
+		return node_ids
+
+
 	def create_mgmt_vlan (self, site, site_no):
-		vlan_id = 3000 + int (site_no)
+		vlan_id = MGMT_VLAN_BASE + int (site_no)
 		try:
 			vlan = VLAN.objects.get (site = site, vid = vlan_id)
 			self.log_info ("Mgmt vlan %s already present, carrying on." % vlan)
@@ -103,7 +127,7 @@ class ProvisionBackbonePOP (Script):
 			site = site,
 			name = "Mgmt %s" % site.name,
 			vid = vlan_id,
-			role = Role.objects.get (name = 'Mgmt')
+			role = self.get_ref (Role, name = 'Mgmt')
 		)
 
 		vlan.save ()
@@ -113,7 +137,7 @@ class ProvisionBackbonePOP (Script):
 
 
 	def create_mgmt_prefix (self, site, site_no, vlan):
-		prefix_cidr = "172.30.%d.0/24" % site_no
+		prefix_cidr = MGMT_PREFIX % site_no
 		try:
 			prefix = Prefix.objects.get (prefix = prefix_cidr)
 			self.log_info ("Mgmt prefix %s already present, carrying on." % prefix)
@@ -126,7 +150,7 @@ class ProvisionBackbonePOP (Script):
 			site = site,
 			prefix = prefix_cidr,
 			vlan = vlan,
-			role = Role.objects.get (name = 'Mgmt')
+			role = self.get_ref (Role, name = 'Mgmt')
 		)
 
 		prefix.save ()
@@ -144,7 +168,7 @@ class ProvisionBackbonePOP (Script):
 			pass
 
 		rack = Rack (
-			role = RackRole.objects.get (name = 'Backbone'),
+			role = self.get_ref (RackRole, name = 'Backbone'),
 			type = RackTypeChoices.TYPE_WALLCABINET,
 			width = RackWidthChoices.WIDTH_19IN,
 			u_height = units,
@@ -158,8 +182,46 @@ class ProvisionBackbonePOP (Script):
 		return rack
 
 
-	def create_patch_panel (self, site, rack, name, ports):
-		pp_name = "pp-%s-%s.1" % (site.slug, name)
+	def get_patch_panel_type (self):
+		return self.get_ref (DeviceType,
+			manufacturer__name = 'Telegärtner',
+			model = 'Patchpanel'
+		)
+
+
+	def get_switch_type (self):
+		return self.get_ref (DeviceType,
+			manufacturer__name = 'Netonix',
+			model = 'WS-12-250-AC'
+		)
+
+
+	# Find free rack positions for all devices of the POP not present yet.
+	#
+	# layout is a list of (device name, device type) tuples, ordered top down.
+	# Devices are placed with one free unit in between, where possible, and
+	# existing equipment in the rack is taken into account.
+	def place_devices (self, rack, layout):
+		existing = set (Device.objects.filter (name__in = [name for name, _ in layout]).values_list ('name', flat = True))
+		missing = [(name, dev_type) for name, dev_type in layout if name not in existing]
+
+		units = load_rack_units ([rack])[rack.id]
+		try:
+			positions = units.place ([(dev_type.u_height, dev_type.is_full_depth) for _, dev_type in missing], DeviceFaceChoices.FACE_FRONT)
+		except RackFullError as e:
+			self.log_failure ("Can't place devices in rack %s: %s" % (rack, e))
+			raise
+
+		placement = {}
+		for (name, _), position in zip (missing, positions):
+			placement[name] = position
+			self.log_info ("Picked position U%s in rack %s for %s" % (position, rack, name))
+
+		return placement
+
+
+	def create_patch_panel (self, site, rack, name, ports, position):
+		pp_name = get_patch_panel_name (site.slug, name)
 
 		try:
 			pp = Device.objects.get (site = site, name = pp_name)
@@ -168,19 +230,16 @@ class ProvisionBackbonePOP (Script):
 		except Device.DoesNotExist:
 			pass
 
-		pp_type = DeviceType.objects.get (
-			manufacturer__name = 'Telegärtner',
-			model = 'Patchpanel'
-		)
+		pp_type = self.get_patch_panel_type ()
 
 		pp = Device (
 			device_type = pp_type,
-			device_role = DeviceRole.objects.get (name = 'Patchpanel'),
+			device_role = self.get_ref (DeviceRole, name = 'Patchpanel'),
 			site = site,
 			status = DeviceStatusChoices.STATUS_PLANNED,
 			name = pp_name,
 			rack = rack,
-			position = rack.u_height,
+			position = position,
 			face = DeviceFaceChoices.FACE_FRONT
 		)
 
@@ -214,43 +273,43 @@ class ProvisionBackbonePOP (Script):
 		# So first split by spaces to get a single pole config and then iterate of surge at this pole.
 		# The RearPort of the 1st surge protector of the 1st pole will be connected to PP port 1 then
 		# continuing upwards.
-		surge_type = DeviceType.objects.get (
+		surge_type = self.get_ref (DeviceType,
 			manufacturer__name = 'Ubiquiti',
 			model = 'Surge Protector'
 		)
 
-		pp_port = 1
-		for pole_config in pole_setup.split ():
-			pole_no, num_surges = pole_config.split (':')
+		surge_role = self.get_ref (DeviceRole, name = 'Surge Protector')
 
-			for n in range (1, int (num_surges) + 1):
-				# Create surge
-				surge_name = "sp-%s-mast%s-%s" % (site.slug.lower (), pole_no, n)
-				surge = Device (
-					device_type = surge_type,
-					device_role = DeviceRole.objects.get (name = 'Surge Protector'),
-					name = surge_name,
-					status = DeviceStatusChoices.STATUS_PLANNED,
-					site = site
-				)
+		surges = []
+		for pole_no, n in parse_pole_setup (pole_setup):
+			surges.append (Device (
+				device_type = surge_type,
+				device_role = surge_role,
+				name = get_surge_name (site.slug, pole_no, n),
+				status = DeviceStatusChoices.STATUS_PLANNED,
+				site = site
+			))
 
-				surge.save ()
+		# Create all surges (and their ports) in one go
+		surges = bulk_create_devices (surges)
 
-				# Link RearPort of SP to next free panel port
-				cable = Cable (
-					termination_a = RearPort.objects.get (device = pp, name = str (pp_port)),
-					termination_b = RearPort.objects.get (device = surge, name = str (1)),
-					status = LinkStatusChoices.STATUS_PLANNED
-				)
+		pp_rear_ports = {rp.name : rp for rp in RearPort.objects.filter (device = pp)}
+		surge_rear_ports = {rp.device_id : rp for rp in RearPort.objects.filter (device__in = surges, name = str (1))}
 
-				cable.save ()
-				self.log_success ("Created surge protector %s and linked it to patch panel port %s." % (surge, pp_port))
+		for pp_port, surge in enumerate (surges, start = 1):
+			# Link RearPort of SP to next free panel port
+			cable = Cable (
+				termination_a = pp_rear_ports[str (pp_port)],
+				termination_b = surge_rear_ports[surge.pk],
+				status = LinkStatusChoices.STATUS_PLANNED
+			)
 
-				pp_port += 1
+			cable.save ()
+			self.log_success ("Created surge protector %s and linked it to patch panel port %s." % (surge, pp_port))
 
 
-	def setup_swtich (self, site, rack, pp, panel_ports, vlan, site_no, asset_tag, serial_no):
-		sw_name = "sw-%s-01.in.ffho.net" % site.slug
+	def setup_swtich (self, site, rack, pp, panel_ports, vlan, site_no, asset_tag, serial_no, position):
+		sw_name = get_switch_name (site.slug)
 
 		try:
 			sw = Device.objects.get (name = sw_name)
@@ -260,22 +319,19 @@ class ProvisionBackbonePOP (Script):
 		except Device.DoesNotExist:
 			pass
 
-		sw_type = DeviceType.objects.get (
-			manufacturer__name = 'Netonix',
-			model = 'WS-12-250-AC'
-		)
+		sw_type = self.get_switch_type ()
 
 		sw = Device (
 			device_type = sw_type,
-			device_role = DeviceRole.objects.get (name = 'Switch'),
-			platform = Platform.objects.get (name = 'Netonix'),
+			device_role = self.get_ref (DeviceRole, name = 'Switch'),
+			platform = self.get_ref (Platform, name = 'Netonix'),
 			name = sw_name,
 			asset_tag = asset_tag,
 			serial = serial_no,
 			status = DeviceStatusChoices.STATUS_PLANNED,
 			site = site,
 			rack = rack,
-			position = rack.u_height - 2,
+			position = position,
 			face = DeviceFaceChoices.FACE_FRONT
 		)
 
@@ -326,7 +382,7 @@ class ProvisionBackbonePOP (Script):
 
 		# Set up Mgmt vlan interface + IP
 		sw_mgmt_ip = IPAddress (
-			address = "172.30.%d.10/24" % site_no
+			address = MGMT_IP_SWITCH % site_no
 		)
 		sw_mgmt_ip.save ()
 
@@ -347,8 +403,8 @@ class ProvisionBackbonePOP (Script):
 		return sw
 
 
-	def setup_bbr (self, site, rack, model, vlan, site_no, node_id, asset_tag, serial_no, sw):
-		bbr_name = "bbr-%s.in.ffho.net" % site.slug
+	def setup_bbr (self, site, rack, model, vlan, site_no, node_id, asset_tag, serial_no, sw, position):
+		bbr_name = get_bbr_name (site.slug)
 
 		try:
 			bbr = Device.objects.get (name = bbr_name)
@@ -358,22 +414,22 @@ class ProvisionBackbonePOP (Script):
 		except Device.DoesNotExist:
 			pass
 
-		bbr_type = DeviceType.objects.get (
+		bbr_type = self.get_ref (DeviceType,
 			manufacturer__name = 'PCEngines',
 			model = model
 		)
 
 		bbr = Device (
 			device_type = bbr_type,
-			device_role = DeviceRole.objects.get (name = 'Backbone router'),
-			platform = Platform.objects.get (name = 'Linux'),
+			device_role = self.get_ref (DeviceRole, name = 'Backbone router'),
+			platform = self.get_ref (Platform, name = 'Linux'),
 			name = bbr_name,
 			asset_tag = asset_tag,
 			serial = serial_no,
 			status = DeviceStatusChoices.STATUS_PLANNED,
 			site = site,
 			rack = rack,
-			position = rack.u_height - 4,
+			position = position,
 			face = DeviceFaceChoices.FACE_FRONT,
 		)
 
@@ -408,7 +464,7 @@ class ProvisionBackbonePOP (Script):
 
 		# Set up Mgmt vlan interface + IP
 		bbr_mgmt_ip = IPAddress (
-			address = "172.30.%d.1/24" % site_no,
+			address = MGMT_IP_BBR % site_no,
 		)
 		bbr_mgmt_ip.save ()
 
@@ -426,12 +482,12 @@ class ProvisionBackbonePOP (Script):
 
 		# Set up loopback IPs
 		ipv4 = IPAddress (
-			address = "10.132.255.%s/32" % node_id,
+			address = LOOPBACK_IPV4 % node_id,
 		)
 		ipv4.save ()
 
 		ipv6 = IPAddress (
-			address = "2a03:2260:2342:ffff::%s/128" % node_id,
+			address = LOOPBACK_IPV6 % node_id,
 		)
 		ipv6.save ()
 
@@ -448,6 +504,269 @@ class ProvisionBackbonePOP (Script):
 		self.log_success ("Configured %s + %s on lo interface of %s" % (ipv4, ipv6, bbr))
 
 
+################################################################################
+#                               POP snapshots                                  #
+################################################################################
+
+#
+# A snapshot describes a provisioned POP (rack, devices in the rack and surge
+# protectors, their interfaces, front + rear ports, cables between them, mgmt
+# VLAN + prefix, and IPs) as a compact JSON document.  Repetitive entries
+# (interfaces, ports, cables, IPs) are stored as lists instead of dicts, see
+# export_pop () for their layout.  Bump SNAPSHOT_VERSION on layout changes.
+#
+
+SNAPSHOT_VERSION = 1
+
+
+def get_snapshot_devices (site, rack):
+	return Device.objects.filter (
+		Q (rack = rack) | Q (site = site, name__startswith = "sp-%s-" % site.slug.lower ())
+	).select_related ('device_type__manufacturer', 'device_role', 'platform').order_by ('name')
+
+
+def export_pop (site, rack):
+	devices = list (get_snapshot_devices (site, rack))
+	dev_names = {dev.pk : dev.name for dev in devices}
+
+	vlan = VLAN.objects.filter (site = site, role__name = 'Mgmt').first ()
+	prefix = Prefix.objects.filter (site = site, vlan = vlan).first () if vlan else None
+
+	# Interfaces: [device, name, type, enabled, mode, untagged vid, lag, parent, description]
+	#
+	# Wireguard tunnels are left out (along with their IPs), their transfer networks
+	# and peers belong to the tunnel and can't be cloned.  Set them up with the
+	# Wireguard scripts instead.
+	tunnels = Q (tags__name = "Wireguard")
+	for prefix in TUNNEL_IFACE_PREFIXES:
+		tunnels |= Q (name__startswith = prefix)
+
+	ifaces = Interface.objects.filter (device_id__in = dev_names).exclude (tunnels).values_list (
+		'pk', 'device_id', 'name', 'type', 'enabled', 'mode', 'untagged_vlan__vid', 'lag__name', 'parent__name', 'description')
+
+	# Rear ports: [device, name, type, positions]
+	rear_ports = RearPort.objects.filter (device_id__in = dev_names).values_list ('pk', 'device_id', 'name', 'type', 'positions')
+
+	# Front ports: [device, name, type, rear port name, rear port position]
+	front_ports = FrontPort.objects.filter (device_id__in = dev_names).values_list (
+		'pk', 'device_id', 'name', 'type', 'rear_port__name', 'rear_port_position')
+
+	snapshot = {
+		'version' : SNAPSHOT_VERSION,
+		'site' : site.slug,
+		'mgmt_id' : vlan.vid - MGMT_VLAN_BASE if vlan else None,
+		'vlan' : {'vid' : vlan.vid, 'name' : vlan.name} if vlan else None,
+		'prefix' : str (prefix.prefix) if prefix else None,
+		'rack' : {'name' : rack.name, 'u_height' : rack.u_height},
+		'devices' : [],
+		'interfaces' : [],
+		'rear_ports' : [],
+		'front_ports' : [],
+		'cables' : [],
+		'ips' : [],
+	}
+
+	for dev in devices:
+		snapshot['devices'].append ({
+			'name' : dev.name,
+			'type' : [dev.device_type.manufacturer.name, dev.device_type.model],
+			'role' : dev.device_role.name,
+			'platform' : dev.platform.name if dev.platform else None,
+			'status' : dev.status,
+			'rack' : dev.rack_id == rack.pk,
+			'position' : float (dev.position) if dev.position is not None else None,
+			'face' : dev.face or None,
+			'asset_tag' : dev.asset_tag,
+			'serial' : dev.serial,
+		})
+
+	ports = {}
+	for pk, dev_id, name, *rest in ifaces:
+		ports[('interface', pk)] = [dev_names[dev_id], 'interface', name]
+		snapshot['interfaces'].append ([dev_names[dev_id], name] + rest)
+
+	for pk, dev_id, name, *rest in rear_ports:
+		ports[('rearport', pk)] = [dev_names[dev_id], 'rearport', name]
+		snapshot['rear_ports'].append ([dev_names[dev_id], name] + rest)
+
+	for pk, dev_id, name, *rest in front_ports:
+		ports[('frontport', pk)] = [dev_names[dev_id], 'frontport', name]
+		snapshot['front_ports'].append ([dev_names[dev_id], name] + rest)
+
+	# Cables: [[A end terminations], [B end terminations], status], each termination being
+	# [device, kind, port name].  Cables leaving the POP are skipped.
+	terms = CableTermination.objects.filter (
+		cable_id__in = CableTermination.objects.filter (_device_id__in = dev_names).values ('cable_id')
+	).order_by ('cable_id').values_list ('cable_id', 'cable_end', 'termination_type__model', 'termination_id', 'cable__status')
+
+	cables = {}
+	for cable_id, cable_end, kind, term_id, status in terms:
+		cable = cables.setdefault (cable_id, [[], [], status])
+		cable[0 if cable_end == 'A' else 1].append (ports.get ((kind, term_id)))
+
+	for a_terms, b_terms, status in cables.values ():
+		if None not in a_terms + b_terms:
+			snapshot['cables'].append ([a_terms, b_terms, status])
+
+	# IPs: [address, status, device, interface, primary]
+	primary_ips = {dev.primary_ip4_id for dev in devices} | {dev.primary_ip6_id for dev in devices}
+	iface_names = {pk : (dev_names[dev_id], name) for pk, dev_id, name, *rest in ifaces}
+	ips = IPAddress.objects.filter (
+		assigned_object_type = ContentType.objects.get_for_model (Interface),
+		assigned_object_id__in = iface_names,
+	).values_list ('pk', 'address', 'status', 'assigned_object_id')
+
+	for pk, address, status, iface_id in ips:
+		snapshot['ips'].append ([str (address), status, iface_names[iface_id][0], iface_names[iface_id][1], pk in primary_ips])
+
+	# The node ID is the last octet of the BBRs primary IPv4 loopback
+	snapshot['node_id'] = None
+	for address, status, dev, iface, primary in snapshot['ips']:
+		last_octet = address.split ('/')[0].split ('.')[-1]
+		if primary and last_octet.isdigit () and address == LOOPBACK_IPV4 % last_octet:
+			snapshot['node_id'] = int (last_octet)
+
+	return snapshot
+
+
+# Remove Wireguard tunnel interfaces, their IPs and cables from a snapshot taken
+# before they were left out, returns the number of interfaces removed.
+def drop_tunnel_ifaces (snapshot):
+	tunnels = {(dev, name) for dev, name, *rest in snapshot['interfaces'] if is_tunnel_iface_name (name)}
+	if not tunnels:
+		return 0
+
+	snapshot['interfaces'] = [iface for iface in snapshot['interfaces'] if (iface[0], iface[1]) not in tunnels]
+	snapshot['ips'] = [ip for ip in snapshot['ips'] if (ip[2], ip[3]) not in tunnels]
+	snapshot['cables'] = [cable for cable in snapshot['cables']
+		if not any (kind == 'interface' and (dev, name) in tunnels for dev, kind, name in cable[0] + cable[1])]
+
+	return len (tunnels)
+
+
+# Remap names and addresses of a snapshot taken at one site to another one.
+class SnapshotRemapper (object):
+	def __init__ (self, snapshot, site, mgmt_id, node_id):
+		self.old_slug = snapshot['site']
+		self.new_slug = site.slug
+		self.old_mgmt_id = snapshot['mgmt_id']
+		self.new_mgmt_id = mgmt_id
+		self.old_node_id = snapshot['node_id']
+		self.new_node_id = node_id
+
+		# Hardware specific data only make sense when restoring in place
+		self.restore = self.old_slug == self.new_slug
+
+		rack_name = snapshot['rack']['name']
+		self.names = {
+			get_patch_panel_name (self.old_slug, rack_name) : get_patch_panel_name (self.new_slug, rack_name),
+			get_switch_name (self.old_slug) : get_switch_name (self.new_slug),
+			get_bbr_name (self.old_slug) : get_bbr_name (self.new_slug),
+		}
+		self.surge_re = re.compile (r'^sp-%s-mast(.+)-(\d+)$' % re.escape (self.old_slug.lower ()))
+		self.slug_re = re.compile (r'^([^-.]+-)%s(?=[-.]|$)' % re.escape (self.old_slug))
+
+	# Rebuild names of POP devices for the new site, other devices only get the
+	# slug component (following the "<kind>-<slug>" prefix) replaced.
+	def device_name (self, name):
+		if self.restore:
+			return name
+
+		if name in self.names:
+			return self.names[name]
+
+		match = self.surge_re.match (name)
+		if match:
+			return get_surge_name (self.new_slug, match.group (1), match.group (2))
+
+		return self.slug_re.sub (lambda m: m.group (1) + self.new_slug, name, count = 1)
+
+	def vid (self, vid):
+		if self.old_mgmt_id is not None and vid == MGMT_VLAN_BASE + self.old_mgmt_id:
+			return MGMT_VLAN_BASE + self.new_mgmt_id
+
+		return vid
+
+	def iface_name (self, name):
+		if self.old_mgmt_id is not None and name == "vlan%d" % (MGMT_VLAN_BASE + self.old_mgmt_id):
+			return "vlan%d" % (MGMT_VLAN_BASE + self.new_mgmt_id)
+
+		return name
+
+	# Returns None for addresses which can't be remapped to the new site
+	def address (self, address):
+		if self.restore:
+			return address
+
+		if self.old_mgmt_id is not None and address.startswith ("172.30.%d." % self.old_mgmt_id):
+			return address.replace ("172.30.%d." % self.old_mgmt_id, "172.30.%d." % self.new_mgmt_id, 1)
+
+		if self.old_node_id is not None:
+			if address == LOOPBACK_IPV4 % self.old_node_id:
+				return LOOPBACK_IPV4 % self.new_node_id
+			if address == LOOPBACK_IPV6 % self.old_node_id:
+				return LOOPBACK_IPV6 % self.new_node_id
+
+		return None
+
+
+################################################################################
+#                              Script classes                                  #
+################################################################################
+
+class ProvisionBackbonePOP (BackbonePOPProvisioner, Script):
+	class Meta:
+		name = "Provision Backbone POP"
+		description = "Provision a new backbone POP"
+		field_order = ['site', 'rack_name', 'rack_units', 'panel_ports', 'pole_setup']
+		commit_default = False
+
+	# Drop down for sites
+	site = ObjectVar (
+		model = Site,
+		description = "Site to be provisioned",
+	)
+
+	# Rack name
+	rack_name = StringVar (
+		description = "Name of the rack",
+		default = "R1"
+	)
+
+	# Rack units
+	rack_units = IntegerVar (
+		description = "Number of units of this rack",
+		default = 9
+	)
+
+	# BBR
+	bbr_model = ObjectVar (
+		description = "APU model",
+		model = DeviceType,
+		query_params = {
+			"manufacturer" : "pcengines",
+		}
+	)
+	bbr_asset_tag = StringVar (description = "Asset tag of backbone router")
+	bbr_serial = StringVar (description = "Serial number of backbone router")
+
+	# Switch asset tag
+	sw_asset_tag = StringVar (description = "Asset tag of switch")
+	sw_serial = StringVar (description = "Serial number of switch")
+
+	# Panel ports
+	panel_ports = IntegerVar (description = "Number of port on the patch panel (if 19\")")
+
+	# Pole setup
+	pole_setup = StringVar (description = "Space separated list of &lt;pole no&gt;:&lt;num_cables&gt;")
+
+	# BBR ID
+	node_id = IntegerVar (
+		description = "Node ID of BBR (lowest free one if empty)",
+		required = False
+	)
+
+
 	def run (self, data, commit):
 		site = data['site']
 
@@ -466,7 +785,15 @@ class ProvisionBackbonePOP (Script):
 		bbr_model = data['bbr_model']
 		node_id = data['node_id']
 
-		mgmt_id = self.find_next_free_mgmt_id ()
+		# Pick a node ID for the BBR or make sure the one given isn't in use yet
+		if not Device.objects.filter (name = get_bbr_name (site.slug)).exists ():
+			if node_id is None:
+				node_id = self.allocate_node_ids ()[0]
+			elif not self.load_node_ids ().is_free (node_id):
+				self.log_failure ("Node ID %s is invalid or its loopback IPs are already in use!" % node_id)
+				return "D'oh!"
+
+		mgmt_id = self.find_mgmt_id (site)
 
 		# Set up POP Mgmt VLAN
 		vlan = self.create_mgmt_vlan (site, mgmt_id)
@@ -477,14 +804,359 @@ class ProvisionBackbonePOP (Script):
 		# Create rack
 		rack = self.create_rack (site, rack_name, rack_units)
 
+		# Find free slots in the rack for panel, switch, and backbone router (top down)
+		placement = self.place_devices (rack, [
+			(get_patch_panel_name (site.slug, rack_name), self.get_patch_panel_type ()),
+			(get_switch_name (site.slug), self.get_switch_type ()),
+			(get_bbr_name (site.slug), bbr_model),
+		])
+
 		# Create patch panel
-		pp = self.create_patch_panel (site, rack, rack_name, panel_ports)
+		pp = self.create_patch_panel (site, rack, rack_name, panel_ports, placement.get (get_patch_panel_name (site.slug, rack_name)))
 
 		# Create surges and connect them to panel rear ports
 		self.create_and_connect_surges (site, rack, pp, pole_setup)
 
 		# Create switch
-		sw = self.setup_swtich (site, rack, pp, panel_ports, vlan, mgmt_id, sw_asset_tag, sw_serial)
+		sw = self.setup_swtich (site, rack, pp, panel_ports, vlan, mgmt_id, sw_asset_tag, sw_serial, placement.get (get_switch_name (site.slug)))
 
 		# Create backbone router
-		bbr = self.setup_bbr (site, rack, bbr_model, vlan, mgmt_id, node_id, bbr_asset_tag, bbr_serial, sw)
+		bbr = self.setup_bbr (site, rack, bbr_model, vlan, mgmt_id, node_id, bbr_asset_tag, bbr_serial, sw, placement.get (get_bbr_name (site.slug)))
+
+
+class ExportBackbonePOP (Script):
+	class Meta:
+		name = "Export Backbone POP snapshot"
+		description = "Export a provisioned backbone POP as snapshot, to be cloned or restored later"
+		field_order = ['site', 'rack_name']
+		commit_default = False
+
+	site = ObjectVar (
+		model = Site,
+		description = "Site of the POP",
+	)
+
+	rack_name = StringVar (
+		description = "Name of the rack",
+		default = "R1"
+	)
+
+	def run (self, data, commit):
+		site = data['site']
+
+		try:
+			rack = Rack.objects.get (site = site, name = data['rack_name'])
+		except Rack.DoesNotExist:
+			self.log_failure ("Rack %s doesn't exist at site %s!" % (data['rack_name'], site))
+			return "D'oh!"
+
+		snapshot = export_pop (site, rack)
+		self.log_success ("Exported %d devices, %d interfaces, %d cables, and %d IPs of POP %s." % (
+			len (snapshot['devices']), len (snapshot['interfaces']), len (snapshot['cables']), len (snapshot['ips']), site))
+
+		return json.dumps (snapshot, separators = (',', ':'))
+
+
+class CloneBackbonePOP (BackbonePOPProvisioner, Script):
+	class Meta:
+		name = "Clone Backbone POP snapshot"
+		description = "Clone a backbone POP snapshot to another site, or restore it at its original site"
+		field_order = ['snapshot', 'site', 'node_id']
+		commit_default = False
+
+	snapshot = TextVar (
+		description = "Snapshot as returned by the Export Backbone POP snapshot script"
+	)
+
+	site = ObjectVar (
+		model = Site,
+		description = "Site to clone the POP to (the POP is restored if it's the original one)",
+	)
+
+	node_id = IntegerVar (
+		description = "Node ID of BBR when cloning (lowest free one if empty)",
+		required = False
+	)
+
+	# Load device types, roles, and platforms used by the snapshot.  Returns None
+	# if any device type or role doesn't exist here.
+	def load_references (self, snapshot):
+		models = {dev['type'][1] for dev in snapshot['devices']}
+		dev_types = {(t.manufacturer.name, t.model) : t for t in DeviceType.objects.filter (model__in = models).select_related ('manufacturer')}
+		roles = {r.name : r for r in DeviceRole.objects.filter (name__in = {dev['role'] for dev in snapshot['devices']})}
+		platforms = {p.name : p for p in Platform.objects.filter (name__in = {dev['platform'] for dev in snapshot['devices']})}
+
+		missing = False
+		for dev in snapshot['devices']:
+			if tuple (dev['type']) not in dev_types:
+				self.log_failure ("Device type %s %s of device %s doesn't exist!" % (dev['type'][0], dev['type'][1], dev['name']))
+				missing = True
+			if dev['role'] not in roles:
+				self.log_failure ("Device role %s of device %s doesn't exist!" % (dev['role'], dev['name']))
+				missing = True
+			if dev['platform'] and dev['platform'] not in platforms:
+				self.log_warning ("Platform %s of device %s doesn't exist, leaving it empty." % (dev['platform'], dev['name']))
+
+		if missing:
+			return None
+
+		return dev_types, roles, platforms
+
+	def clone_devices (self, snapshot, site, rack, remap, refs):
+		names = [remap.device_name (dev['name']) for dev in snapshot['devices']]
+		devices = {dev.name : dev for dev in Device.objects.filter (name__in = names)}
+		for name in devices:
+			self.log_info ("Device %s already present, carrying on." % name)
+
+		dev_types, roles, platforms = refs
+
+		# Find free rack positions for missing devices (top down), keeping the one
+		# from the snapshot if it's free, taking existing equipment into account.
+		units = load_rack_units ([rack])[rack.id]
+		placement = {}
+		racked = [dev for dev in snapshot['devices'] if dev['rack'] and dev['position'] is not None and remap.device_name (dev['name']) not in devices]
+		for dev in sorted (racked, key = lambda dev: -dev['position']):
+			name = remap.device_name (dev['name'])
+			dev_type = dev_types[tuple (dev['type'])]
+			height = float (dev_type.u_height)
+			face = dev['face'] or DeviceFaceChoices.FACE_FRONT
+
+			position = dev['position']
+			if not units.is_free (position, height, face, dev_type.is_full_depth):
+				position = units.find_free (height, face, dev_type.is_full_depth)
+				if position is None:
+					self.log_failure ("Can't place device %s in rack %s: No free slot for a %sU device left in rack." % (name, rack, dev_type.u_height))
+					raise RackFullError ("No free slot for a %sU device left in rack." % dev_type.u_height)
+
+				self.log_info ("U%s in rack %s is occupied, picked position U%s for %s" % (dev['position'], rack, position, name))
+
+			units.occupy (position, height, face, dev_type.is_full_depth)
+			placement[name] = (position, face)
+
+		# Create missing devices in batches per DeviceType
+		new_devices = {}
+		for dev in snapshot['devices']:
+			name = remap.device_name (dev['name'])
+			if name in devices:
+				continue
+
+			position, face = placement.get (name, (None, ""))
+			dev_type = dev_types[tuple (dev['type'])]
+			new_devices.setdefault (dev_type.pk, []).append (Device (
+				device_type = dev_type,
+				device_role = roles[dev['role']],
+				platform = platforms.get (dev['platform']),
+				name = name,
+				asset_tag = dev['asset_tag'] if remap.restore else None,
+				serial = dev['serial'] if remap.restore else "",
+				status = dev['status'],
+				site = site,
+				rack = rack if dev['rack'] else None,
+				position = position,
+				face = face,
+			))
+
+		for batch in new_devices.values ():
+			for device in bulk_create_devices (batch):
+				devices[device.name] = device
+				self.log_success ("Created device %s" % device)
+
+		return devices
+
+	def clone_ports (self, snapshot, devices, remap):
+		existing = set (RearPort.objects.filter (device__in = devices.values ()).values_list ('device_id', 'name'))
+		new_rear_ports = bulk_create (RearPort, [
+			RearPort (device = devices[remap.device_name (dev)], name = name, type = port_type, positions = positions)
+			for dev, name, port_type, positions in snapshot['rear_ports']
+			if (devices[remap.device_name (dev)].pk, name) not in existing
+		])
+
+		rear_ports = {(rp.device_id, rp.name) : rp for rp in RearPort.objects.filter (device__in = devices.values ())}
+		existing = set (FrontPort.objects.filter (device__in = devices.values ()).values_list ('device_id', 'name'))
+		new_front_ports = bulk_create (FrontPort, [
+			FrontPort (
+				device = devices[remap.device_name (dev)],
+				name = name,
+				type = port_type,
+				rear_port = rear_ports[(devices[remap.device_name (dev)].pk, rear_name)],
+				rear_port_position = rear_pos,
+			)
+			for dev, name, port_type, rear_name, rear_pos in snapshot['front_ports']
+			if (devices[remap.device_name (dev)].pk, name) not in existing
+		])
+
+		self.log_success ("Created %d rear and %d front ports" % (len (new_rear_ports), len (new_front_ports)))
+
+		return rear_ports, {(fp.device_id, fp.name) : fp for fp in FrontPort.objects.filter (device__in = devices.values ())}
+
+	def clone_interfaces (self, snapshot, devices, vlan, remap):
+		ifaces = {(iface.device_id, iface.name) : iface for iface in Interface.objects.filter (device__in = devices.values ())}
+		vlans = {vlan.vid : vlan}
+
+		# Create missing (virtual) interfaces first, LAGs and parents are set up below
+		new_ifaces = bulk_create (Interface, [
+			Interface (device = devices[remap.device_name (dev)], name = remap.iface_name (name), type = iface_type)
+			for dev, name, iface_type, *rest in snapshot['interfaces']
+			if (devices[remap.device_name (dev)].pk, remap.iface_name (name)) not in ifaces
+		])
+		ifaces.update ({(iface.device_id, iface.name) : iface for iface in new_ifaces})
+
+		fields = ['enabled', 'mode', 'untagged_vlan', 'lag', 'parent', 'description']
+		changed = []
+		for dev, name, iface_type, enabled, mode, vid, lag, parent, description in snapshot['interfaces']:
+			dev_id = devices[remap.device_name (dev)].pk
+			iface = ifaces[(dev_id, remap.iface_name (name))]
+
+			# Only the mgmt VLAN is part of the snapshot
+			untagged_vlan = vlans.get (remap.vid (vid)) if vid else None
+			if vid and untagged_vlan is None:
+				self.log_warning ("Untagged VLAN %s of interface %s of %s is not the mgmt VLAN, not setting it." % (vid, iface.name, remap.device_name (dev)))
+
+			values = [
+				enabled,
+				mode,
+				untagged_vlan,
+				ifaces[(dev_id, lag)] if lag else None,
+				ifaces[(dev_id, remap.iface_name (parent))] if parent else None,
+				description,
+			]
+			if [getattr (iface, field) for field in fields] == values:
+				continue
+
+			iface.snapshot ()
+			for field, value in zip (fields, values):
+				setattr (iface, field, value)
+			changed.append (iface)
+
+		bulk_update (Interface, changed, fields)
+		self.log_success ("Created %d and configured %d interfaces" % (len (new_ifaces), len (changed)))
+
+		return ifaces
+
+	def clone_cables (self, snapshot, devices, ports, remap):
+		created = 0
+		for a_terms, b_terms, status in snapshot['cables']:
+			ends = []
+			for terms in (a_terms, b_terms):
+				ends.append ([ports[kind].get ((devices[remap.device_name (dev)].pk, remap.iface_name (name))) for dev, kind, name in terms])
+
+			if None in ends[0] + ends[1]:
+				self.log_warning ("Port of cable %s <-> %s missing, skipping." % (a_terms, b_terms))
+				continue
+
+			if any (term.cable_id for term in ends[0] + ends[1]):
+				continue
+
+			cable = Cable (
+				a_terminations = ends[0],
+				b_terminations = ends[1],
+				status = status
+			)
+			cable.save ()
+			created += 1
+
+		self.log_success ("Created %d cables" % created)
+
+	def clone_ips (self, snapshot, devices, ifaces, remap):
+		ips = []
+		for address, status, dev, iface, primary in snapshot['ips']:
+			new_address = remap.address (address)
+			if new_address is None:
+				self.log_warning ("Can't remap IP %s of %s %s to the new site, skipping." % (address, dev, iface))
+				continue
+			ips.append ((new_address, status, dev, iface, primary))
+
+		# IPs are compared by their host part only, the mask may differ
+		host = lambda address: address.split ('/')[0]
+		existing = {str (addr.address.ip) : addr for addr in IPAddress.objects.filter (address__net_in = [host (ip[0]) for ip in ips])}
+
+		new_ips = []
+		for address, status, dev, iface, primary in ips:
+			if host (address) in existing:
+				self.log_info ("IP %s already present, carrying on." % address)
+				continue
+
+			ip = IPAddress (
+				address = address,
+				status = status,
+				assigned_object = ifaces[(devices[remap.device_name (dev)].pk, remap.iface_name (iface))],
+			)
+			new_ips.append (ip)
+			existing[host (address)] = ip
+
+		bulk_create (IPAddress, new_ips)
+
+		# Primary IPs
+		changed = {}
+		for address, status, dev, iface, primary in ips:
+			ip = existing[host (address)]
+			device = devices[remap.device_name (dev)]
+			field = 'primary_ip%d' % ipaddress.ip_interface (address).version
+			if not primary or getattr (device, '%s_id' % field) == ip.pk:
+				continue
+
+			if device.pk not in changed:
+				device.snapshot ()
+			setattr (device, field, ip)
+			changed[device.pk] = device
+
+		bulk_update (Device, changed.values (), ['primary_ip4', 'primary_ip6'])
+		self.log_success ("Created %d IPs, set primary IPs of %d devices" % (len (new_ips), len (changed)))
+
+	def run (self, data, commit):
+		site = data['site']
+
+		try:
+			snapshot = json.loads (data['snapshot'])
+		except ValueError as e:
+			self.log_failure ("Can't parse snapshot: %s" % e)
+			return "D'oh!"
+
+		if snapshot.get ('version') != SNAPSHOT_VERSION:
+			self.log_failure ("Unsupported snapshot version %s, expected %s!" % (snapshot.get ('version'), SNAPSHOT_VERSION))
+			return "D'oh!"
+
+		refs = self.load_references (snapshot)
+		if refs is None:
+			return "D'oh!"
+
+		# Snapshots taken before tunnels were left out may still contain them
+		skipped = drop_tunnel_ifaces (snapshot)
+		if skipped:
+			self.log_warning ("Skipping %d Wireguard tunnel interfaces and their IPs, set up tunnels with the Wireguard scripts." % skipped)
+
+		# Restore in place, or allocate new mgmt and node IDs for the clone
+		if snapshot['site'] == site.slug:
+			mgmt_id = snapshot['mgmt_id']
+			node_id = snapshot['node_id']
+			if mgmt_id is None:
+				self.log_failure ("Snapshot of POP %s doesn't contain a mgmt VLAN, can't restore it in place!" % site)
+				return "D'oh!"
+
+			self.log_info ("Restoring POP %s in place" % site)
+		else:
+			mgmt_id = self.find_mgmt_id (site)
+			node_id = data['node_id']
+			if node_id is None:
+				node_id = self.allocate_node_ids ()[0]
+			elif not self.load_node_ids ().is_free (node_id):
+				self.log_failure ("Node ID %s is invalid or its loopback IPs are already in use!" % node_id)
+				return "D'oh!"
+
+		remap = SnapshotRemapper (snapshot, site, mgmt_id, node_id)
+
+		vlan = self.create_mgmt_vlan (site, mgmt_id)
+		self.create_mgmt_prefix (site, mgmt_id, vlan)
+		rack = self.create_rack (site, snapshot['rack']['name'], snapshot['rack']['u_height'])
+
+		devices = self.clone_devices (snapshot, site, rack, remap, refs)
+		rear_ports, front_ports = self.clone_ports (snapshot, devices, remap)
+		ifaces = self.clone_interfaces (snapshot, devices, vlan, remap)
+
+		ports = {
+			'interface' : ifaces,
+			'rearport' : rear_ports,
+			'frontport' : front_ports,
+		}
+		self.clone_cables (snapshot, devices, ports, remap)
+		self.clone_ips (snapshot, devices, ifaces, remap)
@@ -3,38 +3,54 @@
 # Maximilian Wilhelm <max@sdn.clinic>
 # -- Sat, 14 May 2022 22:14:47 +0200
 
-from django.utils.text import slugify
+import datetime
+import json
 
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import Max, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 
-from dcim.choices import *
+
+from dcim.choices import InterfaceTypeChoices
 from dcim.models import Device
 from dcim.models.device_components import Interface
 
 from extras.models import Tag
-from extras.scripts import *
 
-from ipam.choices import *
+try:
+	from core.models import ObjectChange
+except ImportError:
+	from extras.models import ObjectChange
+from extras.scripts import BooleanVar, ObjectVar, Script, StringVar, TextVar
+
+from ipam.choices import PrefixStatusChoices
 from ipam.models import IPAddress, Prefix, Role, VRF
 
 from virtualization.models import VirtualMachine, VMInterface
 
-import netaddr
-
-prefix_length_by_af = {
-	4: 31,
-	6: 64,
-}
-
-ip_mask_by_af = {
-	4: 31,
-	6: 126,
-}
-
-infra_suffix = ".in.ffho.net"
+from netbox.config import get_config
+
+from scriptutils.capacity import get_prefix_pool_usage, get_usage_warning
+from scriptutils.chunked import enqueue_chunks
+from scriptutils.locks import lock_prefix_allocation
+from scriptutils.prefixes import first_free_prefix, prefix_ranges
+from scriptutils.refcache import ReferenceCache
+from scriptutils.wgtunnel import (
+	IfaceNameError,
+	PREFIX_ROLE_SLUG_OOBM,
+	PREFIX_ROLE_SLUG_REGULAR,
+	VRF_NAME_OOBM,
+	get_iface_name,
+	get_prefix_desc,
+	ip_mask_by_af,
+	pick_iface_name,
+	prefix_length_by_af,
+	wg_key_valid,
+)
 
-PREFIX_ROLE_SLUG_REGULAR = "vpn-x-connect"
-PREFIX_ROLE_SLUG_OOBM = "vpn-oobm"
-VRF_NAME_OOBM = "vrf_oobm"
+import netaddr
 
 ################################################################################
 #                                 Helpers                                      #
@@ -43,24 +59,19 @@ VRF_NAME_OOBM = "vrf_oobm"
 class MyException (Exception): {}
 
 
-def get_prefix_desc (server, client):
-	server = server.replace (infra_suffix, "")
-	client = client.replace (infra_suffix, "")
-
-	return "%s <-> %s" % (server, client)
+# Nodes are passed to background jobs as (type, ID) tuples
+NODE_MODELS = {
+	'device' : Device,
+	'vm' : VirtualMachine,
+}
 
 
-def get_iface_name (node_name, tun):
-	prefix = "wg"
-	if tun['oobm']:
-		prefix = "oob"
+def node_ref (node):
+	return ('device' if type (node) == Device else 'vm', node.id)
 
-	node = node_name.replace (infra_suffix, "")
-	if_name = "%s-%s" % (prefix, node.replace ('.', '-'))
-	if len (if_name) > 15:
-		if_name = if_name[0:15]
 
-	return if_name
+def resolve_node_ref (ref):
+	return NODE_MODELS[ref[0]].objects.get (pk = ref[1])
 
 
 def node_has_wg_keys_set (node):
@@ -71,70 +82,117 @@ def node_has_wg_keys_set (node):
 		return False
 
 
-################################################################################
-#                              Script class                                    #
-################################################################################
+# Validate the Wireguard keys of all given nodes (Devices / VMs or node refs) at once.
+#
+# Only the local_context_data of the nodes is fetched from the database, with one
+# query for Devices and one for VMs.  Returns a list of all problems found, which
+# is empty if all nodes have a valid key pair and no public key is used twice.
+def validate_wg_keys (nodes):
+	ids = {node_type : set () for node_type in NODE_MODELS}
+	for node in nodes:
+		node_type, node_id = node if isinstance (node, tuple) else node_ref (node)
+		ids[node_type].add (node_id)
+
+	problems = []
+	pubkeys = {}
+	for node_type, model in NODE_MODELS.items ():
+		if not ids[node_type]:
+			continue
+
+		found = set ()
+		for node_id, name, ctx in model.objects.filter (pk__in = ids[node_type]).values_list ('pk', 'name', 'local_context_data'):
+			found.add (node_id)
+
+			wg = (ctx or {}).get ('wireguard')
+			if not isinstance (wg, dict) or not (wg.get ('privkey') and wg.get ('pubkey')):
+				problems.append ("Node %s does not have Wireguard keys configured in config context!" % name)
+				continue
 
-class AddWireguardTunnel (Script):
-	class Meta:
-		server_device = "Server (device)"
-		server_vm = "Server (VM)"
-		client_device = "Client (device)"
-		client_vm = "Client (VM)"
-		oobm = "Out of Band Mgmt tunnel"
-		field_order = ['server_device', 'server_vm', 'client_device', 'client_vm', 'oobm']
-		commit_default = False
+			for key in ['privkey', 'pubkey']:
+				if not wg_key_valid (wg[key]):
+					problems.append ("Node %s has an invalid Wireguard %s in config context!" % (name, key))
 
-	# Drop down for server device
-	server_device = ObjectVar (
-		model = Device,
-		required = False,
-		query_params = {
-			"platform" : 'linux',
-		},
-		description = "Server end (if device)"
-	)
+			pubkeys.setdefault (wg['pubkey'], []).append (name)
 
-	# Drop down for server VM
-	server_vm = ObjectVar (
-		model = VirtualMachine,
-		required = False,
-		query_params = {
-			"platform" : 'linux',
-		},
-		description = "Server end (if VM)"
-	)
+		for node_id in sorted (ids[node_type] - found):
+			problems.append ("Node %s #%s does not exist!" % (node_type, node_id))
 
-	# Drop down for client device
-	client_device = ObjectVar (
-		model = Device,
-		required = False,
-		query_params = {
-			"platform" : 'linux',
-		},
-		description = "Client end (if device)"
-	)
+	for pubkey, names in pubkeys.items ():
+		if len (names) > 1:
+			problems.append ("Wireguard pubkey %s is used by multiple nodes: %s" % (pubkey, ", ".join (sorted (names))))
 
-	# Drop down for client VM
-	client_vm = ObjectVar (
-		model = VirtualMachine,
-		required = False,
-		query_params = {
-			"platform" : 'linux',
-		},
-		description = "Client end (if VM)"
-	)
+	return problems
 
-	# Should this be a tunnel for Out-of-band management?
-	oobm = BooleanVar (
-		description = "Tunnel should be used for OOBM access to client device"
-	)
+
+# Collision free interface names for tunnels.
+#
+# get_iface_name () truncates names to 15 characters, so peers with long names
+# sharing a common prefix end up with the same interface name.  The index loads
+# the names and peer links of all interfaces of the given nodes with one query
+# per model and hands out names as follows:
+#
+#  * an interface already linked to the peer keeps its name (stable on re-runs)
+#  * if the name didn't need truncation, it's used as is
+#  * otherwise the truncated name ends with a hash of the peer name, which only
+#    depends on the peer, so parallel jobs never pick the same name.
+#
+# Names handed out are recorded, so one index can be used for a whole batch.
+class InterfaceNameIndex (object):
+	def __init__ (self, nodes):
+		self.names = {}
+		self.linked = {}
+
+		ids = {node_type : set () for node_type in NODE_MODELS}
+		for node in nodes:
+			node_type, node_id = node_ref (node)
+			ids[node_type].add (node_id)
+			self.names.setdefault ((node_type, node_id), {})
+
+		queries = [
+			('device', Interface.objects.filter (device_id__in = ids['device']).values_list ('device_id', 'name', 'custom_field_data')),
+			('vm', VMInterface.objects.filter (virtual_machine_id__in = ids['vm']).values_list ('virtual_machine_id', 'name', 'custom_field_data')),
+		]
+
+		for node_type, query in queries:
+			if not ids[node_type]:
+				continue
+
+			for node_id, name, cf_data in query:
+				peer = None
+				for peer_type in NODE_MODELS:
+					peer_id = (cf_data or {}).get ('wg_peer_%s' % peer_type)
+					if peer_id:
+						peer = (peer_type, peer_id)
+						self.linked[((node_type, node_id), peer, name.split ('-', 1)[0])] = name
+
+				self.names[(node_type, node_id)][name] = peer
+
+	def get_name (self, node, peer, oobm):
+		node_key = node_ref (node)
+		peer_key = node_ref (peer)
+		prefix = "oob" if oobm else "wg"
+
+		if_name = self.linked.get ((node_key, peer_key, prefix))
+		if if_name:
+			return if_name
+
+		names = self.names.setdefault (node_key, {})
+		try:
+			if_name = pick_iface_name (names, peer_key, peer.name, oobm)
+		except IfaceNameError as e:
+			raise MyException ("%s (on %s)" % (e, node.name))
+
+		names[if_name] = peer_key
+		self.linked[(node_key, peer_key, prefix)] = if_name
+
+		return if_name
 
 
 ################################################################################
-#                                 Methods                                      #
+#                           Tunnel provisioning                                #
 ################################################################################
 
+class WireguardTunnelProvisioner (ReferenceCache):
 	def verify_wg_keys_present (self, server, client):
 		err = False
 		if not node_has_wg_keys_set (server):
@@ -155,10 +213,14 @@ class AddWireguardTunnel (Script):
 
 	def get_tunnel_prefix (self, server, client, af, oobm):
 		pfx_role_slug = PREFIX_ROLE_SLUG_OOBM if oobm else PREFIX_ROLE_SLUG_REGULAR
-		pfx_role = Role.objects.get (slug = pfx_role_slug)
+		pfx_role = self.get_ref (Role, slug = pfx_role_slug)
 		desired_plen = prefix_length_by_af[af]
 		pfx_desc = get_prefix_desc (server.name, client.name)
 
+		# Held until the end of the transaction, so tunnels set up in parallel
+		# (background jobs, API calls) don't pick the same prefix.
+		lock_prefix_allocation ()
+
 		try:
 			prefixes = Prefix.objects.filter (
 				role = pfx_role,
@@ -186,21 +248,25 @@ class AddWireguardTunnel (Script):
 
 			msg = "Found IPv%s container %s, " % (af, pfx.prefix)
 
-			# Get a list of all availble sub prefixes (type IPNetwork)
-			avail_pfxs = pfx.get_available_prefixes ().iter_cidrs ()
-			for apfx in avail_pfxs:
-				if apfx.prefixlen <= desired_plen:
-					new_prefix = Prefix (
-						prefix = "%s/%s" % (apfx.network, desired_plen),
-						role = pfx_role,
-						description = pfx_desc
-					)
+			# Find the first gap big enough for the transfer network based on the
+			# integer ranges of all children, instead of building an IPSet via
+			# get_available_prefixes (), which is slow for sparse IPv6 containers.
+			container = netaddr.IPNetwork (pfx.prefix)
+			children = prefix_ranges (pfx.get_child_prefixes ().values_list ('prefix', flat = True))
+			first = first_free_prefix (container.first, container.last, children, desired_plen, af)
+			if first is not None:
+				new_prefix = Prefix (
+					prefix = "%s/%s" % (netaddr.IPAddress (first, af), desired_plen),
+					role = pfx_role,
+					description = pfx_desc
+				)
 
-					new_prefix.save ()
-					msg += "picking %s for new tunnel." % new_prefix
-					self.log_success (msg)
+				new_prefix.save ()
+				msg += "picking %s for new tunnel." % new_prefix
+				self.log_success (msg)
 
-					return new_prefix
+				self.__dict__.setdefault ('_allocated_pools', set ()).add ((pfx_role_slug, af, desired_plen))
+				return new_prefix
 
 			msg += "but no free prefixes available *sniff*"
 			self.log_info (msg)
@@ -208,6 +274,15 @@ class AddWireguardTunnel (Script):
 		raise MyException ("Can't find IPv%s prefix to carve transfer network from, dying of shame." % af)
 
 
+	# Warn about address pools running low, which prefixes have been allocated from
+	# within this run.  Done once at the end, as it scans the whole pool.
+	def check_pool_usage (self):
+		for role_slug, af, plen in sorted (self.__dict__.pop ('_allocated_pools', ())):
+			warning = get_usage_warning (get_prefix_pool_usage (role_slug, af, plen))
+			if warning:
+				self.log_warning (warning)
+
+
 	# TODO: Query interfaces only by object + if_name and validate Wireguard Tag + type:Virtual (for devices) here
 	def validate_interface (self, iface, node, peer):
 		# Custom field name relevant for peer
@@ -236,15 +311,14 @@ class AddWireguardTunnel (Script):
 		self.log_info ("Found interface '%s' on node '%s' linked to peer '%s', carrying on." % (iface, node.name, peer.name))
 
 
-	def create_interface (self, tun, node, peer):
+	def create_interface (self, tun, node, peer, if_name = None):
 		peer_type = 'device' if type (peer) == Device else 'vm'
 		cf_name = 'wg_peer_%s' % peer_type
-		if_name = get_iface_name (peer.name, tun)
+		if not if_name:
+			if_name = get_iface_name (peer.name, tun)
 
 		try:
-			wg_tag = Tag.objects.get (
-				name = "Wireguard"
-			)
+			wg_tag = self.get_ref (Tag, name = "Wireguard")
 		except Tag.DoesNotExist:
 			raise MyException ("Wiregurad tag doesn't exist, dying of shame.")
 
@@ -339,7 +413,7 @@ class AddWireguardTunnel (Script):
 
 	def set_interface_vrf(self, node, iface, vrf_name):
 		try:
-			vrf = VRF.objects.get(name=vrf_name)
+			vrf = self.get_ref(VRF, name=vrf_name)
 		except VRF.DoesNotExist:
 			raise MyException(f"VRF {vrf_name} does not exist, dying of shame!")
 
@@ -353,10 +427,14 @@ class AddWireguardTunnel (Script):
 		self.log_success(f"Assigned {iface.name} on {node.name} to VRF {vrf_name}.")
 
 
-	def configure_tunnel (self, server, client, oobm):
+	# names may be an InterfaceNameIndex shared by multiple tunnels
+	def configure_tunnel (self, server, client, oobm, names = None):
 		# Do the peers have Wireguard keys set in config context?
 		self.verify_wg_keys_present (server, client)
 
+		if names is None:
+			names = InterfaceNameIndex ([server, client])
+
 		tun = {
 			"server" : server,
 			"client" : client,
@@ -385,8 +463,8 @@ class AddWireguardTunnel (Script):
 		for af in [ 4, 6 ]:
 			tun['prefix'][af] = self.get_tunnel_prefix (server, client, af, oobm)
 
-		tun['iface']['server'] = self.create_interface (tun, server, client)
-		tun['iface']['client'] = self.create_interface (tun, client, server)
+		tun['iface']['server'] = self.create_interface (tun, server, client, names.get_name (server, client, oobm))
+		tun['iface']['client'] = self.create_interface (tun, client, server, names.get_name (client, server, oobm))
 		if oobm:
 			self.set_interface_vrf(client, tun['iface']['client'], VRF_NAME_OOBM)
 
@@ -395,6 +473,289 @@ class AddWireguardTunnel (Script):
 		return tun
 
 
+################################################################################
+#                             Tunnel delta feed                                #
+################################################################################
+
+# Interfaces of tunnels are identified by (node type, interface ID) tuples
+IFACE_MODELS = {
+	'device' : Interface,
+	'vm' : VMInterface,
+}
+
+IFACE_NODE_FIELD = {
+	'device' : 'device',
+	'vm' : 'virtual_machine',
+}
+
+# Change log entries are timestamped when the object is saved, not when the
+# transaction is committed, so changes of long running transactions may show
+# up with a time before the cursor returned by an earlier call.  Every call
+# looks back this far before the cursor, so these aren't missed.  As the feed
+# returns the current state of affected tunnels, reporting a tunnel again is
+# harmless.
+CURSOR_SAFETY_WINDOW = datetime.timedelta (hours = 1)
+
+
+def is_tunnel_iface_data (data):
+	if not data:
+		return False
+
+	cf_data = data.get ('custom_fields') or {}
+	return "Wireguard" in (data.get ('tags') or []) or any (cf_data.get ('wg_peer_%s' % t) for t in NODE_MODELS)
+
+
+def get_wg_pubkey (ctx):
+	try:
+		return ctx['wireguard']['pubkey']
+	except (KeyError, TypeError):
+		return None
+
+
+# Collect the tunnel interfaces affected by change log entries after since
+# (minus the safety window).
+#
+# Returns the set of affected interfaces, a dict of deleted tunnel interfaces
+# mapping to their (node ref, name), and the time of the latest change seen.
+def get_changed_tunnel_ifaces (since):
+	cts = ContentType.objects.get_for_models (Interface, VMInterface, IPAddress, Prefix, Device, VirtualMachine)
+	iface_types = {cts[Interface].pk : 'device', cts[VMInterface].pk : 'vm'}
+	node_types = {cts[Device].pk : 'device', cts[VirtualMachine].pk : 'vm'}
+
+	changes = ObjectChange.objects.filter (
+		time__gt = since - CURSOR_SAFETY_WINDOW,
+		changed_object_type__in = cts.values (),
+	).order_by ('time').values_list ('time', 'action', 'changed_object_type_id', 'changed_object_id', 'prechange_data', 'postchange_data')
+
+	ifaces = set ()
+	deleted = {}
+	prefixes = set ()
+	nodes = set ()
+	last = None
+
+	for time, action, type_id, obj_id, pre, post in changes:
+		last = time
+
+		if type_id in iface_types:
+			key = (iface_types[type_id], obj_id)
+			if not (is_tunnel_iface_data (pre) or is_tunnel_iface_data (post)):
+				continue
+
+			if action == 'delete':
+				deleted[key] = ((key[0], pre.get (IFACE_NODE_FIELD[key[0]])), pre.get ('name'))
+				ifaces.discard (key)
+			else:
+				ifaces.add (key)
+				deleted.pop (key, None)
+
+		elif type_id == cts[IPAddress].pk:
+			for data in (pre, post):
+				if data and data.get ('assigned_object_type') in iface_types:
+					ifaces.add ((iface_types[data['assigned_object_type']], data['assigned_object_id']))
+
+		elif type_id == cts[Prefix].pk:
+			for data in (pre, post):
+				if data and data.get ('prefix'):
+					prefixes.add (data['prefix'])
+
+		elif type_id in node_types:
+			if get_wg_pubkey ((pre or {}).get ('local_context_data')) != get_wg_pubkey ((post or {}).get ('local_context_data')):
+				nodes.add ((node_types[type_id], obj_id))
+
+	# IPs within changed transfer networks belong to affected tunnels
+	if prefixes:
+		query = Q ()
+		for pfx in prefixes:
+			query |= Q (address__net_host_contained = pfx)
+
+		for type_id, obj_id in IPAddress.objects.filter (query, assigned_object_type_id__in = iface_types).values_list ('assigned_object_type_id', 'assigned_object_id'):
+			ifaces.add ((iface_types[type_id], obj_id))
+
+	# Tunnels of nodes with changed keys, on the node itself and on its peers
+	for node_type, model in IFACE_MODELS.items ():
+		if not nodes:
+			break
+
+		query = Q (**{'%s_id__in' % IFACE_NODE_FIELD[node_type] : [node_id for t, node_id in nodes if t == node_type]})
+		for peer_type in NODE_MODELS:
+			query |= Q (**{'custom_field_data__wg_peer_%s__in' % peer_type : [node_id for t, node_id in nodes if t == peer_type]})
+
+		for iface_id in model.objects.filter (query, tags__name = "Wireguard").values_list ('pk', flat = True):
+			ifaces.add ((node_type, iface_id))
+
+	return ifaces, deleted, last
+
+
+# Return the current state of the given tunnel interfaces, as dict mapping the
+# interface refs to dicts.  Interfaces which don't exist (anymore) or aren't
+# tunnel interfaces are omitted.
+def get_tunnel_state (ifaces):
+	cts = ContentType.objects.get_for_models (Interface, VMInterface)
+	state = {}
+
+	for node_type, model in IFACE_MODELS.items ():
+		iface_ids = [iface_id for t, iface_id in ifaces if t == node_type]
+		if not iface_ids:
+			continue
+
+		node_field = IFACE_NODE_FIELD[node_type]
+		rows = model.objects.filter (pk__in = iface_ids, tags__name = "Wireguard").values_list ('pk', node_field, '%s__name' % node_field, 'name', 'custom_field_data', 'vrf__name')
+
+		ips = {}
+		for iface_id, address in IPAddress.objects.filter (assigned_object_type = cts[model], assigned_object_id__in = iface_ids).values_list ('assigned_object_id', 'address'):
+			ips.setdefault (iface_id, []).append (str (address))
+
+		rows = list (rows)
+		node_refs = {(node_type, row[1]) for row in rows}
+		for row in rows:
+			for peer_type in NODE_MODELS:
+				peer_id = (row[4] or {}).get ('wg_peer_%s' % peer_type)
+				if peer_id:
+					node_refs.add ((peer_type, peer_id))
+
+		nodes = {}
+		for t, node_model in NODE_MODELS.items ():
+			ids = [node_id for nt, node_id in node_refs if nt == t]
+			for node_id, name, ctx in node_model.objects.filter (pk__in = ids).values_list ('pk', 'name', 'local_context_data'):
+				nodes[(t, node_id)] = (name, get_wg_pubkey (ctx))
+
+		for iface_id, node_id, node_name, name, cf_data, vrf in rows:
+			peer = (None, None)
+			for peer_type in NODE_MODELS:
+				peer_id = (cf_data or {}).get ('wg_peer_%s' % peer_type)
+				if peer_id:
+					peer = nodes.get ((peer_type, peer_id), peer)
+
+			state[(node_type, iface_id)] = {
+				'node' : node_name,
+				'interface' : name,
+				'pubkey' : nodes.get ((node_type, node_id), (None, None))[1],
+				'peer' : peer[0],
+				'peer_pubkey' : peer[1],
+				'vrf' : vrf,
+				'ips' : sorted (ips.get (iface_id, [])),
+			}
+
+	return state
+
+
+# Return True if change log entries after since may have been removed already
+def changes_expired (since):
+	retention = getattr (get_config (), 'CHANGELOG_RETENTION', None)
+	if not retention:
+		return False
+
+	return since - CURSOR_SAFETY_WINDOW < timezone.now () - datetime.timedelta (days = retention)
+
+
+# Delta of all tunnels changed after the given cursor (a datetime), including deletions.
+#
+# Returns a dict with the tunnels changed, the ones deleted, and the cursor to pass
+# in on the next call.  Without a cursor, or if the change log doesn't cover the
+# time since the cursor anymore, the full state of all tunnels is returned and
+# "full" is set, in which case consumers should drop all tunnels not returned.
+def get_tunnel_delta (since = None):
+	full = since is None or changes_expired (since)
+
+	if full:
+		last = ObjectChange.objects.aggregate (last = Max ('time'))['last']
+		ifaces = set ()
+		for node_type, model in IFACE_MODELS.items ():
+			ifaces.update ((node_type, pk) for pk in model.objects.filter (tags__name = "Wireguard").values_list ('pk', flat = True))
+		deleted = {}
+	else:
+		ifaces, deleted, last = get_changed_tunnel_ifaces (since)
+
+		# Changes within the safety window only must not move the cursor back
+		if last is None or last < since:
+			last = since
+
+	changed = get_tunnel_state (ifaces)
+
+	# Interfaces which aren't tunnel interfaces anymore are gone for consumers, too
+	for node_type, model in IFACE_MODELS.items ():
+		node_field = IFACE_NODE_FIELD[node_type]
+		ids = [iface_id for t, iface_id in ifaces - set (changed) if t == node_type]
+		for iface_id, node_id, name in model.objects.filter (pk__in = ids).values_list ('pk', node_field, 'name'):
+			deleted[(node_type, iface_id)] = ((node_type, node_id), name)
+
+	node_names = {}
+	for node_type, model in NODE_MODELS.items ():
+		ids = [node[1] for node, name in deleted.values () if node[0] == node_type]
+		for node_id, name in model.objects.filter (pk__in = ids).values_list ('pk', 'name'):
+			node_names[(node_type, node_id)] = name
+
+	return {
+		'cursor' : (last or timezone.now ()).isoformat (),
+		'full' : full,
+		'changed' : sorted (changed.values (), key = lambda t: (t['node'], t['interface'])),
+		'deleted' : sorted (
+			({'node' : node_names.get (node, "%s #%s" % node), 'interface' : name} for node, name in deleted.values ()),
+			key = lambda t: (t['node'], t['interface'])
+		),
+	}
+
+
+################################################################################
+#                              Script classes                                  #
+################################################################################
+
+class AddWireguardTunnel (WireguardTunnelProvisioner, Script):
+	class Meta:
+		server_device = "Server (device)"
+		server_vm = "Server (VM)"
+		client_device = "Client (device)"
+		client_vm = "Client (VM)"
+		oobm = "Out of Band Mgmt tunnel"
+		field_order = ['server_device', 'server_vm', 'client_device', 'client_vm', 'oobm']
+		commit_default = False
+
+	# Drop down for server device
+	server_device = ObjectVar (
+		model = Device,
+		required = False,
+		query_params = {
+			"platform" : 'linux',
+		},
+		description = "Server end (if device)"
+	)
+
+	# Drop down for server VM
+	server_vm = ObjectVar (
+		model = VirtualMachine,
+		required = False,
+		query_params = {
+			"platform" : 'linux',
+		},
+		description = "Server end (if VM)"
+	)
+
+	# Drop down for client device
+	client_device = ObjectVar (
+		model = Device,
+		required = False,
+		query_params = {
+			"platform" : 'linux',
+		},
+		description = "Client end (if device)"
+	)
+
+	# Drop down for client VM
+	client_vm = ObjectVar (
+		model = VirtualMachine,
+		required = False,
+		query_params = {
+			"platform" : 'linux',
+		},
+		description = "Client end (if VM)"
+	)
+
+	# Should this be a tunnel for Out-of-band management?
+	oobm = BooleanVar (
+		description = "Tunnel should be used for OOBM access to client device"
+	)
+
+
 	def run (self, data, commit):
 		server_device = data['server_device']
 		server_vm = data['server_vm']
@@ -424,3 +785,121 @@ class AddWireguardTunnel (Script):
 		except MyException as m:
 			return m
 
+		self.check_pool_usage ()
+
+
+class AddWireguardTunnels (WireguardTunnelProvisioner, Script):
+	class Meta:
+		name = "Add Wireguard tunnels (batch)"
+		description = "Provision many Wireguard tunnels, optionally in background jobs"
+		field_order = ['tunnels', 'background']
+		commit_default = False
+
+	tunnels = TextVar (
+		description = "One tunnel per line: &lt;server&gt; &lt;client&gt; [oobm], with server and client being Device or VM names"
+	)
+
+	background = BooleanVar (
+		description = "Provision every tunnel in its own background job, in parallel on all workers"
+	)
+
+	def resolve_node (self, name):
+		nodes = list (Device.objects.filter (name = name)) + list (VirtualMachine.objects.filter (name = name))
+		if len (nodes) != 1:
+			raise MyException ("Node name '%s' matches %d Devices/VMs, need exactly one!" % (name, len (nodes)))
+
+		return nodes[0]
+
+	def parse_tunnels (self, text):
+		tunnels = []
+		for line in text.splitlines ():
+			fields = line.split ()
+			if not fields or fields[0].startswith ('#'):
+				continue
+
+			if len (fields) not in (2, 3) or (len (fields) == 3 and fields[2] != 'oobm'):
+				raise MyException ("Invalid tunnel line '%s', expected '<server> <client> [oobm]'." % line)
+
+			tunnels.append ((self.resolve_node (fields[0]), self.resolve_node (fields[1]), len (fields) == 3))
+
+		return tunnels
+
+	# Entry point for background jobs, chunk is a list of (server ref, client ref, oobm) tuples
+	def configure_tunnel_chunk (self, chunk):
+		tunnels = [(resolve_node_ref (server_ref), resolve_node_ref (client_ref), oobm) for server_ref, client_ref, oobm in chunk]
+		names = InterfaceNameIndex ([node for tun in tunnels for node in tun[:2]])
+
+		for server, client, oobm in tunnels:
+			self.configure_tunnel (server, client, oobm, names)
+
+		self.check_pool_usage ()
+
+	def run (self, data, commit):
+		try:
+			tunnels = self.parse_tunnels (data['tunnels'])
+		except MyException as m:
+			return m
+
+		# Check all keys before touching anything
+		problems = validate_wg_keys ([node for tun in tunnels for node in tun[:2]])
+		if problems:
+			for problem in problems:
+				self.log_failure (problem)
+
+			return "Please configure valid Wireguard public and private keys in nodes config context."
+
+		if data['background']:
+			chunk_list = [[(node_ref (server), node_ref (client), oobm)] for server, client, oobm in tunnels]
+			names = {node_ref (node) : node.name for tun in tunnels for node in tun[:2]}
+
+			collector, jobs = enqueue_chunks (self, 'configure_tunnel_chunk', chunk_list, commit,
+				label_fn = lambda chunk: get_prefix_desc (names[chunk[0][0]], names[chunk[0][1]]))
+
+			self.log_success ("Enqueued %d background jobs, their results will be added to this job when done (collector job %s)." % (len (jobs), collector.id))
+			return
+
+		names = InterfaceNameIndex ([node for tun in tunnels for node in tun[:2]])
+
+		failed = 0
+		for server, client, oobm in tunnels:
+			try:
+				# Don't leave half provisioned tunnels behind
+				with transaction.atomic ():
+					self.configure_tunnel (server, client, oobm, names)
+			except MyException as m:
+				self.log_failure ("Failed to set up tunnel %s: %s" % (get_prefix_desc (server.name, client.name), m))
+				failed += 1
+
+		self.check_pool_usage ()
+		self.log_info ("Set up %d tunnels, %d failed." % (len (tunnels) - failed, failed))
+
+
+class WireguardTunnelDelta (Script):
+	class Meta:
+		name = "Wireguard tunnel delta"
+		description = "Return Wireguard tunnels changed since a given point in time as JSON"
+		commit_default = False
+
+	since = StringVar (
+		description = "Cursor returned by the last run (ISO 8601 timestamp), leave empty for full state",
+		required = False
+	)
+
+	def run (self, data, commit):
+		since = None
+		if data.get ('since'):
+			since = parse_datetime (data['since'])
+			if since is None:
+				self.log_failure ("Invalid cursor '%s', expected ISO 8601 timestamp!" % data['since'])
+				return "D'oh!"
+
+			if timezone.is_naive (since):
+				since = timezone.make_aware (since)
+
+		delta = get_tunnel_delta (since)
+		if since and delta['full']:
+			self.log_warning ("Change log doesn't cover the time since %s anymore, returning full state." % since.isoformat ())
+
+		self.log_success ("%d tunnel interfaces changed, %d deleted, next cursor is %s" % (len (delta['changed']), len (delta['deleted']), delta['cursor']))
+
+		return json.dumps (delta, indent = 2)
@@ -0,0 +1,10 @@
+#
+# Standalone mode of the provisioning workflows, talking to the NetBox REST API
+# with an asyncio HTTP client instead of running within NetBox's script runner.
+#
+# Needs aiohttp and the scriptutils directory on the Python path, e.g. run
+#
+#   NETBOX_TOKEN=... python3 -m asyncclient --url https://netbox.example.org <command> ...
+#
+# from the root of this repository.
+#
@@ -0,0 +1,143 @@
+#!/usr/bin/python3
+
+#
+# Command line interface of the standalone provisioning mode.
+#
+#   python3 -m asyncclient --url URL connect-rear-ports DEV_A DEV_B [--connected]
+#   python3 -m asyncclient --url URL wireguard-tunnel SERVER CLIENT [--oobm]
+#   python3 -m asyncclient --url URL wireguard-tunnel --tunnels FILE
+#   python3 -m asyncclient --url URL provision-pop SITE ...
+#   python3 -m asyncclient mock-server [--seed FILE] [--port PORT]
+#
+# The API token is read from the NETBOX_TOKEN environment variable.
+#
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+
+from asyncclient.client import DEFAULT_CONCURRENCY, NetBoxAPIError, NetBoxClient
+from asyncclient.workflows import WorkflowError, add_wireguard_tunnel, connect_rear_ports, provision_pop
+
+
+# Parse tunnels given as "<server> <client> [oobm]", one per line
+def read_tunnels (path):
+	tunnels = []
+	with open (path) as fh:
+		for line in fh:
+			fields = line.split ()
+			if not fields or fields[0].startswith ('#'):
+				continue
+
+			if len (fields) not in (2, 3) or (len (fields) == 3 and fields[2] != 'oobm'):
+				raise WorkflowError ("Invalid tunnel line: %s" % line.strip ())
+
+			tunnels.append ((fields[0], fields[1], len (fields) == 3))
+
+	return tunnels
+
+
+async def run_tunnels (client, tunnels):
+	results = await asyncio.gather (*[add_wireguard_tunnel (client, *tunnel) for tunnel in tunnels], return_exceptions = True)
+
+	failed = 0
+	for (server, peer, oobm), result in zip (tunnels, results):
+		if isinstance (result, Exception):
+			logging.error ("Tunnel %s <-> %s failed: %s", server, peer, result)
+			failed += 1
+
+	logging.info ("Set up %d tunnels, %d failed.", len (tunnels) - failed, failed)
+	return failed == 0
+
+
+async def run (args):
+	async with NetBoxClient (args.url, os.environ.get ('NETBOX_TOKEN', ''), args.concurrency) as client:
+		if args.command == 'connect-rear-ports':
+			await connect_rear_ports (client, args.device_a, args.device_b, args.connected)
+
+		elif args.command == 'wireguard-tunnel':
+			if args.tunnels:
+				return await run_tunnels (client, read_tunnels (args.tunnels))
+
+			if not (args.server and args.client):
+				raise WorkflowError ("Either server and client or --tunnels have to be given!")
+
+			await add_wireguard_tunnel (client, args.server, args.client, args.oobm)
+
+		elif args.command == 'provision-pop':
+			await provision_pop (client, args.site, args.rack_name, args.rack_units, args.bbr_model, args.panel_ports, args.pole_setup,
+				args.sw_asset_tag, args.sw_serial, args.bbr_asset_tag, args.bbr_serial, args.node_id)
+
+	return True
+
+
+def run_mock_server (args):
+	from aiohttp import web
+
+	from asyncclient.mockserver import MockNetBox
+
+	seed = None
+	if args.seed:
+		with open (args.seed) as fh:
+			seed = json.load (fh)
+
+	web.run_app (MockNetBox (seed).app, host = args.host, port = args.port)
+
+
+def main ():
+	parser = argparse.ArgumentParser (prog = "asyncclient", description = "Run provisioning workflows against the NetBox REST API")
+	parser.add_argument ('--url', help = "NetBox base URL", default = "http://localhost:8000")
+	parser.add_argument ('--concurrency', type = int, default = DEFAULT_CONCURRENCY, help = "Maximum number of requests in flight")
+	parser.add_argument ('--debug', action = 'store_true')
+	sub = parser.add_subparsers (dest = 'command', required = True)
+
+	p = sub.add_parser ('connect-rear-ports', help = "Connect all rear ports of two devices")
+	p.add_argument ('device_a')
+	p.add_argument ('device_b')
+	p.add_argument ('--connected', action = 'store_true', help = "Mark cables as connected (default: planned)")
+
+	p = sub.add_parser ('wireguard-tunnel', help = "Set up Wireguard tunnel(s)")
+	p.add_argument ('server', nargs = '?')
+	p.add_argument ('client', nargs = '?')
+	p.add_argument ('--oobm', action = 'store_true', help = "Tunnel is for OOBM")
+	p.add_argument ('--tunnels', help = "File with one '<server> <client> [oobm]' per line, set up concurrently")
+
+	p = sub.add_parser ('provision-pop', help = "Provision a backbone POP")
+	p.add_argument ('site', help = "Slug of the site")
+	p.add_argument ('--rack-name', default = "R1")
+	p.add_argument ('--rack-units', type = int, default = 9)
+	p.add_argument ('--bbr-model', required = True, help = "Model of the PCEngines APU")
+	p.add_argument ('--bbr-asset-tag', required = True)
+	p.add_argument ('--bbr-serial', required = True)
+	p.add_argument ('--sw-asset-tag', required = True)
+	p.add_argument ('--sw-serial', required = True)
+	p.add_argument ('--panel-ports', type = int, required = True)
+	p.add_argument ('--pole-setup', default = "", help = "Space separated list of <pole no>:<num_cables>")
+	p.add_argument ('--node-id', type = int, help = "Node ID of BBR (lowest free one if not given)")
+
+	p = sub.add_parser ('mock-server', help = "Run an in-memory mock of the NetBox API")
+	p.add_argument ('--seed', help = "JSON file with objects to load")
+	p.add_argument ('--host', default = "127.0.0.1")
+	p.add_argument ('--port', type = int, default = 8000)
+
+	args = parser.parse_args ()
+	logging.basicConfig (level = logging.DEBUG if args.debug else logging.INFO, format = "%(levelname)s %(message)s")
+
+	if args.command == 'mock-server':
+		run_mock_server (args)
+		return 0
+
+	try:
+		ok = asyncio.run (run (args))
+	except (NetBoxAPIError, WorkflowError) as e:
+		logging.error ("%s", e)
+		return 1
+
+	return 0 if ok else 1
+
+
+if __name__ == '__main__':
+	sys.exit (main ())
@@ -0,0 +1,163 @@
+#!/usr/bin/python3
+
+#
+# Minimal asyncio NetBox REST API client.
+#
+# All requests share one aiohttp session, so connections are pooled and kept
+# alive, and at most <concurrency> requests are in flight at any time, no matter
+# how many coroutines are issuing them.  Lists are fetched by loading the first
+# page and then all remaining pages concurrently.
+#
+
+import asyncio
+import json
+
+import aiohttp
+
+DEFAULT_CONCURRENCY = 8
+PAGE_SIZE = 1000
+REQUEST_TIMEOUT = 300
+
+
+class NetBoxAPIError (Exception):
+	def __init__ (self, status, method, path, body):
+		self.status = status
+		self.method = method
+		self.path = path
+		self.body = body
+
+		super ().__init__ ("%s %s failed with HTTP %s: %s" % (method, path, status, body))
+
+
+# Convert a dict of filters into a list of query parameters.  Lists are passed
+# as repeated parameters (which NetBox ORs), booleans the way NetBox expects them.
+def build_params (filters):
+	params = []
+	for key, values in filters.items ():
+		if not isinstance (values, (list, tuple, set)):
+			values = [values]
+
+		for value in values:
+			if value is None:
+				continue
+			if isinstance (value, bool):
+				value = "true" if value else "false"
+			params.append ((key, str (value)))
+
+	return params
+
+
+# Related objects are returned nested, but given as IDs on writes
+def obj_id (value):
+	if isinstance (value, dict):
+		return value.get ('id')
+
+	return value
+
+
+# Choice fields are returned as {"value" : ..., "label" : ...}
+def choice_value (value):
+	if isinstance (value, dict):
+		return value.get ('value')
+
+	return value
+
+
+class NetBoxClient (object):
+	def __init__ (self, url, token, concurrency = DEFAULT_CONCURRENCY, page_size = PAGE_SIZE):
+		self.api_url = "%s/api/" % url.rstrip ('/')
+		self.token = token
+		self.concurrency = concurrency
+		self.page_size = page_size
+
+		self.session = None
+		self.semaphore = None
+		self.lookups = {}
+
+	async def __aenter__ (self):
+		self.semaphore = asyncio.Semaphore (self.concurrency)
+		self.session = aiohttp.ClientSession (
+			connector = aiohttp.TCPConnector (limit = self.concurrency),
+			timeout = aiohttp.ClientTimeout (total = REQUEST_TIMEOUT),
+			headers = {
+				'Authorization' : "Token %s" % self.token,
+				'Accept' : 'application/json',
+			},
+		)
+
+		return self
+
+	async def __aexit__ (self, *exc):
+		await self.session.close ()
+
+	async def request (self, method, path, params = None, data = None):
+		async with self.semaphore:
+			async with self.session.request (method, self.api_url + path, params = build_params (params or {}), json = data) as resp:
+				body = await resp.text ()
+				if resp.status >= 400:
+					raise NetBoxAPIError (resp.status, method, path, body)
+
+				if not body:
+					return None
+
+				return json.loads (body)
+
+	async def get (self, path, id):
+		return await self.request ('GET', "%s%d/" % (path, id))
+
+	# Return all objects matching the given filters
+	async def list (self, path, **filters):
+		page = await self.request ('GET', path, dict (filters, limit = self.page_size, offset = 0))
+		results = page['results']
+
+		offsets = range (self.page_size, page['count'], self.page_size)
+		pages = await asyncio.gather (*[
+			self.request ('GET', path, dict (filters, limit = self.page_size, offset = offset)) for offset in offsets
+		])
+
+		for page in pages:
+			results.extend (page['results'])
+
+		return results
+
+	# Return the first object matching the given filters, or None
+	async def first (self, path, **filters):
+		page = await self.request ('GET', path, dict (filters, limit = 1))
+		if page['results']:
+			return page['results'][0]
+
+		return None
+
+	# Cached first (), for reference objects (roles, tags, VRFs, ...) which are
+	# looked up by many workflows running concurrently.  Concurrent lookups of
+	# the same object share one request.  Failed lookups aren't cached, so the
+	# next caller tries again.
+	async def lookup (self, path, **filters):
+		key = (path, tuple (sorted (build_params (filters))))
+		if key not in self.lookups:
+			self.lookups[key] = asyncio.ensure_future (self.first (path, **filters))
+
+		future = self.lookups[key]
+		try:
+			return await future
+		except Exception:
+			if self.lookups.get (key) is future:
+				del self.lookups[key]
+			raise
+
+	# Create one object, or all objects with one request if data is a list
+	async def create (self, path, data):
+		if isinstance (data, list) and not data:
+			return []
+
+		return await self.request ('POST', path, data = data)
+
+	# Update all given objects (each having an "id") with one request
+	async def update (self, path, data):
+		if not data:
+			return []
+
+		return await self.request ('PATCH', path, data = data)
+
+	async def delete (self, path, id):
+		return await self.request ('DELETE', "%s%d/" % (path, id))
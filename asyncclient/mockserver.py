@@ -0,0 +1,239 @@
+#!/usr/bin/python3
+
+#
+# In-memory stand-in for the NetBox REST API, to run the workflows in CI.
+#
+# Objects are kept as plain dicts per endpoint, related objects as IDs.  Only
+# what the workflows rely on is modelled: paginated lists with the filters
+# used, single and bulk creates and updates, instantiating interfaces and rear
+# ports from (seeded) templates when creating devices, marking cable
+# terminations, and the available-prefixes endpoint.
+#
+# Seed data is a dict of endpoint -> list of objects, e.g.
+#
+#   {
+#     "dcim/sites/" : [{"id" : 1, "name" : "Foo", "slug" : "foo"}],
+#     "templates" : {"<device type ID>" : {"dcim/interfaces/" : [{"name" : "eth0", "type" : "1000base-t"}]}}
+#   }
+#
+
+import collections
+import ipaddress
+
+from aiohttp import web
+
+from scriptutils.prefixes import first_free_prefix
+
+# Endpoints for cable termination types
+TERMINATION_PATHS = {
+	'dcim.interface' : "dcim/interfaces/",
+	'dcim.frontport' : "dcim/front-ports/",
+	'dcim.rearport' : "dcim/rear-ports/",
+}
+
+# Objects which have an IP network or address, and its field
+NETWORK_FIELDS = {
+	"ipam/prefixes/" : 'prefix',
+	"ipam/aggregates/" : 'prefix',
+	"ipam/ip-addresses/" : 'address',
+}
+
+
+def obj_id (value):
+	if isinstance (value, dict):
+		return value.get ('id')
+
+	return value
+
+
+class MockNetBox (object):
+	def __init__ (self, seed = None):
+		seed = dict (seed or {})
+
+		self.templates = {int (dev_type) : tmpls for dev_type, tmpls in seed.pop ('templates', {}).items ()}
+		self.objects = collections.defaultdict (dict)
+		self.next_id = 1
+		self.requests = collections.Counter ()
+
+		for path, objs in seed.items ():
+			for obj in objs:
+				self.add (path, dict (obj))
+
+		self.app = web.Application ()
+		self.app.router.add_route ('*', '/api/ipam/prefixes/{id:\\d+}/available-prefixes/', self.handle_available_prefixes)
+		self.app.router.add_route ('*', '/api/{app}/{model}/', self.handle_list)
+		self.app.router.add_route ('*', '/api/{app}/{model}/{id:\\d+}/', self.handle_object)
+
+	def add (self, path, obj):
+		if 'id' not in obj:
+			obj['id'] = self.next_id
+		self.next_id = max (self.next_id, obj['id'] + 1)
+
+		obj.setdefault ('custom_fields', {})
+		if path == "ipam/prefixes/":
+			obj.setdefault ('status', 'active')
+			obj.setdefault ('is_pool', False)
+		self.objects[path][obj['id']] = obj
+
+		if path == "dcim/devices/":
+			self.instantiate_components (obj)
+		elif path == "dcim/cables/":
+			self.connect_terminations (obj)
+
+		return obj
+
+	def instantiate_components (self, device):
+		for path, templates in self.templates.get (obj_id (device.get ('device_type')), {}).items ():
+			for template in templates:
+				self.add (path, dict (template, device = device['id']))
+
+	def connect_terminations (self, cable):
+		for end in ['a_terminations', 'b_terminations']:
+			for term in cable.get (end, []):
+				port = self.objects[TERMINATION_PATHS[term['object_type']]].get (term['object_id'])
+				if port is None:
+					raise web.HTTPBadRequest (text = "Termination %s #%s does not exist" % (term['object_type'], term['object_id']))
+				if port.get ('cable'):
+					raise web.HTTPBadRequest (text = "%s #%s is already cabled" % (term['object_type'], term['object_id']))
+
+		for end in ['a_terminations', 'b_terminations']:
+			for term in cable.get (end, []):
+				self.objects[TERMINATION_PATHS[term['object_type']]][term['object_id']]['cable'] = cable['id']
+
+	def network (self, path, obj):
+		value = obj.get (NETWORK_FIELDS.get (path))
+		if not value:
+			return None
+
+		return ipaddress.ip_interface (value).network if path == "ipam/ip-addresses/" else ipaddress.ip_network (value)
+
+	def matches (self, path, obj, key, values):
+		if key == 'id':
+			return obj['id'] in [int (v) for v in values]
+
+		if key in ('within', 'parent', 'family', 'mask_length'):
+			if path == "ipam/ip-addresses/":
+				net = ipaddress.ip_interface (obj['address'])
+			else:
+				net = self.network (path, obj)
+			if net is None:
+				return False
+
+			if key == 'family':
+				return str (net.version) in values
+			if key == 'mask_length':
+				return str (net.network.prefixlen if hasattr (net, 'ip') else net.prefixlen) in values
+
+			containers = [ipaddress.ip_network (v) for v in values]
+			if path == "ipam/ip-addresses/":
+				return any (net.ip.version == c.version and net.ip in c for c in containers)
+			return any (net.version == c.version and net != c and net.subnet_of (c) for c in containers)
+
+		if key.endswith ('_id') and key[:-3] in obj:
+			return str (obj_id (obj[key[:-3]])) in values
+
+		value = obj.get (key)
+		if isinstance (value, dict) and 'value' in value:
+			value = value['value']
+		if isinstance (value, bool):
+			value = "true" if value else "false"
+
+		return str (value) in values
+
+	def filter (self, path, query):
+		filters = collections.defaultdict (list)
+		for key, value in query.items ():
+			if key not in ('limit', 'offset', 'brief', 'ordering'):
+				filters[key].append (value)
+
+		return [obj for _, obj in sorted (self.objects[path].items ())
+			if all (self.matches (path, obj, key, values) for key, values in filters.items ())]
+
+	async def handle_list (self, request):
+		path = "%s/%s/" % (request.match_info['app'], request.match_info['model'])
+		self.requests[(request.method, path)] += 1
+
+		if request.method == 'GET':
+			objs = self.filter (path, request.query)
+			limit = int (request.query.get ('limit', 50))
+			offset = int (request.query.get ('offset', 0))
+			return web.json_response ({
+				'count' : len (objs),
+				'next' : None,
+				'previous' : None,
+				'results' : objs[offset:offset + limit],
+			})
+
+		data = await request.json ()
+		bulk = isinstance (data, list)
+		items = data if bulk else [data]
+
+		if request.method == 'POST':
+			result = [self.add (path, dict (item)) for item in items]
+			return web.json_response (result if bulk else result[0], status = 201)
+
+		if request.method == 'PATCH':
+			result = []
+			for item in items:
+				obj = self.objects[path].get (item.get ('id'))
+				if obj is None:
+					raise web.HTTPNotFound (text = "%s #%s does not exist" % (path, item.get ('id')))
+				result.append (self.update (obj, item))
+			return web.json_response (result if bulk else result[0])
+
+		raise web.HTTPMethodNotAllowed (request.method, ['GET', 'POST', 'PATCH'])
+
+	def update (self, obj, data):
+		for key, value in data.items ():
+			if key == 'custom_fields':
+				obj['custom_fields'].update (value)
+			elif key != 'id':
+				obj[key] = value
+
+		return obj
+
+	async def handle_object (self, request):
+		path = "%s/%s/" % (request.match_info['app'], request.match_info['model'])
+		self.requests[(request.method, path)] += 1
+
+		obj = self.objects[path].get (int (request.match_info['id']))
+		if obj is None:
+			raise web.HTTPNotFound ()
+
+		if request.method == 'GET':
+			return web.json_response (obj)
+		if request.method == 'PATCH':
+			return web.json_response (self.update (obj, await request.json ()))
+		if request.method == 'DELETE':
+			del self.objects[path][obj['id']]
+			return web.Response (status = 204)
+
+		raise web.HTTPMethodNotAllowed (request.method, ['GET', 'PATCH', 'DELETE'])
+
+	async def handle_available_prefixes (self, request):
+		path = "ipam/prefixes/"
+		self.requests[(request.method, "ipam/prefixes/{id}/available-prefixes/")] += 1
+
+		container = self.objects[path].get (int (request.match_info['id']))
+		if container is None:
+			raise web.HTTPNotFound ()
+		if request.method != 'POST':
+			raise web.HTTPMethodNotAllowed (request.method, ['POST'])
+
+		data = await request.json ()
+		net = ipaddress.ip_network (container['prefix'])
+		children = sorted (
+			(int (child.network_address), int (child.broadcast_address))
+			for child in (self.network (path, obj) for obj in self.objects[path].values ())
+			if child.version == net.version and child != net and child.subnet_of (net)
+		)
+
+		first = first_free_prefix (int (net.network_address), int (net.broadcast_address), children, data['prefix_length'], net.version)
+		if first is None:
+			return web.json_response ({'detail' : "Insufficient space is available to accommodate the requested prefix size(s)"}, status = 409)
+
+		address = ipaddress.IPv4Address (first) if net.version == 4 else ipaddress.IPv6Address (first)
+		prefix = dict (data, prefix = "%s/%d" % (address, data['prefix_length']))
+		prefix.pop ('prefix_length')
+
+		return web.json_response (self.add (path, prefix), status = 201)
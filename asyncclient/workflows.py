@@ -0,0 +1,613 @@
+#!/usr/bin/python3
+
+#
+# The ConnectRearPorts, AddWireguardTunnel, and ProvisionBackbonePOP workflows
+# on top of the REST API.
+#
+# They follow the scripts step by step, using the same conventions (names,
+# addresses, IDs) from scriptutils, but issue all requests which don't depend
+# on each other concurrently and create or update objects of the same kind
+# with one request to the bulk endpoints.  Like the scripts, the workflows can
+# be run again for already (partly) provisioned objects.
+#
+
+import asyncio
+import ipaddress
+import logging
+
+from scriptutils.bbpop import (
+	LOOPBACK_IPV4, LOOPBACK_IPV4_PREFIX, LOOPBACK_IPV6, LOOPBACK_IPV6_PREFIX,
+	MGMT_AGGREGATE_DESC, MGMT_IP_BBR, MGMT_IP_SWITCH, MGMT_PREFIX, MGMT_VLAN_BASE,
+	NODE_ID_MAX, NODE_ID_MIN,
+	get_bbr_name, get_patch_panel_name, get_surge_name, get_switch_name, loopback_node_id, parse_pole_setup,
+)
+from scriptutils.idpool import IdPool
+from scriptutils.prefixes import first_free_prefix
+from scriptutils.rackunits import RackUnits
+from scriptutils.wgtunnel import (
+	IfaceNameError,
+	PREFIX_ROLE_SLUG_OOBM,
+	PREFIX_ROLE_SLUG_REGULAR,
+	VRF_NAME_OOBM,
+	get_prefix_desc,
+	ip_mask_by_af,
+	ip_offsets_by_af,
+	pick_iface_name,
+	prefix_length_by_af,
+	wg_key_valid,
+)
+
+from asyncclient.client import NetBoxAPIError, choice_value, obj_id
+
+log = logging.getLogger (__name__)
+
+
+class WorkflowError (Exception):
+	pass
+
+
+async def get_required (client, path, **filters):
+	obj = await client.lookup (path, **filters)
+	if obj is None:
+		raise WorkflowError ("%s matching %s does not exist!" % (path, filters))
+
+	return obj
+
+
+def network_range (prefix):
+	net = ipaddress.ip_network (prefix)
+	return int (net.network_address), int (net.broadcast_address)
+
+
+################################################################################
+#                              Connect rear ports                              #
+################################################################################
+
+async def connect_rear_ports (client, dev_a_name, dev_b_name, connected = False):
+	dev_a, dev_b = await asyncio.gather (
+		get_required (client, "dcim/devices/", name = dev_a_name),
+		get_required (client, "dcim/devices/", name = dev_b_name),
+	)
+
+	a_rps, b_rps = await asyncio.gather (
+		client.list ("dcim/rear-ports/", device_id = dev_a['id']),
+		client.list ("dcim/rear-ports/", device_id = dev_b['id']),
+	)
+
+	if len (a_rps) != len (b_rps):
+		raise WorkflowError ("Devices have different number of rear ports: %d vs. %d" % (len (a_rps), len (b_rps)))
+
+	cables = []
+	skipped = 0
+	for rp_a, rp_b in zip (a_rps, b_rps):
+		if rp_a.get ('cable'):
+			log.info ("Rear port %s:%s already connected, skipping.", dev_a_name, rp_a['name'])
+			skipped += 1
+			continue
+
+		cables.append ({
+			'a_terminations' : [{'object_type' : 'dcim.rearport', 'object_id' : rp_a['id']}],
+			'b_terminations' : [{'object_type' : 'dcim.rearport', 'object_id' : rp_b['id']}],
+			'status' : 'connected' if connected else 'planned',
+		})
+
+	await client.create ("dcim/cables/", cables)
+	log.info ("Connected %d rear ports of %s and %s, %d skipped.", len (cables), dev_a_name, dev_b_name, skipped)
+
+	return len (cables), skipped
+
+
+################################################################################
+#                              Wireguard tunnels                               #
+################################################################################
+
+NODE_PATHS = {
+	'device' : "dcim/devices/",
+	'vm' : "virtualization/virtual-machines/",
+}
+
+IFACE_PATHS = {
+	'device' : ("dcim/interfaces/", 'device', 'dcim.interface'),
+	'vm' : ("virtualization/interfaces/", 'virtual_machine', 'virtualization.vminterface'),
+}
+
+
+# Resolve a node name to a (node type, node) tuple, looking at Devices and VMs concurrently
+async def resolve_node (client, name):
+	device, vm = await asyncio.gather (
+		client.first (NODE_PATHS['device'], name = name),
+		client.first (NODE_PATHS['vm'], name = name),
+	)
+
+	if device:
+		return ('device', device)
+	if vm:
+		return ('vm', vm)
+
+	raise WorkflowError ("Node %s does not exist!" % name)
+
+
+# Same checks as validate_wg_keys () of the Wireguard script, on already loaded nodes
+def validate_wg_keys (nodes):
+	problems = []
+	pubkeys = {}
+	for node_type, node in nodes:
+		wg = (node.get ('local_context_data') or {}).get ('wireguard')
+		if not isinstance (wg, dict) or not (wg.get ('privkey') and wg.get ('pubkey')):
+			problems.append ("Node %s does not have Wireguard keys configured in config context!" % node['name'])
+			continue
+
+		for key in ['privkey', 'pubkey']:
+			if not wg_key_valid (wg[key]):
+				problems.append ("Node %s has an invalid Wireguard %s in config context!" % (node['name'], key))
+
+		pubkeys.setdefault (wg['pubkey'], set ()).add (node['name'])
+
+	for pubkey, names in pubkeys.items ():
+		if len (names) > 1:
+			problems.append ("Wireguard pubkey %s is used by multiple nodes: %s" % (pubkey, ", ".join (sorted (names))))
+
+	return problems
+
+
+# Return the transfer network of the given address family, allocating it if necessary.
+#
+# New prefixes are carved out via the available-prefixes endpoint of the
+# containers, which serializes concurrent allocations within NetBox.
+async def get_tunnel_prefix (client, server, peer, af, oobm):
+	pfx_role_slug = PREFIX_ROLE_SLUG_OOBM if oobm else PREFIX_ROLE_SLUG_REGULAR
+	pfx_role = await get_required (client, "ipam/roles/", slug = pfx_role_slug)
+	pfx_desc = get_prefix_desc (server['name'], peer['name'])
+
+	existing = await client.first ("ipam/prefixes/", role_id = pfx_role['id'], is_pool = False, status = 'active', family = af, description = pfx_desc)
+	if existing:
+		log.info ("Found existing IPv%s prefix %s.", af, existing['prefix'])
+		return existing
+
+	containers = await client.list ("ipam/prefixes/", role_id = pfx_role['id'], is_pool = False, status = 'container', family = af)
+	for container in containers:
+		try:
+			prefix = await client.create ("ipam/prefixes/%d/available-prefixes/" % container['id'], {
+				'prefix_length' : prefix_length_by_af[af],
+				'role' : pfx_role['id'],
+				'description' : pfx_desc,
+			})
+		except NetBoxAPIError as e:
+			# No space left in this container
+			if e.status != 409:
+				raise
+			log.info ("Found IPv%s container %s, but no free prefixes available *sniff*", af, container['prefix'])
+			continue
+
+		log.info ("Found IPv%s container %s, picking %s for new tunnel.", af, container['prefix'], prefix['prefix'])
+		return prefix
+
+	raise WorkflowError ("Can't find IPv%s prefix to carve transfer network from, dying of shame." % af)
+
+
+def get_iface_peer (iface):
+	cf_data = iface.get ('custom_fields') or {}
+	for peer_type in NODE_PATHS:
+		peer_id = obj_id (cf_data.get ('wg_peer_%s' % peer_type))
+		if peer_id:
+			return (peer_type, peer_id)
+
+	return None
+
+
+# Is iface a Wireguard interface, i.e. a virtual interface (VM interfaces
+# don't have a type) carrying the Wireguard tag?
+def is_wg_iface (iface, node_type, wg_tag):
+	if node_type == 'device' and choice_value (iface.get ('type')) != 'virtual':
+		return False
+
+	return wg_tag['id'] in [obj_id (tag) for tag in iface.get ('tags') or []]
+
+
+# Find or create the interface on node towards peer
+async def get_tunnel_iface (client, node, peer, oobm, wg_tag):
+	node_type, node_obj = node
+	peer_type, peer_obj = peer
+	path, node_field, _ = IFACE_PATHS[node_type]
+	peer_key = (peer_type, peer_obj['id'])
+	cf_name = 'wg_peer_%s' % peer_type
+	prefix = "oob" if oobm else "wg"
+
+	ifaces = await client.list (path, **{"%s_id" % node_field : node_obj['id']})
+
+	names = {}
+	for iface in ifaces:
+		if_peer = get_iface_peer (iface)
+		if if_peer == peer_key and iface['name'].split ('-', 1)[0] == prefix and is_wg_iface (iface, node_type, wg_tag):
+			log.info ("Found interface '%s' on node '%s' linked to peer '%s', carrying on.", iface['name'], node_obj['name'], peer_obj['name'])
+			return iface
+
+		names[iface['name']] = if_peer
+
+	try:
+		if_name = pick_iface_name (names, peer_key, peer_obj['name'], oobm)
+	except IfaceNameError as e:
+		raise WorkflowError ("%s (on %s)" % (e, node_obj['name']))
+
+	for iface in ifaces:
+		if iface['name'] == if_name:
+			if not is_wg_iface (iface, node_type, wg_tag):
+				raise WorkflowError ("Interface '%s' on node '%s' isn't a Wireguard interface, dying of shame." % (if_name, node_obj['name']))
+
+			iface = await client.update (path, [{'id' : iface['id'], 'custom_fields' : {cf_name : peer_obj['id']}}])
+			log.info ("Found interface '%s' on node '%s' and linked it to peer '%s'", if_name, node_obj['name'], peer_obj['name'])
+			return iface[0]
+
+	data = {
+		node_field : node_obj['id'],
+		'name' : if_name,
+		'tags' : [wg_tag['id']],
+		'custom_fields' : {cf_name : peer_obj['id']},
+	}
+	if node_type == 'device':
+		data['type'] = 'virtual'
+
+	iface = await client.create (path, data)
+	log.info ("Created interface '%s' on peer '%s'.", if_name, node_obj['name'])
+
+	return iface
+
+
+async def configure_ips (client, ifaces, prefixes):
+	addresses = []
+	for af in [4, 6]:
+		net = ipaddress.ip_network (prefixes[af]['prefix'])
+		for (node_type, iface), offset in zip (ifaces, ip_offsets_by_af[af]):
+			addresses.append (("%s/%d" % (net.network_address + offset, ip_mask_by_af[af]), node_type, iface))
+
+	existing = await client.list ("ipam/ip-addresses/", address = [address for address, _, _ in addresses])
+	existing = {ip['address'] : ip for ip in existing}
+
+	new_ips = []
+	for address, node_type, iface in addresses:
+		if address in existing:
+			log.info ("IP %s already exists, carrying on.", address)
+			continue
+
+		new_ips.append ({
+			'address' : address,
+			'assigned_object_type' : IFACE_PATHS[node_type][2],
+			'assigned_object_id' : iface['id'],
+		})
+
+	await client.create ("ipam/ip-addresses/", new_ips)
+	for ip in new_ips:
+		log.info ("Configured IP %s", ip['address'])
+
+
+async def add_wireguard_tunnel (client, server_name, client_name, oobm = False):
+	server, peer = await asyncio.gather (
+		resolve_node (client, server_name),
+		resolve_node (client, client_name),
+	)
+
+	problems = validate_wg_keys ([server, peer])
+	if problems:
+		raise WorkflowError ("\n".join (problems))
+
+	wg_tag = await client.lookup ("extras/tags/", name = "Wireguard")
+	if wg_tag is None:
+		raise WorkflowError ("Wireguard tag doesn't exist, dying of shame.")
+
+	pfx_v4, pfx_v6, server_iface, client_iface = await asyncio.gather (
+		get_tunnel_prefix (client, server[1], peer[1], 4, oobm),
+		get_tunnel_prefix (client, server[1], peer[1], 6, oobm),
+		get_tunnel_iface (client, server, peer, oobm, wg_tag),
+		get_tunnel_iface (client, peer, server, oobm, wg_tag),
+	)
+
+	if oobm:
+		vrf = await get_required (client, "ipam/vrfs/", name = VRF_NAME_OOBM)
+		if obj_id (client_iface.get ('vrf')) != vrf['id']:
+			await client.update (IFACE_PATHS[peer[0]][0], [{'id' : client_iface['id'], 'vrf' : vrf['id']}])
+			log.info ("Assigned %s on %s to VRF %s.", client_iface['name'], client_name, VRF_NAME_OOBM)
+
+	await configure_ips (client, [(server[0], server_iface), (peer[0], client_iface)], {4 : pfx_v4, 6 : pfx_v6})
+
+
+################################################################################
+#                              POP provisioning                                #
+################################################################################
+
+async def get_device_type (client, manufacturer, model):
+	for dev_type in await client.list ("dcim/device-types/", model = model):
+		if (dev_type.get ('manufacturer') or {}).get ('name') == manufacturer:
+			return dev_type
+
+	raise WorkflowError ("Device type %s %s does not exist!" % (manufacturer, model))
+
+
+async def get_or_create (client, path, data, **filters):
+	obj = await client.first (path, **filters)
+	if obj:
+		log.info ("%s %s already present, carrying on.", path, filters)
+		return obj
+
+	obj = await client.create (path, data)
+	log.info ("Created %s %s", path, filters)
+
+	return obj
+
+
+# Objects of all given devices, without a request if there are none
+async def list_for_devices (client, path, devices, **filters):
+	if not devices:
+		return []
+
+	return await client.list (path, device_id = [dev['id'] for dev in devices], **filters)
+
+
+async def load_node_ids (client):
+	pool = IdPool (NODE_ID_MIN, NODE_ID_MAX)
+	v4, v6 = await asyncio.gather (
+		client.list ("ipam/ip-addresses/", parent = LOOPBACK_IPV4_PREFIX),
+		client.list ("ipam/ip-addresses/", parent = LOOPBACK_IPV6_PREFIX),
+	)
+
+	for ip in v4 + v6:
+		node_id = loopback_node_id (ip['address'])
+		if node_id is not None:
+			pool.mark_used (node_id)
+
+	return pool
+
+
+async def find_mgmt_id (client, site, mgmt_role):
+	# Re-use the mgmt VLAN of the site, if there is one already
+	for vlan in await client.list ("ipam/vlans/", site_id = site['id'], role_id = mgmt_role['id']):
+		if vlan['vid'] > MGMT_VLAN_BASE:
+			return vlan['vid'] - MGMT_VLAN_BASE
+
+	aggregate = await get_required (client, "ipam/aggregates/", description = MGMT_AGGREGATE_DESC)
+	first, last = network_range (aggregate['prefix'])
+	children = sorted (network_range (pfx['prefix']) for pfx in await client.list ("ipam/prefixes/", within = aggregate['prefix']))
+
+	free = first_free_prefix (first, last, children, 24, 4)
+	if free is None:
+		raise WorkflowError ("Didn't find next free mgmt ID :'(")
+
+	mgmt_id = (free >> 8) & 0xff
+	log.info ("Picked next free mgmt ID %d", mgmt_id)
+
+	return mgmt_id
+
+
+async def place_devices (client, rack, layout):
+	units = RackUnits (rack['u_height'], rack.get ('starting_unit') or 1)
+
+	devices = [dev for dev in await client.list ("dcim/devices/", rack_id = rack['id']) if dev.get ('position') is not None]
+	type_ids = sorted (set (obj_id (dev['device_type']) for dev in devices))
+	dev_types = {dev_type['id'] : dev_type for dev_type in await client.list ("dcim/device-types/", id = type_ids)} if type_ids else {}
+
+	for dev in devices:
+		dev_type = dev_types[obj_id (dev['device_type'])]
+		units.occupy (float (dev['position']), float (dev_type['u_height']), choice_value (dev.get ('face')), dev_type.get ('is_full_depth'))
+
+	positions = units.place ([(dev_type['u_height'], dev_type.get ('is_full_depth')) for _, dev_type in layout], 'front')
+
+	placement = {}
+	for (name, _), position in zip (layout, positions):
+		placement[name] = position
+		log.info ("Picked position U%s in rack %s for %s", position, rack['name'], name)
+
+	return placement
+
+
+async def provision_pop (client, site_slug, rack_name, rack_units, bbr_model, panel_ports, pole_setup,
+		sw_asset_tag, sw_serial, bbr_asset_tag, bbr_serial, node_id = None):
+	site = await get_required (client, "dcim/sites/", slug = site_slug)
+	pp_name = get_patch_panel_name (site['slug'], rack_name)
+	sw_name = get_switch_name (site['slug'])
+	bbr_name = get_bbr_name (site['slug'])
+	surges = [(get_surge_name (site['slug'], pole_no, n), (pole_no, n)) for pole_no, n in parse_pole_setup (pole_setup)]
+
+	(mgmt_role, rack_role, pp_role, sw_role, bbr_role, surge_role, netonix, linux,
+	 pp_type, sw_type, bbr_type, surge_type, existing) = await asyncio.gather (
+		get_required (client, "ipam/roles/", name = 'Mgmt'),
+		get_required (client, "dcim/rack-roles/", name = 'Backbone'),
+		get_required (client, "dcim/device-roles/", name = 'Patchpanel'),
+		get_required (client, "dcim/device-roles/", name = 'Switch'),
+		get_required (client, "dcim/device-roles/", name = 'Backbone router'),
+		get_required (client, "dcim/device-roles/", name = 'Surge Protector'),
+		get_required (client, "dcim/platforms/", name = 'Netonix'),
+		get_required (client, "dcim/platforms/", name = 'Linux'),
+		get_device_type (client, 'Telegärtner', 'Patchpanel'),
+		get_device_type (client, 'Netonix', 'WS-12-250-AC'),
+		get_device_type (client, 'PCEngines', bbr_model),
+		get_device_type (client, 'Ubiquiti', 'Surge Protector'),
+		client.list ("dcim/devices/", site_id = site['id'], name = [pp_name, sw_name, bbr_name] + [name for name, _ in surges]),
+	)
+	existing = {dev['name'] : dev for dev in existing}
+
+	# Pick a node ID for the BBR or make sure the one given isn't in use yet
+	if bbr_name not in existing:
+		pool = await load_node_ids (client)
+		if node_id is None:
+			node_id = pool.allocate ()[0]
+			log.info ("Picked free node ID %s", node_id)
+		elif not pool.is_free (node_id):
+			raise WorkflowError ("Node ID %s is invalid or its loopback IPs are already in use!" % node_id)
+
+	mgmt_id = await find_mgmt_id (client, site, mgmt_role)
+
+	# Mgmt VLAN + prefix and rack
+	vlan, rack = await asyncio.gather (
+		get_or_create (client, "ipam/vlans/", {
+			'site' : site['id'],
+			'name' : "Mgmt %s" % site['name'],
+			'vid' : MGMT_VLAN_BASE + mgmt_id,
+			'role' : mgmt_role['id'],
+		}, site_id = site['id'], vid = MGMT_VLAN_BASE + mgmt_id),
+		get_or_create (client, "dcim/racks/", {
+			'site' : site['id'],
+			'name' : rack_name,
+			'role' : rack_role['id'],
+			'type' : 'wall-cabinet',
+			'width' : 19,
+			'u_height' : rack_units,
+			'status' : 'planned',
+		}, site_id = site['id'], name = rack_name),
+	)
+
+	await get_or_create (client, "ipam/prefixes/", {
+		'site' : site['id'],
+		'prefix' : MGMT_PREFIX % mgmt_id,
+		'vlan' : vlan['id'],
+		'role' : mgmt_role['id'],
+	}, prefix = MGMT_PREFIX % mgmt_id)
+
+	# Create all devices not present yet with one request
+	layout = [(name, dev_type) for name, dev_type in [(pp_name, pp_type), (sw_name, sw_type), (bbr_name, bbr_type)] if name not in existing]
+	placement = await place_devices (client, rack, layout)
+
+	rack_devices = {
+		pp_name : (pp_type, pp_role, None, {}),
+		sw_name : (sw_type, sw_role, netonix, {'asset_tag' : sw_asset_tag, 'serial' : sw_serial}),
+		bbr_name : (bbr_type, bbr_role, linux, {'asset_tag' : bbr_asset_tag, 'serial' : bbr_serial}),
+	}
+
+	new_devices = []
+	for name, _ in layout:
+		dev_type, role, platform, extra = rack_devices[name]
+		new_devices.append (dict (extra,
+			name = name,
+			device_type = dev_type['id'],
+			device_role = role['id'],
+			platform = platform['id'] if platform else None,
+			site = site['id'],
+			rack = rack['id'],
+			position = placement[name],
+			face = 'front',
+			status = 'planned',
+		))
+
+	for name, _ in surges:
+		if name not in existing:
+			new_devices.append ({
+				'name' : name,
+				'device_type' : surge_type['id'],
+				'device_role' : surge_role['id'],
+				'site' : site['id'],
+				'status' : 'planned',
+			})
+
+	created = {dev['name'] : dev for dev in await client.create ("dcim/devices/", new_devices)}
+	for name in created:
+		log.info ("Created device %s", name)
+
+	devices = dict (existing, **created)
+	pp, sw, bbr = devices[pp_name], devices[sw_name], devices[bbr_name]
+
+	# Patch panel ports
+	if pp_name in created:
+		rear_ports = await client.create ("dcim/rear-ports/", [
+			{'device' : pp['id'], 'name' : str (n), 'type' : '8p8c', 'positions' : 1} for n in range (1, panel_ports + 1)
+		])
+		await client.create ("dcim/front-ports/", [
+			{'device' : pp['id'], 'name' : rp['name'], 'type' : '8p8c', 'rear_port' : rp['id'], 'rear_port_position' : 1} for rp in rear_ports
+		])
+
+	new_surges = [devices[name] for name, _ in surges if name in created]
+	pp_rear_ports, pp_front_ports, sw_ifaces, bbr_ifaces, surge_rear_ports = await asyncio.gather (
+		client.list ("dcim/rear-ports/", device_id = pp['id']),
+		client.list ("dcim/front-ports/", device_id = pp['id']),
+		client.list ("dcim/interfaces/", device_id = sw['id']),
+		client.list ("dcim/interfaces/", device_id = bbr['id']),
+		list_for_devices (client, "dcim/rear-ports/", new_surges, name = "1"),
+	)
+	pp_rear_ports = {port['name'] : port for port in pp_rear_ports}
+	pp_front_ports = {port['name'] : port for port in pp_front_ports}
+	sw_ifaces = {iface['name'] : iface for iface in sw_ifaces}
+	bbr_ifaces = {iface['name'] : iface for iface in bbr_ifaces}
+	surge_rear_ports = {obj_id (port['device']) : port for port in surge_rear_ports}
+
+	# All cables of new devices with one request
+	def cable (a_type, a, b_type, b):
+		return {
+			'a_terminations' : [{'object_type' : a_type, 'object_id' : a['id']}],
+			'b_terminations' : [{'object_type' : b_type, 'object_id' : b['id']}],
+			'status' : 'planned',
+		}
+
+	cables = []
+	for (name, _), pp_port in zip (surges, range (1, panel_ports + 1)):
+		if name in created:
+			cables.append (cable ('dcim.rearport', pp_rear_ports[str (pp_port)], 'dcim.rearport', surge_rear_ports[devices[name]['id']]))
+
+	if sw_name in created:
+		for n in range (1, panel_ports + 1):
+			cables.append (cable ('dcim.interface', sw_ifaces[str (n)], 'dcim.frontport', pp_front_ports[str (n)]))
+
+	if bbr_name in created:
+		for n in [1, 2]:
+			cables.append (cable ('dcim.interface', sw_ifaces[str (10 + n)], 'dcim.interface', bbr_ifaces["enp%ds0" % n]))
+
+	await client.create ("dcim/cables/", cables)
+	log.info ("Created %d cables", len (cables))
+
+	# Configure ports of new devices with one request
+	iface_updates = []
+	new_ifaces = []
+	new_ips = []
+	primary_ips = {}
+
+	if sw_name in created:
+		unused_ifaces = [13, 14]
+		if panel_ports < 10:
+			unused_ifaces.extend (range (panel_ports + 1, 10))
+		for n in sorted (unused_ifaces):
+			iface_updates.append ({'id' : sw_ifaces[str (n)]['id'], 'enabled' : False})
+
+		iface_updates.append ({'id' : sw_ifaces["10"]['id'], 'mode' : 'access', 'untagged_vlan' : vlan['id'], 'description' : "Mgmt"})
+		iface_updates.append ({'id' : sw_ifaces["po1"]['id'], 'mode' : 'tagged-all'})
+		for n in [11, 12]:
+			iface_updates.append ({'id' : sw_ifaces[str (n)]['id'], 'lag' : sw_ifaces["po1"]['id']})
+
+		new_ifaces.append ({'device' : sw['id'], 'name' : "vlan%d" % vlan['vid'], 'type' : 'virtual'})
+		new_ips.append ((sw_name, "vlan%d" % vlan['vid'], MGMT_IP_SWITCH % mgmt_id, 'primary_ip4'))
+
+	if bbr_name in created:
+		iface_updates.append ({'id' : bbr_ifaces["bond0"]['id'], 'mode' : 'tagged-all'})
+		for n in [1, 2]:
+			iface_updates.append ({'id' : bbr_ifaces["enp%ds0" % n]['id'], 'lag' : bbr_ifaces["bond0"]['id']})
+		iface_updates.append ({'id' : bbr_ifaces["enp3s0"]['id'], 'enabled' : False})
+
+		new_ifaces.append ({'device' : bbr['id'], 'name' : "vlan%d" % vlan['vid'], 'type' : 'virtual', 'parent' : bbr_ifaces["bond0"]['id']})
+		new_ips.append ((bbr_name, "vlan%d" % vlan['vid'], MGMT_IP_BBR % mgmt_id, None))
+		new_ips.append ((bbr_name, "lo", LOOPBACK_IPV4 % node_id, 'primary_ip4'))
+		new_ips.append ((bbr_name, "lo", LOOPBACK_IPV6 % node_id, 'primary_ip6'))
+
+	_, vlan_ifaces = await asyncio.gather (
+		client.update ("dcim/interfaces/", iface_updates),
+		client.create ("dcim/interfaces/", new_ifaces),
+	)
+
+	ifaces = {
+		sw_name : sw_ifaces,
+		bbr_name : bbr_ifaces,
+	}
+	for iface in vlan_ifaces:
+		dev_name = sw_name if obj_id (iface['device']) == sw['id'] else bbr_name
+		ifaces[dev_name][iface['name']] = iface
+
+	# Mgmt and loopback IPs, then primary IPs
+	ips = await client.create ("ipam/ip-addresses/", [{
+		'address' : address,
+		'assigned_object_type' : 'dcim.interface',
+		'assigned_object_id' : ifaces[dev_name][if_name]['id'],
+	} for dev_name, if_name, address, _ in new_ips])
+
+	for (dev_name, if_name, address, primary), ip in zip (new_ips, ips):
+		log.info ("Configured %s on interface %s of %s", address, if_name, dev_name)
+		if primary:
+			primary_ips.setdefault (devices[dev_name]['id'], {})[primary] = ip['id']
+
+	for dev in await client.update ("dcim/devices/", [dict (fields, id = dev_id) for dev_id, fields in primary_ips.items ()]):
+		devices[dev['name']] = dev
+
+	return devices
@@ -0,0 +1,116 @@
+#!/usr/bin/python3
+
+#
+# Measure how long importing each script module takes and how much memory it
+# allocates, as NetBox does when rendering the scripts list or form and when
+# starting a job.  Every measurement runs in a fresh Python process with Django
+# already set up, so only the cost of the script module itself (and everything
+# it pulls in which NetBox hasn't loaded anyway) is measured.
+#
+# "cold" is the first import within the process, "reload" executing the module
+# again, as NetBox does every time it (re)loads scripts.  Needs a NetBox
+# installation, run it with NetBox's virtualenv:
+#
+#   ./benchmarks/bench_import.py --netbox /opt/netbox/netbox [--runs N] [script.py ...]
+#
+
+import argparse
+import importlib.util
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+REPO_ROOT = os.path.join (os.path.dirname (os.path.abspath (__file__)), '..')
+
+SCRIPT_MODULES = [
+	"AddressSpaceReport/addressSpaceReport.py",
+	"ConnectHelper/connectHelper.py",
+	"ProvisionBackbonePOP/ProvisionBackbonePOP.py",
+	"Wireguard-tunnels/wireguard.py",
+]
+
+
+def exec_module (path):
+	name = os.path.splitext (os.path.basename (path))[0]
+	spec = importlib.util.spec_from_file_location (name, path)
+	module = importlib.util.module_from_spec (spec)
+	spec.loader.exec_module (module)
+
+	return module
+
+
+# Runs within the child process, prints the results as JSON
+def measure (path, netbox, memory):
+	sys.path.insert (0, netbox)
+	sys.path.insert (0, REPO_ROOT)
+	os.environ.setdefault ('DJANGO_SETTINGS_MODULE', 'netbox.settings')
+
+	import django
+	django.setup ()
+
+	modules = len (sys.modules)
+	result = {}
+
+	if memory:
+		tracemalloc.start ()
+		exec_module (path)
+		result['current'], result['peak'] = tracemalloc.get_traced_memory ()
+		tracemalloc.stop ()
+	else:
+		start = time.perf_counter ()
+		exec_module (path)
+		result['cold'] = time.perf_counter () - start
+
+		start = time.perf_counter ()
+		exec_module (path)
+		result['reload'] = time.perf_counter () - start
+
+	result['modules'] = len (sys.modules) - modules
+	print (json.dumps (result))
+
+
+def run_child (path, netbox, memory):
+	cmd = [sys.executable, os.path.abspath (__file__), '--netbox', netbox, '--child', path]
+	if memory:
+		cmd.append ('--memory')
+
+	proc = subprocess.run (cmd, stdout = subprocess.PIPE, check = True, universal_newlines = True)
+	return json.loads (proc.stdout.strip ().splitlines ()[-1])
+
+
+def main ():
+	parser = argparse.ArgumentParser (description = "Benchmark import time and memory of script modules")
+	parser.add_argument ("--netbox", required = True, help = "Path of the NetBox Django project (containing manage.py)")
+	parser.add_argument ("--runs", type = int, default = 5, help = "Processes per measurement")
+	parser.add_argument ("--child", help = argparse.SUPPRESS)
+	parser.add_argument ("--memory", action = 'store_true', help = argparse.SUPPRESS)
+	parser.add_argument ("scripts", nargs = '*', help = "Script modules to measure (default: all of this repository)")
+	args = parser.parse_args ()
+
+	if args.child:
+		measure (args.child, args.netbox, args.memory)
+		return
+
+	scripts = args.scripts or [os.path.join (REPO_ROOT, path) for path in SCRIPT_MODULES]
+
+	print ("%-24s %10s %12s %12s %12s %8s" % ("module", "cold [ms]", "reload [ms]", "alloc [KiB]", "peak [KiB]", "modules"))
+	for path in scripts:
+		times = [run_child (path, args.netbox, False) for _ in range (args.runs)]
+		mem = run_child (path, args.netbox, True)
+
+		print ("%-24s %10.1f %12.1f %12.0f %12.0f %8d" % (
+			os.path.basename (path),
+			statistics.median (t['cold'] for t in times) * 1000,
+			statistics.median (t['reload'] for t in times) * 1000,
+			mem['current'] / 1024,
+			mem['peak'] / 1024,
+			mem['modules'],
+		))
+
+
+if __name__ == '__main__':
+	main ()
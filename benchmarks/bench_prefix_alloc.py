@@ -0,0 +1,79 @@
+#!/usr/bin/python3
+
+#
+# Compare carving a transfer network out of a container via netaddr IPSets (what
+# Prefix.get_available_prefixes ().iter_cidrs () does) with the integer allocator
+# from scriptutils.prefixes.  Only needs netaddr, no NetBox installation.
+#
+#   ./benchmarks/bench_prefix_alloc.py [--children N] [--runs N]
+#
+
+import argparse
+import os
+import random
+import sys
+import timeit
+
+import netaddr
+
+sys.path.insert (0, os.path.join (os.path.dirname (os.path.abspath (__file__)), '..'))
+
+from scriptutils.prefixes import ADDR_BITS_BY_AF, first_free_prefix, prefix_ranges
+
+
+def build_children (container, plen, num, seed):
+	# Sparse children spread over the container, with the first few slots taken
+	# to make sure the allocator has to skip some of them.
+	rnd = random.Random (seed)
+	subnets = 1 << (plen - container.prefixlen)
+	slots = set (range (min (16, num)))
+	while len (slots) < num:
+		slots.add (rnd.randrange (subnets))
+
+	size = 1 << (ADDR_BITS_BY_AF[container.version] - plen)
+	return [netaddr.IPNetwork ("%s/%d" % (netaddr.IPAddress (container.first + slot * size, container.version), plen)) for slot in slots]
+
+
+def ipset_path (container, children, plen):
+	avail = netaddr.IPSet ([container]) - netaddr.IPSet (children)
+	for apfx in avail.iter_cidrs ():
+		if apfx.prefixlen <= plen:
+			return apfx.first
+
+	return None
+
+
+def integer_path (container, children, plen):
+	return first_free_prefix (container.first, container.last, prefix_ranges (children), plen, container.version)
+
+
+def main ():
+	parser = argparse.ArgumentParser (description = "Benchmark transfer network allocation")
+	parser.add_argument ("--children", type = int, nargs = '+', default = [100, 1000, 10000], help = "Number of existing children")
+	parser.add_argument ("--runs", type = int, default = 5, help = "Runs per measurement")
+	args = parser.parse_args ()
+
+	cases = [
+		("IPv6 /48 -> /64", netaddr.IPNetwork ("2a03:2260:2342::/48"), 64),
+		("IPv4 /16 -> /31", netaddr.IPNetwork ("10.132.0.0/16"), 31),
+	]
+
+	print ("%-18s %8s %14s %14s %9s" % ("case", "children", "ipset [ms]", "integer [ms]", "speedup"))
+	for name, container, plen in cases:
+		for num in args.children:
+			if num >= (1 << (plen - container.prefixlen)):
+				continue
+
+			children = build_children (container, plen, num, seed = num)
+
+			if ipset_path (container, children, plen) != integer_path (container, children, plen):
+				sys.exit ("Result mismatch for %s with %d children!" % (name, num))
+
+			t_ipset = min (timeit.repeat (lambda: ipset_path (container, children, plen), number = 1, repeat = args.runs))
+			t_int = min (timeit.repeat (lambda: integer_path (container, children, plen), number = 1, repeat = args.runs))
+
+			print ("%-18s %8d %14.3f %14.3f %8.1fx" % (name, num, t_ipset * 1000, t_int * 1000, t_ipset / t_int))
+
+
+if __name__ == '__main__':
+	main ()
@@ -0,0 +1,6 @@
+#
+# Shared helpers for the NetBox scripts in this repository.
+#
+# To use them, copy (or symlink) this directory into NetBox's SCRIPTS_ROOT
+# next to the script modules, so it can be imported as `scriptutils`.
+#
@@ -0,0 +1,76 @@
+#!/usr/bin/python3
+
+#
+# Backbone POP conventions (names, IDs, addresses) which don't need NetBox,
+# shared by the POP scripts and the standalone API client.
+#
+
+import ipaddress
+
+# Loopback IPs of backbone routers, <id> being the node ID (in both cases)
+LOOPBACK_IPV4_PREFIX = "10.132.255.0/24"
+LOOPBACK_IPV4 = "10.132.255.%s/32"
+LOOPBACK_IPV6_PREFIX = "2a03:2260:2342:ffff::/64"
+LOOPBACK_IPV6 = "2a03:2260:2342:ffff::%s/128"
+
+NODE_ID_MIN = 1
+NODE_ID_MAX = 254
+
+# Mgmt VLAN ID is MGMT_VLAN_BASE + mgmt ID
+MGMT_VLAN_BASE = 3000
+
+MGMT_AGGREGATE_DESC = "FFHO Management"
+MGMT_PREFIX = "172.30.%d.0/24"
+MGMT_IP_SWITCH = "172.30.%d.10/24"
+MGMT_IP_BBR = "172.30.%d.1/24"
+
+
+def get_patch_panel_name (site_slug, rack_name):
+	return "pp-%s-%s.1" % (site_slug, rack_name)
+
+
+def get_switch_name (site_slug):
+	return "sw-%s-01.in.ffho.net" % site_slug
+
+
+def get_bbr_name (site_slug):
+	return "bbr-%s.in.ffho.net" % site_slug
+
+
+def get_surge_name (site_slug, pole_no, n):
+	return "sp-%s-mast%s-%s" % (site_slug.lower (), pole_no, n)
+
+
+# Parse a pole setup "<pole no>:<num surges>[ <pole no>:<num surges> [...]]"
+# into a list of (pole no, surge no) tuples, in the order of the panel ports
+# the surges are connected to.
+def parse_pole_setup (pole_setup):
+	surges = []
+	for pole_config in pole_setup.split ():
+		pole_no, num_surges = pole_config.split (':')
+		surges.extend ((pole_no, n) for n in range (1, int (num_surges) + 1))
+
+	return surges
+
+
+# Return the node ID a loopback IP (as string, with or without mask) belongs to,
+# or None.  The IPv6 loopback is built from the decimal node ID written into the
+# last group of the address, so ::12 is node ID 12 (not 18).  Addresses using
+# more than the last group don't belong to any node.
+def loopback_node_id (address):
+	ip = ipaddress.ip_interface (address).ip
+
+	if ip.version == 4:
+		if ip in ipaddress.ip_network (LOOPBACK_IPV4_PREFIX):
+			return int (ip) & 0xff
+		return None
+
+	if ip not in ipaddress.ip_network (LOOPBACK_IPV6_PREFIX):
+		return None
+
+	host = int (ip) & 0xffffffffffffffff
+	if host > 0xffff:
+		return None
+
+	group = "%x" % host
+	return int (group) if group.isdigit () else None
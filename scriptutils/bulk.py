@@ -0,0 +1,47 @@
+#!/usr/bin/python3
+
+#
+# Batched inserts and updates which still show up in the change log.
+#
+# QuerySet.bulk_create () and bulk_update () don't call save () and hence don't
+# trigger any signals, so neither change log entries nor webhooks / event rules
+# would be generated.  Like NetBox does itself when instantiating components
+# from templates, the post_save signal is sent manually for every object.
+#
+
+from django.db.models.signals import post_save
+
+
+def _send_post_save (model, objects, created):
+	for obj in objects:
+		post_save.send (sender = model, instance = obj, created = created, raw = False, using = 'default', update_fields = None)
+
+
+def bulk_create (model, objects):
+	objects = list (objects)
+	if not objects:
+		return objects
+
+	for obj in objects:
+		obj.full_clean ()
+
+	objects = model.objects.bulk_create (objects)
+	_send_post_save (model, objects, True)
+
+	return objects
+
+
+# Objects should have been snapshot () before being modified, so the change log
+# entries contain the pre-change data.
+def bulk_update (model, objects, fields):
+	objects = list (objects)
+	if not objects:
+		return objects
+
+	for obj in objects:
+		obj.full_clean ()
+
+	model.objects.bulk_update (objects, fields)
+	_send_post_save (model, objects, False)
+
+	return objects
@@ -0,0 +1,122 @@
+#!/usr/bin/python3
+
+#
+# Cable topology graph and path tracing, which don't need NetBox.  The graph is
+# loaded from NetBox by scriptutils.topology.
+#
+# Nodes of the graph are (kind, ID) tuples, kind being the model name of the
+# termination, e.g. "interface", "frontport", or "rearport".
+#
+
+import collections
+
+PATH_COMPLETE = 'complete'
+PATH_DANGLING = 'dangling'
+PATH_BROKEN = 'broken'
+
+PASS_THROUGH = ('frontport', 'rearport')
+
+CablePath = collections.namedtuple ('CablePath', ['origin', 'hops', 'status', 'reason'])
+
+
+class Topology (object):
+	def __init__ (self, cable_peers, front_to_rear, rear_positions, names):
+		# node -> list of nodes on the other end of its cable
+		self.cable_peers = cable_peers
+		# front port ID -> (rear port ID, position)
+		self.front_to_rear = front_to_rear
+		# rear port ID -> number of positions
+		self.rear_positions = rear_positions
+		# node -> "<device>:<port>"
+		self.names = names
+
+		self.rear_to_front = {rear : ('frontport', front) for front, rear in front_to_rear.items ()}
+		# Rear ports without any front ports (e.g. of surge protectors) end a path
+		self.mapped_rears = {rear for rear, _ in front_to_rear.values ()}
+
+	def name (self, node):
+		return "%s (%s)" % (self.names.get (node, "#%s" % node[1]), node[0])
+
+	def format_path (self, path):
+		hops = " -> ".join (self.name (node) for node in path.hops)
+		if path.status == PATH_COMPLETE:
+			return hops
+
+		return "%s [%s: %s]" % (hops, path.status, path.reason)
+
+	def trace (self, origin):
+		hops = [origin]
+		seen = {origin}
+		positions = []
+		node = origin
+
+		while True:
+			peers = self.cable_peers.get (node)
+			if peers is not None and not peers:
+				return CablePath (origin, hops, PATH_BROKEN, "cable of %s has no far end terminations" % self.name (node))
+
+			if not peers:
+				if node[0] in PASS_THROUGH:
+					return CablePath (origin, hops, PATH_DANGLING, "%s isn't connected" % self.name (node))
+				return CablePath (origin, hops, PATH_COMPLETE, None)
+
+			if len (peers) > 1:
+				return CablePath (origin, hops, PATH_BROKEN, "cable of %s has %d far end terminations" % (self.name (node), len (peers)))
+
+			far = peers[0]
+			hops.append (far)
+
+			# Follow front and rear ports through to the other side of their device
+			if far[0] == 'frontport':
+				mapping = self.front_to_rear.get (far[1])
+				if not mapping:
+					return CablePath (origin, hops, PATH_BROKEN, "no rear port known for %s" % self.name (far))
+
+				positions.append (mapping[1])
+				node = ('rearport', mapping[0])
+
+			elif far[0] == 'rearport':
+				if far[1] not in self.mapped_rears:
+					return CablePath (origin, hops, PATH_COMPLETE, None)
+
+				if positions:
+					position = positions.pop ()
+				elif self.rear_positions.get (far[1]) == 1:
+					position = 1
+				else:
+					return CablePath (origin, hops, PATH_BROKEN, "can't tell position of multi position rear port %s" % self.name (far))
+
+				node = self.rear_to_front.get ((far[1], position))
+				if not node:
+					return CablePath (origin, hops, PATH_BROKEN, "no front port mapped to position %s of %s" % (position, self.name (far)))
+
+			else:
+				return CablePath (origin, hops, PATH_COMPLETE, None)
+
+			if node in seen:
+				return CablePath (origin, hops, PATH_BROKEN, "loop at %s" % self.name (node))
+
+			seen.add (node)
+			hops.append (node)
+
+	# Trace the paths of all cabled ports at once.
+	#
+	# Every cabled port which isn't a pass-through port is used as origin.  Pass-through
+	# ports not seen on any of those paths are part of chains without an endpoint, which
+	# are traced too and reported as dangling at least.
+	def paths (self):
+		paths = []
+		seen = set ()
+
+		origins = sorted (node for node in self.cable_peers if node[0] not in PASS_THROUGH)
+		origins += sorted (node for node in self.cable_peers if node[0] in PASS_THROUGH)
+
+		for origin in origins:
+			if origin in seen:
+				continue
+
+			path = self.trace (origin)
+			seen.update (path.hops)
+			paths.append (path)
+
+		return paths
@@ -0,0 +1,119 @@
+#!/usr/bin/python3
+
+#
+# Utilisation of address pools and forecast of their exhaustion.
+#
+# A pool is a set of containers (prefixes or aggregates) of one address family
+# from which prefixes of a fixed length are allocated, e.g. all vpn-x-connect
+# IPv6 containers handing out /64s.  All children of all containers of a pool
+# are loaded with one query and counted as integer ranges, so this is cheap
+# enough to be run at the end of every allocating script run.  Children are
+# the ones the allocator sees, i.e. within the same VRF scope as returned by
+# get_child_prefixes () of the container.  The allocation rate is derived from
+# the children created within the last window_days days.
+#
+
+import bisect
+import collections
+import datetime
+
+from django.db.models import Q
+from django.utils import timezone
+
+from ipam.choices import PrefixStatusChoices
+from ipam.models import Aggregate, Prefix
+
+from scriptutils.prefixes import count_free_prefixes, merge_ranges, prefix_ranges
+
+DEFAULT_WINDOW_DAYS = 30
+
+# Warn if a pool will be exhausted within this many days or has less free prefixes left
+WARN_DAYS_LEFT = 60
+WARN_FREE = 16
+
+PoolUsage = collections.namedtuple ('PoolUsage', ['name', 'af', 'plen', 'containers', 'total', 'free', 'recent', 'window_days', 'days_left'])
+
+
+# Filter for the children of a Prefix container, as used by Prefix.get_child_prefixes ()
+def get_child_scope (pfx):
+	if pfx.vrf_id is None and pfx.status == PrefixStatusChoices.STATUS_CONTAINER:
+		return Q ()
+
+	return Q (vrf_id = pfx.vrf_id)
+
+
+# containers is a list of (netaddr.IPNetwork, child filter) tuples of the same address family.
+#
+# Overlapping or nested containers are merged, so no space is counted twice, and
+# containers of the pool nested within others don't count as used space.
+def get_pool_usage (name, containers, plen, window_days = DEFAULT_WINDOW_DAYS):
+	containers = sorted (containers, key = lambda container: container[0].first)
+	networks = [net for net, scope in containers]
+	af = networks[0].version if networks else 4
+
+	query = Q ()
+	for net, scope in containers:
+		query |= Q (prefix__net_contained = str (net)) & scope
+
+	container_ranges = prefix_ranges (networks)
+
+	children = []
+	recent = 0
+	if networks:
+		since = timezone.now () - datetime.timedelta (days = window_days)
+		for prefix, created in Prefix.objects.filter (query).values_list ('prefix', 'created'):
+			if (prefix.first, prefix.last) in container_ranges:
+				continue
+
+			children.append (prefix)
+			if created and created >= since:
+				recent += 1
+
+	ranges = prefix_ranges (children)
+	starts = [first for first, last in ranges]
+
+	total = 0
+	free = 0
+	for first, last in merge_ranges (container_ranges):
+		# Children of this block of containers are a slice of the sorted ranges
+		lo = bisect.bisect_left (starts, first)
+		hi = bisect.bisect_right (starts, last)
+		net_total, net_free = count_free_prefixes (first, last, ranges[lo:hi], plen, af)
+		total += net_total
+		free += net_free
+
+	days_left = None
+	if recent:
+		days_left = free / (recent / window_days)
+
+	return PoolUsage (name, af, plen, len (networks), total, free, recent, window_days, days_left)
+
+
+def get_prefix_pool_usage (role_slug, af, plen, window_days = DEFAULT_WINDOW_DAYS):
+	containers = [(pfx.prefix, get_child_scope (pfx)) for pfx in Prefix.objects.filter (
+		role__slug = role_slug,
+		status = PrefixStatusChoices.STATUS_CONTAINER,
+		is_pool = False,
+	) if pfx.family == af]
+
+	return get_pool_usage ("%s (IPv%d)" % (role_slug, af), containers, plen, window_days)
+
+
+# Children of aggregates are global prefixes only, as for Aggregate.get_child_prefixes ()
+def get_aggregate_pool_usage (description, plen, window_days = DEFAULT_WINDOW_DAYS):
+	aggregates = list (Aggregate.objects.filter (description = description))
+	return get_pool_usage (description, [(aggr.prefix, Q (vrf__isnull = True)) for aggr in aggregates], plen, window_days)
+
+
+def format_usage (usage):
+	days_left = "%.0f days" % usage.days_left if usage.days_left is not None else "n/a"
+	return "%s: %d of %d /%d free, %d allocated within %d days, exhausted in %s" % (
+		usage.name, usage.free, usage.total, usage.plen, usage.recent, usage.window_days, days_left)
+
+
+# Return a warning message if the pool is running low, None otherwise
+def get_usage_warning (usage):
+	if usage.free < WARN_FREE or (usage.days_left is not None and usage.days_left < WARN_DAYS_LEFT):
+		return "Address pool running low! %s" % format_usage (usage)
+
+	return None
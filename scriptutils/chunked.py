@@ -0,0 +1,262 @@
+#!/usr/bin/python3
+
+#
+# Split large script runs into chunks which are executed as independent RQ jobs.
+#
+# A script calls enqueue_chunks() with a list of picklable chunks (IDs, not model
+# instances) and the name of one of its methods.  Every chunk is run in its own
+# job and transaction by run_chunk(), which instantiates the script class in the
+# worker and calls the method with the chunk.  A collector job depending on all
+# chunk jobs aggregates their results and logs, and appends them to the NetBox
+# job of the script run (identified by the ID of the RQ job running the script,
+# which NetBox uses as Job.job_id), which is marked as failed if any of the chunks
+# failed.  If NetBox hasn't completed that job yet, the update is retried later
+# via the RQ scheduler (which NetBox's rqworker runs) instead of blocking a worker.
+#
+# Like NetBox does for the script run itself, every chunk runs with change
+# logging enabled on behalf of the user who started the script, and with the
+# ID of the originating request, so all changes show up in the change log
+# (and trigger webhooks / event rules) as part of that request.
+#
+# The script module has to be importable by the RQ workers, which is the case
+# when SCRIPTS_ROOT is on the Python path (as required for scriptutils anyway).
+#
+
+import datetime
+import importlib
+import logging
+import uuid
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.utils import timezone
+
+import django_rq
+from rq import get_current_job
+from rq.job import Dependency, Job
+
+try:
+	from netbox.context_managers import event_tracking as change_logging
+except ImportError:
+	try:
+		from netbox.context_managers import change_logging
+	except ImportError:
+		from extras.context_managers import change_logging
+
+try:
+	from utilities.request import NetBoxFakeRequest
+except ImportError:
+	from utilities.utils import NetBoxFakeRequest
+
+try:
+	from core.choices import JobStatusChoices
+	from core.models import Job as NetBoxJob
+except ImportError:
+	from extras.choices import JobResultStatusChoices as JobStatusChoices
+	from extras.models import JobResult as NetBoxJob
+
+QUEUE_NAME = "default"
+
+# Keep chunk results around long enough for the collector to pick them up
+CHUNK_TIMEOUT = 1800
+RESULT_TTL = 7 * 86400
+
+# Retry updating the job of the script run every PARENT_JOB_RETRY_DELAY
+# seconds, until NetBox has completed it
+PARENT_JOB_RETRY_DELAY = 10
+PARENT_JOB_RETRIES = 60
+
+logger = logging.getLogger ('scriptutils.chunked')
+
+
+class _Rollback (Exception):
+	pass
+
+
+def chunks (items, size):
+	items = list (items)
+	return [items[i:i + size] for i in range (0, len (items), size)]
+
+
+# Return the log entries of a script instance as list of (level, message) tuples.
+# NetBox 3.x keeps them in script.log, NetBox 4.x in script.messages.
+def get_log_entries (script):
+	messages = getattr (script, 'messages', None)
+	if messages is not None:
+		return [(m.get ('status'), m.get ('message')) for m in messages]
+
+	return [(str (level), str (msg)) for level, msg in getattr (script, 'log', [])]
+
+
+# Build a request on behalf of the given user, as NetBox does for script jobs
+def get_fake_request (user_id, request_id):
+	return NetBoxFakeRequest ({
+		'META' : {},
+		'POST' : {},
+		'GET' : {},
+		'FILES' : {},
+		'user' : get_user_model ().objects.get (pk = user_id),
+		'path' : '',
+		'id' : request_id or uuid.uuid4 (),
+	})
+
+
+def run_chunk (module_name, class_name, method_name, label, chunk, commit, user_id, request_id = None):
+	module = importlib.import_module (module_name)
+	script = getattr (module, class_name) ()
+	script.request = get_fake_request (user_id, request_id)
+
+	ok = True
+	try:
+		with transaction.atomic (), change_logging (script.request):
+			getattr (script, method_name) (chunk)
+
+			if not commit:
+				raise _Rollback ()
+	except _Rollback:
+		script.log_info ("Database changes of chunk %s have been reverted (commit not set)." % label)
+	except Exception as e:
+		script.log_failure ("Chunk %s failed, changes reverted: %s" % (label, e))
+		ok = False
+
+	return {
+		'label' : label,
+		'ok' : ok,
+		'log' : get_log_entries (script),
+	}
+
+
+def _job_result (job):
+	# Job.return_value () was added with RQ 1.12, Job.result is deprecated since
+	if hasattr (job, 'return_value'):
+		return job.return_value ()
+
+	return job.result
+
+
+# Log entry in the format of the given job log: dicts on NetBox 4.x, [level, message] lists before
+def _log_entry (log, level, message):
+	if log and isinstance (log[0], dict):
+		return {'time' : timezone.now ().isoformat (), 'status' : level, 'message' : message, 'obj' : None, 'url' : None}
+
+	return [level, message]
+
+
+def format_summary (summary):
+	return "%d of %d chunks succeeded, %d failed." % (summary['ok'], summary['ok'] + summary['failed'], summary['failed'])
+
+
+# Append the logs and summary of all chunks to the NetBox job of the script run.
+#
+# NetBox completes that job as soon as the script returned, and saves its log
+# then, so the update is rescheduled until that happened, to not have the
+# results overwritten.
+def update_parent_job (parent_job_id, summary, queue_name = QUEUE_NAME, attempt = 0):
+	job = NetBoxJob.objects.filter (job_id = parent_job_id).first ()
+	if job is None:
+		logger.error ("Job %s of the script run not found, can't add results: %s", parent_job_id, format_summary (summary))
+		raise LookupError ("Job %s of the script run not found!" % parent_job_id)
+
+	if not job.completed:
+		if attempt >= PARENT_JOB_RETRIES:
+			logger.error ("Job %s of the script run didn't complete, can't add results: %s", parent_job_id, format_summary (summary))
+			raise TimeoutError ("Job %s of the script run didn't complete!" % parent_job_id)
+
+		django_rq.get_queue (queue_name).enqueue_in (
+			datetime.timedelta (seconds = PARENT_JOB_RETRY_DELAY),
+			update_parent_job,
+			args = (parent_job_id, summary, queue_name, attempt + 1),
+			result_ttl = RESULT_TTL,
+		)
+		return
+
+	data = job.data if isinstance (job.data, dict) else {}
+	log = data.setdefault ('log', [])
+	for chunk in summary['chunks']:
+		for level, message in chunk['log']:
+			log.append (_log_entry (log, level, "[%s] %s" % (chunk['label'], message)))
+
+	text = format_summary (summary)
+	log.append (_log_entry (log, 'failure' if summary['failed'] else 'success', "Background jobs done: %s" % text))
+	data['output'] = "\n".join (filter (None, [data.get ('output'), text]))
+
+	job.data = data
+	if summary['failed']:
+		job.status = JobStatusChoices.STATUS_FAILED
+	job.save ()
+
+
+def collect_chunks (job_ids, queue_name = QUEUE_NAME, parent_job_id = None):
+	connection = django_rq.get_connection (queue_name)
+
+	results = []
+	for job_id in job_ids:
+		try:
+			job = Job.fetch (job_id, connection = connection)
+		except Exception as e:
+			results.append ({'label' : job_id, 'ok' : False, 'log' : [('failure', "Job vanished: %s" % e)]})
+			continue
+
+		res = _job_result (job)
+		if res is None:
+			res = {
+				'label' : job_id,
+				'ok' : False,
+				'log' : [('failure', "Job ended with status %s" % job.get_status ())],
+			}
+
+		results.append (res)
+
+	summary = {
+		'ok' : len ([r for r in results if r['ok']]),
+		'failed' : len ([r for r in results if not r['ok']]),
+		'chunks' : results,
+	}
+
+	if parent_job_id:
+		update_parent_job (parent_job_id, summary, queue_name)
+
+	return summary
+
+
+# Enqueue one job per chunk plus a collector job which runs after all of them.
+#
+# label_fn is called with a chunk and should return a short human readable
+# description of it to be used in the logs.  Returns the collector job and the
+# list of chunk jobs.
+def enqueue_chunks (script, method_name, chunk_list, commit, label_fn = str, queue_name = QUEUE_NAME):
+	request = getattr (script, 'request', None)
+	if request is None or not getattr (request, 'user', None) or not request.user.pk:
+		raise ValueError ("Can't run chunks without the user the script runs for (script.request.user)!")
+
+	# NetBox uses the ID of the RQ job running the script as Job.job_id
+	current_job = get_current_job ()
+	parent_job_id = current_job.id if current_job else None
+	if parent_job_id is None:
+		script.log_warning ("Not running as background job, results of the chunks won't be added to this job.")
+
+	queue = django_rq.get_queue (queue_name)
+	module_name = type (script).__module__
+	class_name = type (script).__name__
+
+	chunk_jobs = []
+	for chunk in chunk_list:
+		label = label_fn (chunk)
+		chunk_jobs.append (queue.enqueue (
+			run_chunk,
+			args = (module_name, class_name, method_name, label, chunk, commit, request.user.pk, getattr (request, 'id', None)),
+			job_timeout = CHUNK_TIMEOUT,
+			result_ttl = RESULT_TTL,
+			description = "%s.%s: %s" % (class_name, method_name, label),
+		))
+
+	collector = queue.enqueue (
+		collect_chunks,
+		args = ([j.id for j in chunk_jobs], queue_name, parent_job_id),
+		depends_on = Dependency (jobs = chunk_jobs, allow_failure = True),
+		job_timeout = CHUNK_TIMEOUT,
+		result_ttl = RESULT_TTL,
+		description = "%s: collect results of %d chunks" % (class_name, len (chunk_jobs)),
+	)
+
+	return collector, chunk_jobs
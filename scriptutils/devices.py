@@ -0,0 +1,164 @@
+#!/usr/bin/python3
+
+#
+# Create many devices of the same DeviceType in one go.
+#
+# Device.save () instantiates all components from the DeviceType templates for
+# every single device, querying the templates each time and looking up the rear
+# port of every front port (and power port of every power outlet) one by one.
+# bulk_create_devices () loads the templates once, creates all devices with one
+# insert, and then creates all components of a kind for all devices at once,
+# in the same order Device.save () does.  Like NetBox does, post_save is sent
+# for every new device and component, so the change log is kept.  Components
+# which are MPTT nodes (module bays on NetBox >= 4.1, inventory items) can't be
+# bulk created and are saved one by one, as NetBox does.  Like Device.save (),
+# the platform and airflow defaults of the DeviceType are inherited and custom
+# field defaults are set on all components.
+#
+
+import copy
+
+from django.db.models.signals import post_save
+
+from dcim.models import Device, PowerPort, RearPort
+from extras.models import CustomField
+
+from scriptutils.bulk import bulk_create
+
+# Template relations in the order Device.save () instantiates them
+COMPONENT_TEMPLATES = [
+	'consoleporttemplates',
+	'consoleserverporttemplates',
+	'powerporttemplates',
+	'poweroutlettemplates',
+	'interfacetemplates',
+	'rearporttemplates',
+	'frontporttemplates',
+	'modulebaytemplates',
+	'devicebaytemplates',
+]
+
+# Template relations referring to other components of the same device,
+# mapped to the model of the referred to component
+TEMPLATE_REFERENCES = {
+	'frontporttemplates' : ('rear_port', RearPort),
+	'poweroutlettemplates' : ('power_port', PowerPort),
+}
+
+# Template relations of components which are MPTT nodes (ModuleBay on NetBox >= 4.1)
+MPTT_TEMPLATES = [
+	'modulebaytemplates',
+]
+
+
+def _instantiate (templates, devices, reference = None):
+	if reference is None:
+		return [template.instantiate (device = dev) for dev in devices for template in templates]
+
+	# Instantiate from a copy without the reference, which would be looked
+	# up per component otherwise, and set it from one bulk query instead.
+	field, model = reference
+	referred = {(obj.device_id, obj.name) : obj for obj in model.objects.filter (device__in = devices)}
+
+	components = []
+	for template in templates:
+		ref = getattr (template, field)
+		tmpl = copy.copy (template)
+		setattr (tmpl, field, None)
+
+		for dev in devices:
+			component = tmpl.instantiate (device = dev)
+			if ref is not None:
+				setattr (component, field, referred[(dev.pk, ref.name)])
+			components.append (component)
+
+	return components
+
+
+# Custom field defaults Device.save () sets on new components of the given model
+# (NetBox >= 4.0, older versions don't set any)
+def _cf_defaults (model):
+	get_defaults = getattr (CustomField.objects, 'get_defaults_for_model', None)
+	if get_defaults is None:
+		return {}
+
+	return get_defaults (model)
+
+
+def _set_cf_defaults (components, cf_defaults):
+	if cf_defaults:
+		for component in components:
+			component.custom_field_data = dict (cf_defaults)
+
+	return components
+
+
+def bulk_create_devices (devices):
+	devices = list (devices)
+	if not devices:
+		return devices
+
+	device_type = devices[0].device_type
+	if any (dev.device_type_id != device_type.pk for dev in devices):
+		raise ValueError ("All devices have to be of the same DeviceType!")
+
+	# Attributes Device.save () inherits on creation
+	for dev in devices:
+		if hasattr (dev, 'airflow') and not dev.airflow:
+			dev.airflow = device_type.airflow
+		if not dev.platform_id and getattr (device_type, 'default_platform_id', None):
+			dev.platform_id = device_type.default_platform_id
+		if dev.rack and getattr (dev.rack, 'location', None):
+			dev.location = dev.rack.location
+
+	devices = bulk_create (Device, devices)
+
+	for relation in COMPONENT_TEMPLATES:
+		if not hasattr (device_type, relation):
+			continue
+
+		reference = TEMPLATE_REFERENCES.get (relation)
+		templates = getattr (device_type, relation).all ()
+		if reference:
+			templates = templates.select_related (reference[0])
+
+		templates = list (templates)
+		if not templates:
+			continue
+
+		components = _instantiate (templates, devices, reference)
+		model = type (components[0])
+		_set_cf_defaults (components, _cf_defaults (model))
+
+		if relation in MPTT_TEMPLATES and hasattr (model, 'tree_id'):
+			for component in components:
+				component.save ()
+			continue
+
+		model.objects.bulk_create (components)
+
+		# Interfaces may be bridged to other interfaces of the same device (NetBox >= 3.6)
+		bridges = {t.name : t.bridge_id for t in templates if getattr (t, 'bridge_id', None)}
+		if bridges:
+			names = {t.pk : t.name for t in templates}
+			by_name = {(c.device_id, c.name) : c for c in components}
+			bridged = [c for c in components if c.name in bridges]
+			for component in bridged:
+				component.bridge = by_name[(component.device_id, names[bridges[component.name]])]
+			model.objects.bulk_update (bridged, ['bridge'])
+
+		for component in components:
+			post_save.send (sender = model, instance = component, created = True, raw = False, using = 'default', update_fields = None)
+
+	# Inventory items are MPTT nodes and can't be bulk created (NetBox doesn't either)
+	if hasattr (device_type, 'inventoryitemtemplates'):
+		cf_defaults = None
+		for template in device_type.inventoryitemtemplates.all ():
+			for dev in devices:
+				item = template.instantiate (device = dev)
+				if cf_defaults is None:
+					cf_defaults = _cf_defaults (type (item))
+				_set_cf_defaults ([item], cf_defaults)
+				item.save ()
+
+	return devices
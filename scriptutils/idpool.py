@@ -0,0 +1,53 @@
+#!/usr/bin/python3
+
+#
+# Pool of numeric IDs (node IDs, mgmt IDs, ...) backed by an integer bitmap.
+#
+# The IDs in use are usually derived from objects loaded with one query, the
+# pool then hands out the lowest free IDs, one at a time or in blocks for
+# batch runs.  IDs handed out are marked as used.
+#
+
+class PoolExhaustedError (Exception):
+	pass
+
+
+class IdPool (object):
+	def __init__ (self, first, last):
+		self.first = first
+		self.last = last
+		self.used = 0
+		self.mask = (1 << (last - first + 1)) - 1
+
+	def _bit (self, id):
+		return 1 << (id - self.first)
+
+	def contains (self, id):
+		return self.first <= id <= self.last
+
+	def mark_used (self, id):
+		if self.contains (id):
+			self.used |= self._bit (id)
+
+	def is_free (self, id):
+		return self.contains (id) and not self.used & self._bit (id)
+
+	def num_free (self):
+		return bin (~self.used & self.mask).count ('1')
+
+	# Return the lowest count free IDs and mark them as used
+	def allocate (self, count = 1):
+		ids = []
+		free = ~self.used & self.mask
+		while len (ids) < count:
+			if not free:
+				raise PoolExhaustedError ("Only %d of %d IDs available between %d and %d." % (len (ids), count, self.first, self.last))
+
+			lowest = free & -free
+			ids.append (self.first + lowest.bit_length () - 1)
+			free ^= lowest
+
+		for id in ids:
+			self.mark_used (id)
+
+		return ids
@@ -0,0 +1,170 @@
+#!/usr/bin/python3
+
+#
+# Buffered job logging for scripts which would otherwise log one line per object.
+#
+# NetBox stores all log lines of a script run together with the job, so a run
+# connecting thousands of ports ends up with a huge job row and a job page which
+# takes ages to render.  A JobLog buffers all entries, collapses entries sharing
+# the same key into counters, and only hands a limited number of detail lines to
+# the script log when flushed.  The full log can still be retrieved as text via
+# full_text(), or stored as a file in NetBox's media storage via save_full_text(),
+# which keeps it out of the job data and links it from the job log.
+#
+# Full log files are named after the ID of the NetBox job they belong to (the ID
+# of the RQ job running the script), and only written if detail lines have been
+# suppressed.  Whenever one is saved, the files of jobs which don't exist anymore
+# (e.g. removed by NetBox's housekeeping after JOB_RETENTION days) are deleted.
+#
+
+import collections
+import os
+import uuid
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+from rq import get_current_job
+
+try:
+	from core.models import Job as NetBoxJob
+except ImportError:
+	from extras.models import JobResult as NetBoxJob
+
+LEVELS = ('info', 'success', 'warning', 'failure')
+
+DEFAULT_DETAIL_LIMIT = 50
+
+# Directory within the media storage full logs are saved to
+FULL_LOG_DIR = "script-logs"
+
+
+class JobLog (object):
+	def __init__ (self, script, detail_limit = DEFAULT_DETAIL_LIMIT):
+		self.script = script
+		self.detail_limit = detail_limit
+
+		# List of (level, key, message) tuples in order of occurrence
+		self.entries = []
+		self.counts = collections.Counter ()
+		self.key_level = {}
+
+	def _add (self, level, message, key):
+		self.entries.append ((level, key, str (message)))
+
+		if key is None:
+			return
+
+		self.counts[key] += 1
+		if LEVELS.index (level) > LEVELS.index (self.key_level.get (key, 'info')):
+			self.key_level[key] = level
+
+	def info (self, message, key = None):
+		self._add ('info', message, key)
+
+	def success (self, message, key = None):
+		self._add ('success', message, key)
+
+	def warning (self, message, key = None):
+		self._add ('warning', message, key)
+
+	def failure (self, message, key = None):
+		self._add ('failure', message, key)
+
+	def count (self, key):
+		return self.counts[key]
+
+	def _emit (self, level, message):
+		getattr (self.script, "log_%s" % level) (message)
+
+	# Hand buffered entries over to the script log.
+	#
+	# Entries without a key are always passed through.  Keyed entries are passed
+	# through until detail_limit is reached, the remainder is only represented by
+	# the summary.  The summary is a format string which is filled with the
+	# counters of all keys, e.g. "Connected {connected} rear ports, {skipped} skipped.",
+	# and logged with the most severe level of all keyed entries.  Without a
+	# summary format, one "<key>: <count>" line per key is logged instead.
+	def flush (self, summary = None):
+		details = 0
+		suppressed = 0
+
+		for level, key, message in self.entries:
+			if key is not None:
+				if self.detail_limit is not None and details >= self.detail_limit:
+					suppressed += 1
+					continue
+				details += 1
+
+			self._emit (level, message)
+
+		if suppressed:
+			self._emit ('info', "%d more log entries suppressed, limit of %d detail entries reached." % (suppressed, self.detail_limit))
+
+		if summary is not None:
+			level = 'info'
+			for key_level in self.key_level.values ():
+				if LEVELS.index (key_level) > LEVELS.index (level):
+					level = key_level
+
+			self._emit (level, summary.format_map (collections.defaultdict (int, self.counts)))
+		else:
+			for key, cnt in self.counts.items ():
+				self._emit (self.key_level[key], "%s: %d" % (key, cnt))
+
+		self.entries = []
+
+	# Render all entries seen so far, regardless of any limit, one per line.
+	# Note that flush() drops the buffer, so call this before flushing.
+	def full_text (self):
+		return "\n".join ("[%s] %s" % (level, message) for level, key, message in self.entries)
+
+	# Number of keyed entries flush() won't pass through to the script log
+	def num_suppressed (self):
+		if self.detail_limit is None:
+			return 0
+
+		return max (0, len ([entry for entry in self.entries if entry[1] is not None]) - self.detail_limit)
+
+	# Save the full_text() to a file in the media storage, named after the job, and
+	# log a link to it, if flush() would suppress any entries.  Returns the URL or None.
+	def save_full_text (self):
+		if not self.num_suppressed ():
+			return None
+
+		job = get_current_job ()
+		path = "%s/%s.log" % (FULL_LOG_DIR, job.id if job else uuid.uuid4 ())
+		if default_storage.exists (path):
+			default_storage.delete (path)
+
+		path = default_storage.save (path, ContentFile (self.full_text ().encode ()))
+		url = default_storage.url (path)
+		self._emit ('info', "Full log saved to [%s](%s)" % (os.path.basename (path), url))
+
+		delete_orphaned_full_logs ()
+
+		return url
+
+
+# Delete full log files of jobs which don't exist anymore
+def delete_orphaned_full_logs ():
+	try:
+		files = default_storage.listdir (FULL_LOG_DIR)[1]
+	except (FileNotFoundError, NotImplementedError):
+		return
+
+	job_ids = {os.path.splitext (name)[0] : name for name in files}
+	existing = {str (job_id) for job_id in NetBoxJob.objects.filter (job_id__in = [
+		job_id for job_id in job_ids if _is_uuid (job_id)]).values_list ('job_id', flat = True)}
+
+	for job_id, name in job_ids.items ():
+		if job_id not in existing:
+			default_storage.delete ("%s/%s" % (FULL_LOG_DIR, name))
+
+
+def _is_uuid (value):
+	try:
+		uuid.UUID (value)
+		return True
+	except ValueError:
+		return False
@@ -0,0 +1,41 @@
+#!/usr/bin/python3
+
+#
+# Serialize allocations from shared pools across concurrent jobs.
+#
+# Allocators read the children of a container and then create a new prefix,
+# so two jobs running in parallel could pick the same free prefix (there is no
+# uniqueness constraint on prefixes).  lock_prefix_allocation () takes the same
+# PostgreSQL advisory lock NetBox's available-prefixes API endpoint uses, as a
+# transaction level lock.  It's held until the surrounding transaction is
+# committed or rolled back, so the next allocator sees the new prefix.
+#
+# Node IDs of backbone routers are derived from their loopback IPs, which are
+# not unique either, so lock_node_id_allocation () serializes picking them the
+# same way, with a lock of its own.
+#
+
+from django.db import connection
+
+try:
+	from netbox.constants import ADVISORY_LOCK_KEYS
+except ImportError:
+	ADVISORY_LOCK_KEYS = {}
+
+AVAILABLE_PREFIXES_LOCK_KEY = ADVISORY_LOCK_KEYS.get ('available-prefixes', 100100)
+
+# Not used by NetBox (whose keys are 1xxxxx)
+NODE_ID_LOCK_KEY = 200100
+
+
+def _lock (key):
+	with connection.cursor () as cursor:
+		cursor.execute ("SELECT pg_advisory_xact_lock (%s)", [key])
+
+
+def lock_prefix_allocation ():
+	_lock (AVAILABLE_PREFIXES_LOCK_KEY)
+
+
+def lock_node_id_allocation ():
+	_lock (NODE_ID_LOCK_KEY)
@@ -0,0 +1,90 @@
+#!/usr/bin/python3
+
+#
+# Integer arithmetic for carving fixed length prefixes out of containers and
+# counting the free ones.
+#
+# Prefix.get_available_prefixes () builds a netaddr IPSet of the container
+# minus all children and iter_cidrs () then walks the result.  For IPv6 /48
+# containers holding lots of sparse /64s this is expensive, while all we want
+# to know is the first gap of a given size.  Prefixes are handled as
+# (first, last) tuples of integer addresses here instead.
+#
+
+ADDR_BITS_BY_AF = {
+	4: 32,
+	6: 128,
+}
+
+
+# Convert an iterable of netaddr.IPNetwork objects into a sorted list of
+# (first, last) integer tuples.
+def prefix_ranges (networks):
+	return sorted ((net.first, net.last) for net in networks)
+
+
+def align_up (addr, size):
+	return -(-addr // size) * size
+
+
+# Return the first address of the first free prefix of length plen within
+# first..last which doesn't overlap any of the children, or None if there is
+# no such prefix.  children has to be a list of (first, last) tuples sorted by
+# first address, as returned by prefix_ranges ().  Nested children are fine.
+def first_free_prefix (first, last, children, plen, af):
+	size = 1 << (ADDR_BITS_BY_AF[af] - plen)
+	cursor = align_up (first, size)
+
+	for child_first, child_last in children:
+		if child_last < cursor:
+			continue
+
+		# Gap in front of this child is big enough
+		if child_first >= cursor + size:
+			break
+
+		cursor = align_up (child_last + 1, size)
+
+	if cursor + size - 1 <= last:
+		return cursor
+
+	return None
+
+
+# Merge overlapping or adjacent (first, last) ranges, input has to be sorted
+def merge_ranges (ranges):
+	merged = []
+	for first, last in ranges:
+		if merged and first <= merged[-1][1] + 1:
+			if last > merged[-1][1]:
+				merged[-1][1] = last
+			continue
+
+		merged.append ([first, last])
+
+	return merged
+
+
+# Number of aligned blocks of the given size fully within first..last
+def count_blocks (first, last, size):
+	if last < first:
+		return 0
+
+	return max (0, (last + 1) // size - align_up (first, size) // size)
+
+
+# Return the total number of prefixes of length plen within first..last and
+# the number of those not overlapping any of the children.  children has to be
+# a list of (first, last) tuples sorted by first address.
+def count_free_prefixes (first, last, children, plen, af):
+	size = 1 << (ADDR_BITS_BY_AF[af] - plen)
+
+	free = 0
+	cursor = first
+	for child_first, child_last in merge_ranges (children):
+		free += count_blocks (cursor, min (child_first - 1, last), size)
+		cursor = max (cursor, child_last + 1)
+
+	free += count_blocks (cursor, last, size)
+
+	return count_blocks (first, last, size), free
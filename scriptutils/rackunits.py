@@ -0,0 +1,102 @@
+#!/usr/bin/python3
+
+#
+# Occupancy aware placement of devices within racks.
+#
+# The occupied units of a rack are kept as one integer bitmap per rack face,
+# bit 0 representing the lowest unit.  Full depth devices occupy both faces.
+# load_rack_units () fetches the devices of any number of racks with one query,
+# so the same allocator can be used to fill many racks in a batch rollout.
+#
+
+import math
+
+FACES = ('front', 'rear')
+
+
+class RackFullError (Exception):
+	pass
+
+
+class RackUnits (object):
+	def __init__ (self, u_height, starting_unit = 1):
+		self.u_height = int (u_height)
+		self.starting_unit = int (starting_unit)
+		self.top_unit = self.starting_unit + self.u_height - 1
+		self.occupied = {face : 0 for face in FACES}
+
+	def _faces (self, face, full_depth):
+		return FACES if full_depth or face not in FACES else (face,)
+
+	# First and last unit touched by a device of the given height at the given
+	# position.  Positions and heights may be fractional (half units).
+	def _units (self, position, height):
+		first = int (math.floor (position))
+		last = max (first, int (math.ceil (position + height)) - 1)
+		return first, last
+
+	def _mask (self, position, height):
+		first, last = self._units (position, height)
+		return ((1 << (last - first + 1)) - 1) << (first - self.starting_unit)
+
+	def occupy (self, position, height, face, full_depth = False):
+		for f in self._faces (face, full_depth):
+			self.occupied[f] |= self._mask (position, height)
+
+	def is_free (self, position, height, face, full_depth = False):
+		first, last = self._units (position, height)
+		if first < self.starting_unit or last > self.top_unit:
+			return False
+
+		mask = self._mask (position, height)
+		return not any (self.occupied[f] & mask for f in self._faces (face, full_depth))
+
+	# Return the highest free position for a device of the given height, which
+	# doesn't reach above unit top (defaults to the top of the rack), or None.
+	def find_free (self, height, face, full_depth = False, top = None):
+		if top is None:
+			top = self.top_unit
+
+		height = max (int (math.ceil (height)), 1)
+		for position in range (min (top, self.top_unit) - height + 1, self.starting_unit - 1, -1):
+			if self.is_free (position, height, face, full_depth):
+				return position
+
+		return None
+
+	# Place devices top down, given as list of (height, full_depth) tuples, keeping
+	# gap units free between them where possible, and return their positions.
+	# Positions found are marked as occupied.
+	def place (self, devices, face, gap = 1):
+		positions = []
+		top = self.top_unit
+
+		for height, full_depth in devices:
+			position = self.find_free (height, face, full_depth, top)
+			if position is None:
+				position = self.find_free (height, face, full_depth)
+			if position is None:
+				raise RackFullError ("No free slot for a %sU device left in rack." % height)
+
+			self.occupy (position, height, face, full_depth)
+			positions.append (position)
+			top = position - 1 - gap
+
+		return positions
+
+
+# Load the occupied units of all given racks, returns a dict rack ID -> RackUnits
+def load_rack_units (racks):
+	from dcim.models import Device
+
+	units = {rack.id : RackUnits (rack.u_height, getattr (rack, 'starting_unit', 1)) for rack in racks}
+
+	devices = Device.objects.filter (
+		rack_id__in = list (units),
+		position__isnull = False,
+	).values_list ('rack_id', 'position', 'face', 'device_type__u_height', 'device_type__is_full_depth')
+
+	for rack_id, position, face, height, full_depth in devices:
+		units[rack_id].occupy (float (position), float (height), face, full_depth)
+
+	return units
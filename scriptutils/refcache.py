@@ -0,0 +1,23 @@
+#!/usr/bin/python3
+
+#
+# Per run cache for reference objects (roles, tags, VRFs, device types, ...).
+#
+# Scripts look up the same reference objects over and over again, once per
+# tunnel or device, which adds up in batch runs.  Mixing ReferenceCache into a
+# script class caches them on the script instance, so every object is queried
+# at most once per run and nothing is loaded before it's needed.  NetBox
+# creates a new script instance for every job, so there is no stale data
+# across runs.
+#
+
+class ReferenceCache (object):
+	# Like model.objects.get (**filters), raising model.DoesNotExist if there's no match
+	def get_ref (self, model, **filters):
+		cache = self.__dict__.setdefault ('_ref_cache', {})
+		key = (model, tuple (sorted (filters.items ())))
+
+		if key not in cache:
+			cache[key] = model.objects.get (**filters)
+
+		return cache[key]
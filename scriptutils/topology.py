@@ -0,0 +1,106 @@
+#!/usr/bin/python3
+
+#
+# In-memory cable topology of a site, for verifying end-to-end paths.
+#
+# All cable terminations touching the site, as well as interfaces and front and
+# rear ports (including their mapping) are loaded with a few bulk queries into
+# an adjacency graph, which allows tracing all paths of the site at once instead
+# of calling the trace API once per port.  Graphs are cached, keyed by the site
+# and the time of the latest change to any cabling related object of the site.
+#
+# The graph itself and path tracing live in scriptutils.cablegraph.
+#
+
+import collections
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db.models import Max, Q
+
+from dcim.models import Cable, CableTermination, Device, FrontPort, Interface, RearPort
+
+try:
+	from core.models import ObjectChange
+except ImportError:
+	from extras.models import ObjectChange
+
+from scriptutils.cablegraph import Topology
+
+CACHE_TIMEOUT = 86400
+
+
+# Return the time of the latest change to any cabling related object of the given site
+def get_last_change (site):
+	content_types = ContentType.objects.get_for_models (Cable, Device, FrontPort, Interface, RearPort)
+	devices = Device.objects.filter (site = site).values ('pk')
+	cables = CableTermination.objects.filter (_site = site).values ('cable_id')
+
+	# Devices of the site (now or before the change), their components, and cables of the site
+	changes = Q (changed_object_type = content_types[Device], changed_object_id__in = devices) | \
+		Q (changed_object_type = content_types[Device], prechange_data__site = site.pk) | \
+		Q (related_object_type = content_types[Device], related_object_id__in = devices) | \
+		Q (changed_object_type = content_types[Cable], changed_object_id__in = cables)
+
+	# Cable terminations are related to their port
+	for model in (FrontPort, Interface, RearPort):
+		ports = model.objects.filter (device__site = site).values ('pk')
+		changes |= Q (related_object_type = content_types[model], related_object_id__in = ports)
+
+	return ObjectChange.objects.filter (changes).aggregate (last = Max ('time'))['last']
+
+
+def load_topology (site):
+	content_types = ContentType.objects.get_for_models (Interface, FrontPort, RearPort)
+	kinds = {ct.pk : ct.model for ct in ContentType.objects.all ()}
+
+	# All terminations of all cables with at least one end in this site
+	site_cables = CableTermination.objects.filter (_site = site).values ('cable_id')
+	terms = CableTermination.objects.filter (cable_id__in = site_cables).values_list ('cable_id', 'cable_end', 'termination_type_id', 'termination_id')
+
+	cables = collections.defaultdict (lambda: {'A' : [], 'B' : []})
+	far_ids = collections.defaultdict (set)
+	for cable_id, cable_end, type_id, term_id in terms:
+		node = (kinds[type_id], term_id)
+		cables[cable_id][cable_end].append (node)
+		far_ids[node[0]].add (term_id)
+
+	cable_peers = {}
+	for ends in cables.values ():
+		for node in ends['A']:
+			cable_peers[node] = ends['B']
+		for node in ends['B']:
+			cable_peers[node] = ends['A']
+
+	# Ports of this site plus the ones on the far end of cables leaving it
+	names = {}
+	front_to_rear = {}
+	rear_positions = {}
+
+	for model, fields in [(Interface, ()), (FrontPort, ('rear_port_id', 'rear_port_position')), (RearPort, ('positions',))]:
+		kind = content_types[model].model
+		ports = model.objects.filter (Q (device__site = site) | Q (pk__in = far_ids[kind])).values_list ('pk', 'device__name', 'name', *fields)
+
+		for port in ports:
+			names[(kind, port[0])] = "%s:%s" % (port[1], port[2])
+			if model == FrontPort:
+				front_to_rear[port[0]] = (port[3], port[4])
+			elif model == RearPort:
+				rear_positions[port[0]] = port[3]
+
+	return Topology (cable_peers, front_to_rear, rear_positions, names)
+
+
+# Return the (possibly cached) Topology of the given site
+def get_topology (site):
+	key = "scriptutils.topology.%d" % site.pk
+	last_change = get_last_change (site)
+
+	cached = cache.get (key)
+	if cached and cached[0] == last_change:
+		return cached[1]
+
+	topology = load_topology (site)
+	cache.set (key, (last_change, topology), CACHE_TIMEOUT)
+
+	return topology
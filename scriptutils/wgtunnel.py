@@ -0,0 +1,107 @@
+#!/usr/bin/python3
+
+#
+# Wireguard tunnel conventions (naming, addressing, keys) which don't need
+# NetBox, shared by the Wireguard script and the standalone API client.
+#
+
+import base64
+import binascii
+import hashlib
+
+prefix_length_by_af = {
+	4: 31,
+	6: 64,
+}
+
+ip_mask_by_af = {
+	4: 31,
+	6: 126,
+}
+
+# Offsets of server and client IP within the transfer network
+ip_offsets_by_af = {
+	4: (0, 1),
+	6: (1, 2),
+}
+
+infra_suffix = ".in.ffho.net"
+
+PREFIX_ROLE_SLUG_REGULAR = "vpn-x-connect"
+PREFIX_ROLE_SLUG_OOBM = "vpn-oobm"
+VRF_NAME_OOBM = "vrf_oobm"
+
+IFACE_NAME_MAX_LEN = 15
+
+# Names of tunnel interfaces start with one of these (see get_iface_name ())
+TUNNEL_IFACE_PREFIXES = ("wg-", "oob-")
+
+
+class IfaceNameError (Exception):
+	pass
+
+
+def get_prefix_desc (server, client):
+	server = server.replace (infra_suffix, "")
+	client = client.replace (infra_suffix, "")
+
+	return "%s <-> %s" % (server, client)
+
+
+def get_iface_name (node_name, tun):
+	prefix = "wg"
+	if tun['oobm']:
+		prefix = "oob"
+
+	node = node_name.replace (infra_suffix, "")
+	if_name = "%s-%s" % (prefix, node.replace ('.', '-'))
+	if len (if_name) > IFACE_NAME_MAX_LEN:
+		if_name = if_name[0:IFACE_NAME_MAX_LEN]
+
+	return if_name
+
+
+def is_tunnel_iface_name (if_name):
+	return if_name.startswith (TUNNEL_IFACE_PREFIXES)
+
+
+def get_hashed_iface_name (if_name, peer_name, hash_len):
+	digest = hashlib.sha1 (peer_name.encode ()).hexdigest ()[:hash_len]
+	return "%s-%s" % (if_name[:IFACE_NAME_MAX_LEN - hash_len - 1], digest)
+
+
+# Pick a collision free name for the interface towards the given peer.
+#
+# names maps the names of all interfaces of the node to the key of the peer
+# they are linked to (or None), peer_key identifies the peer.  If the name
+# didn't need truncation it's used as is, otherwise the truncated name ends
+# with a hash of the peer name, which only depends on the peer.  Interfaces not
+# linked to any peer yet may be adopted.  Raises IfaceNameError if there's no
+# usable name.
+def pick_iface_name (names, peer_key, peer_name, oobm):
+	prefix = "oob" if oobm else "wg"
+	if_name = base_name = get_iface_name (peer_name, {'oobm' : oobm})
+
+	if len ("%s-%s" % (prefix, peer_name.replace (infra_suffix, ""))) > IFACE_NAME_MAX_LEN:
+		for hash_len in range (4, 9):
+			if_name = get_hashed_iface_name (base_name, peer_name, hash_len)
+			if names.get (if_name) in (None, peer_key):
+				return if_name
+
+		raise IfaceNameError ("Unable to find a free interface name for peer %s!" % peer_name)
+
+	if names.get (if_name) not in (None, peer_key):
+		raise IfaceNameError ("Interface %s is linked to another peer, check its custom fields!" % if_name)
+
+	return if_name
+
+
+def wg_key_valid (key):
+	# Wireguard keys are 32 bytes, base64 encoded
+	if not isinstance (key, str) or len (key) != 44:
+		return False
+
+	try:
+		return len (base64.b64decode (key, validate = True)) == 32
+	except (binascii.Error, ValueError):
+		return False
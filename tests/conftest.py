@@ -0,0 +1,8 @@
+#
+# Make asyncclient and scriptutils importable when running pytest from anywhere.
+#
+
+import os
+import sys
+
+sys.path.insert (0, os.path.join (os.path.dirname (os.path.abspath (__file__)), '..'))
@@ -0,0 +1,211 @@
+#
+# Run the standalone workflows against the in-memory NetBox mock.
+#
+#   python3 -m pytest tests
+#
+
+import asyncio
+import base64
+import collections
+
+import pytest
+
+pytest.importorskip ('aiohttp')
+
+from aiohttp.test_utils import TestServer
+
+from asyncclient.client import NetBoxClient
+from asyncclient.mockserver import MockNetBox
+from asyncclient.workflows import WorkflowError, add_wireguard_tunnel, connect_rear_ports, provision_pop
+
+
+def wg_context (n):
+	key = lambda b: base64.b64encode (bytes ([b]) * 32).decode ()
+	return {'wireguard' : {'privkey' : key (n), 'pubkey' : key (n + 100)}}
+
+
+SEED = {
+	"dcim/sites/" : [{"id" : 1, "name" : "Foo", "slug" : "foo"}],
+	"dcim/device-types/" : [
+		{"id" : 10, "model" : "Patchpanel", "manufacturer" : {"name" : "Telegärtner"}, "u_height" : 1, "is_full_depth" : False},
+		{"id" : 11, "model" : "WS-12-250-AC", "manufacturer" : {"name" : "Netonix"}, "u_height" : 1, "is_full_depth" : False},
+		{"id" : 12, "model" : "APU2", "manufacturer" : {"name" : "PCEngines"}, "u_height" : 1, "is_full_depth" : False},
+		{"id" : 13, "model" : "Surge Protector", "manufacturer" : {"name" : "Ubiquiti"}, "u_height" : 0, "is_full_depth" : False},
+		{"id" : 14, "model" : "Fiber box", "manufacturer" : {"name" : "Generic"}, "u_height" : 1, "is_full_depth" : False},
+	],
+	"templates" : {
+		"11" : {"dcim/interfaces/" : [{"name" : str (n), "type" : "1000base-t"} for n in range (1, 15)] + [{"name" : "po1", "type" : "lag"}]},
+		"12" : {"dcim/interfaces/" : [{"name" : name, "type" : "1000base-t"} for name in ["enp1s0", "enp2s0", "enp3s0", "lo", "bond0"]]},
+		"13" : {"dcim/rear-ports/" : [{"name" : "1", "type" : "8p8c", "positions" : 1}]},
+		"14" : {"dcim/rear-ports/" : [{"name" : str (n), "type" : "lc", "positions" : 1} for n in range (1, 25)]},
+	},
+	"dcim/device-roles/" : [{"name" : name} for name in ["Patchpanel", "Switch", "Backbone router", "Surge Protector"]],
+	"dcim/platforms/" : [{"name" : "Netonix"}, {"name" : "Linux"}],
+	"dcim/rack-roles/" : [{"name" : "Backbone"}],
+	"ipam/roles/" : [
+		{"id" : 50, "name" : "Mgmt", "slug" : "mgmt"},
+		{"id" : 51, "name" : "VPN X-Connect", "slug" : "vpn-x-connect"},
+		{"id" : 52, "name" : "VPN OOBM", "slug" : "vpn-oobm"},
+	],
+	"ipam/aggregates/" : [{"prefix" : "172.30.0.0/16", "description" : "FFHO Management"}],
+	"ipam/prefixes/" : [
+		{"prefix" : "172.30.0.0/24"},
+		{"prefix" : "10.132.128.0/24", "role" : 51, "status" : "container"},
+		{"prefix" : "2a03:2260:2342:fd00::/56", "role" : 51, "status" : "container"},
+		{"prefix" : "10.132.130.0/24", "role" : 52, "status" : "container"},
+		{"prefix" : "2a03:2260:2342:fc00::/56", "role" : 52, "status" : "container"},
+	],
+	"ipam/ip-addresses/" : [{"address" : "10.132.255.1/32"}],
+	"ipam/vrfs/" : [{"name" : "vrf_oobm"}],
+	"extras/tags/" : [{"name" : "Wireguard", "slug" : "wireguard"}],
+	"virtualization/virtual-machines/" : [
+		{"id" : 300 + n, "name" : "gw%02d.in.ffho.net" % n, "local_context_data" : wg_context (n)} for n in range (1, 6)
+	],
+}
+
+
+# Run the coroutine function fn (client, mock) against a fresh mock server
+def run_workflow (fn, seed = SEED):
+	async def run ():
+		mock = MockNetBox (seed)
+		async with TestServer (mock.app) as server:
+			async with NetBoxClient (str (server.make_url ('')), "token", page_size = 10) as client:
+				await fn (client, mock)
+
+		return mock
+
+	return asyncio.run (run ())
+
+
+def object_counts (mock):
+	return {path : len (objs) for path, objs in mock.objects.items ()}
+
+
+def test_connect_rear_ports ():
+	results = []
+
+	async def workflow (client, mock):
+		await client.create ("dcim/devices/", [
+			{"name" : "box-a", "device_type" : 14, "site" : 1},
+			{"name" : "box-b", "device_type" : 14, "site" : 1},
+		])
+
+		results.append (await connect_rear_ports (client, "box-a", "box-b"))
+		results.append (await connect_rear_ports (client, "box-a", "box-b", connected = True))
+
+	mock = run_workflow (workflow)
+
+	assert results == [(24, 0), (0, 24)]
+
+	cables = list (mock.objects["dcim/cables/"].values ())
+	assert len (cables) == 24
+	assert {cable['status'] for cable in cables} == {'planned'}
+	assert all (port.get ('cable') for port in mock.objects["dcim/rear-ports/"].values ())
+
+	# Port n of box A is connected to port n of box B
+	ports = mock.objects["dcim/rear-ports/"]
+	for cable in cables:
+		a_port = ports[cable['a_terminations'][0]['object_id']]
+		b_port = ports[cable['b_terminations'][0]['object_id']]
+		assert a_port['name'] == b_port['name']
+		assert a_port['device'] != b_port['device']
+
+
+def test_concurrent_wireguard_tunnels_get_distinct_prefixes ():
+	peers = ["gw%02d.in.ffho.net" % n for n in range (2, 6)]
+
+	async def workflow (client, mock):
+		await asyncio.gather (*[add_wireguard_tunnel (client, "gw01.in.ffho.net", peer) for peer in peers])
+
+	mock = run_workflow (workflow)
+
+	transfer_nets = [pfx for pfx in mock.objects["ipam/prefixes/"].values () if pfx.get ('description')]
+	assert len (transfer_nets) == 2 * len (peers)
+
+	prefixes = [pfx['prefix'] for pfx in transfer_nets]
+	assert len (set (prefixes)) == len (prefixes)
+	assert collections.Counter (pfx['prefix'].split ('/')[1] for pfx in transfer_nets) == {'31' : len (peers), '64' : len (peers)}
+
+	# Every tunnel got one interface on each end
+	ifaces = collections.Counter (iface['virtual_machine'] for iface in mock.objects["virtualization/interfaces/"].values ())
+	assert ifaces[301] == len (peers)
+	assert all (ifaces[300 + n] == 1 for n in range (2, 6))
+
+
+def test_failed_lookup_is_not_cached ():
+	results = []
+
+	async def workflow (client, mock):
+		first = client.first
+		calls = []
+
+		async def flaky_first (path, **filters):
+			calls.append (path)
+			if len (calls) == 1:
+				raise asyncio.TimeoutError ()
+			return await first (path, **filters)
+
+		client.first = flaky_first
+
+		with pytest.raises (asyncio.TimeoutError):
+			await client.lookup ("extras/tags/", name = "Wireguard")
+
+		results.append (await client.lookup ("extras/tags/", name = "Wireguard"))
+		results.append (await client.lookup ("extras/tags/", name = "Wireguard"))
+		results.append (len (calls))
+
+	run_workflow (workflow)
+
+	assert results[0]['name'] == "Wireguard"
+	assert results[1] == results[0]
+	assert results[2] == 2
+
+
+def test_wireguard_tunnel_adopts_only_wireguard_ifaces ():
+	async def workflow (client, mock):
+		wg_tag = await client.lookup ("extras/tags/", name = "Wireguard")
+		await client.create ("virtualization/interfaces/", [
+			{"virtual_machine" : 301, "name" : "wg-gw02", "tags" : [wg_tag['id']]},
+			{"virtual_machine" : 301, "name" : "wg-gw03"},
+		])
+
+		await add_wireguard_tunnel (client, "gw01.in.ffho.net", "gw02.in.ffho.net")
+
+		with pytest.raises (WorkflowError, match = "isn't a Wireguard interface"):
+			await add_wireguard_tunnel (client, "gw01.in.ffho.net", "gw03.in.ffho.net")
+
+	mock = run_workflow (workflow)
+
+	ifaces = [iface for iface in mock.objects["virtualization/interfaces/"].values () if iface['virtual_machine'] == 301]
+	assert sorted (iface['name'] for iface in ifaces) == ["wg-gw02", "wg-gw03"]
+
+	# The tagged interface has been linked to the peer, the untagged one left alone
+	peers = {iface['name'] : (iface.get ('custom_fields') or {}).get ('wg_peer_vm') for iface in ifaces}
+	assert peers == {"wg-gw02" : 302, "wg-gw03" : None}
+
+
+def test_provision_pop_rerun_is_idempotent ():
+	counts = []
+
+	async def workflow (client, mock):
+		for _ in range (2):
+			await provision_pop (client, "foo", "R1", 9, "APU2", 8, "1:2 2:1", "sw-asset", "sw-serial", "bbr-asset", "bbr-serial")
+			counts.append (object_counts (mock))
+
+	mock = run_workflow (workflow)
+
+	assert counts[0] == counts[1]
+
+	names = sorted (dev['name'] for dev in mock.objects["dcim/devices/"].values ())
+	assert names == [
+		"bbr-foo.in.ffho.net",
+		"pp-foo-R1.1",
+		"sp-foo-mast1-1",
+		"sp-foo-mast1-2",
+		"sp-foo-mast2-1",
+		"sw-foo-01.in.ffho.net",
+	]
+
+	# Rack devices don't overlap
+	positions = [dev['position'] for dev in mock.objects["dcim/devices/"].values () if dev.get ('position')]
+	assert len (set (positions)) == 3
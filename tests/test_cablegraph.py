@@ -0,0 +1,99 @@
+#
+# Path tracing of scriptutils.cablegraph.
+#
+
+from scriptutils.cablegraph import PATH_BROKEN, PATH_COMPLETE, PATH_DANGLING, Topology
+
+SP = ('rearport', 1)
+PP_REAR = ('rearport', 2)
+PP_FRONT = ('frontport', 3)
+SW = ('interface', 4)
+
+NAMES = {
+	SP : "sp-foo-mast1-1:1",
+	PP_REAR : "pp-foo-R1.1:1",
+	PP_FRONT : "pp-foo-R1.1:1",
+	SW : "sw-foo-01:1",
+}
+
+
+# Surge protector rear port -> panel rear port, panel front port -> switch port
+def topology (cable_peers = None, front_to_rear = None, rear_positions = None):
+	if cable_peers is None:
+		cable_peers = {SP : [PP_REAR], PP_REAR : [SP], PP_FRONT : [SW], SW : [PP_FRONT]}
+	if front_to_rear is None:
+		front_to_rear = {PP_FRONT[1] : (PP_REAR[1], 1)}
+	if rear_positions is None:
+		rear_positions = {SP[1] : 1, PP_REAR[1] : 1}
+
+	return Topology (cable_peers, front_to_rear, rear_positions, NAMES)
+
+
+def test_complete_path ():
+	path = topology ().trace (SW)
+
+	assert path.status == PATH_COMPLETE
+	assert path.hops == [SW, PP_FRONT, PP_REAR, SP]
+	assert path.reason is None
+
+	# The other way round, from the surge protector's rear port
+	path = topology ().trace (SP)
+
+	assert path.status == PATH_COMPLETE
+	assert path.hops == [SP, PP_REAR, PP_FRONT, SW]
+
+
+def test_dangling_pass_through_port ():
+	path = topology ({PP_FRONT : [SW], SW : [PP_FRONT]}).trace (SW)
+
+	assert path.status == PATH_DANGLING
+	assert path.hops == [SW, PP_FRONT, PP_REAR]
+	assert "isn't connected" in path.reason
+
+
+def test_cable_without_far_end ():
+	path = topology ({SW : []}).trace (SW)
+
+	assert path.status == PATH_BROKEN
+	assert "has no far end terminations" in path.reason
+
+
+def test_cable_with_multiple_far_ends ():
+	path = topology ({SW : [PP_FRONT, ('interface', 5)]}).trace (SW)
+
+	assert path.status == PATH_BROKEN
+	assert "has 2 far end terminations" in path.reason
+
+
+def test_front_port_without_rear_port ():
+	path = topology (front_to_rear = {}).trace (SW)
+
+	assert path.status == PATH_BROKEN
+	assert path.reason.startswith ("no rear port known")
+
+
+def test_multi_position_rear_port ():
+	path = topology (rear_positions = {SP[1] : 1, PP_REAR[1] : 4}).trace (SP)
+
+	assert path.status == PATH_BROKEN
+	assert "multi position rear port" in path.reason
+
+
+def test_loop ():
+	# Both front ports of a panel cabled to its own rear ports
+	front_a, front_b = ('frontport', 10), ('frontport', 11)
+	rear_a, rear_b = ('rearport', 20), ('rearport', 21)
+	cable_peers = {front_a : [rear_b], rear_b : [front_a], front_b : [rear_a], rear_a : [front_b]}
+	front_to_rear = {front_a[1] : (rear_a[1], 1), front_b[1] : (rear_b[1], 1)}
+
+	path = topology (cable_peers, front_to_rear, {rear_a[1] : 1, rear_b[1] : 1}).trace (rear_a)
+
+	assert path.status == PATH_BROKEN
+	assert path.reason.startswith ("loop at")
+
+
+def test_paths_covers_every_port_once ():
+	paths = topology ().paths ()
+
+	assert len (paths) == 1
+	assert paths[0].origin == SW
@@ -0,0 +1,95 @@
+#
+# Compare devices created by bulk_create_devices () with ones created by Device.save ().
+#
+# Needs a NetBox installation and pytest-django, e.g. run
+#
+#   DJANGO_SETTINGS_MODULE=netbox.settings PYTHONPATH=/opt/netbox/netbox python3 -m pytest tests
+#
+# with NetBox's virtualenv.  Skipped otherwise.
+#
+
+import os
+
+import pytest
+
+pytest.importorskip ('pytest_django')
+if not os.environ.get ('DJANGO_SETTINGS_MODULE'):
+	pytest.skip ("Needs a NetBox installation (DJANGO_SETTINGS_MODULE)", allow_module_level = True)
+
+from django.contrib.contenttypes.models import ContentType
+
+from dcim.models import (
+	Device, DeviceRole, DeviceType, FrontPortTemplate, InterfaceTemplate, InventoryItemTemplate, Manufacturer,
+	ModuleBayTemplate, Platform, RearPortTemplate, Site,
+)
+from dcim.models.device_components import Interface
+from extras.models import CustomField
+
+from scriptutils.devices import bulk_create_devices
+
+pytestmark = pytest.mark.django_db
+
+# The device role field has been renamed with NetBox 4.0
+ROLE_FIELD = 'role' if any (field.name == 'role' for field in Device._meta.get_fields ()) else 'device_role'
+
+
+@pytest.fixture
+def setup ():
+	site = Site.objects.create (name = "Test", slug = "test")
+	manufacturer = Manufacturer.objects.create (name = "Test", slug = "test")
+	role = DeviceRole.objects.create (name = "Test", slug = "test")
+	platform = Platform.objects.create (name = "Test", slug = "test")
+
+	dev_type = DeviceType (manufacturer = manufacturer, model = "Test", slug = "test")
+	if hasattr (dev_type, 'airflow'):
+		dev_type.airflow = 'front-to-rear'
+	if hasattr (dev_type, 'default_platform'):
+		dev_type.default_platform = platform
+	dev_type.save ()
+
+	for n in range (1, 5):
+		InterfaceTemplate.objects.create (device_type = dev_type, name = "eth%d" % n, type = '1000base-t')
+		rear_port = RearPortTemplate.objects.create (device_type = dev_type, name = str (n), type = '8p8c', positions = 1)
+		FrontPortTemplate.objects.create (device_type = dev_type, name = str (n), type = '8p8c', rear_port = rear_port, rear_port_position = 1)
+	ModuleBayTemplate.objects.create (device_type = dev_type, name = "bay1")
+	InventoryItemTemplate.objects.create (device_type = dev_type, name = "psu1")
+
+	cf = CustomField.objects.create (name = "test_default", type = 'text', default = "foo")
+	if hasattr (cf, 'object_types'):
+		from core.models import ObjectType
+		cf.object_types.set ([ObjectType.objects.get_for_model (Interface)])
+	else:
+		cf.content_types.set ([ContentType.objects.get_for_model (Interface)])
+
+	return site, role, dev_type
+
+
+def new_device (setup, name):
+	site, role, dev_type = setup
+	return Device (device_type = dev_type, name = name, site = site, status = 'planned', **{ROLE_FIELD : role})
+
+
+def describe (device):
+	device = Device.objects.get (pk = device.pk)
+
+	return {
+		'platform' : device.platform_id,
+		'airflow' : getattr (device, 'airflow', None),
+		'interfaces' : sorted ((i.name, i.type, sorted (i.custom_field_data.items ())) for i in device.interfaces.all ()),
+		'rear_ports' : sorted ((p.name, p.type, p.positions) for p in device.rearports.all ()),
+		'front_ports' : sorted ((p.name, p.type, p.rear_port.name, p.rear_port_position) for p in device.frontports.all ()),
+		'module_bays' : sorted (bay.name for bay in device.modulebays.all ()),
+		'inventory_items' : sorted (item.name for item in device.inventoryitems.all ()),
+	}
+
+
+def test_bulk_created_devices_match_saved_device (setup):
+	saved = new_device (setup, "saved")
+	saved.save ()
+
+	bulk = bulk_create_devices ([new_device (setup, "bulk1"), new_device (setup, "bulk2")])
+
+	expected = describe (saved)
+	assert expected['interfaces'] and expected['front_ports']
+	for device in bulk:
+		assert describe (device) == expected
@@ -0,0 +1,66 @@
+#
+# Node ID allocation helpers of scriptutils.idpool and scriptutils.bbpop.
+#
+
+import pytest
+
+from scriptutils.bbpop import LOOPBACK_IPV4, LOOPBACK_IPV6, NODE_ID_MAX, NODE_ID_MIN, loopback_node_id
+from scriptutils.idpool import IdPool, PoolExhaustedError
+
+
+def test_allocate_lowest_free_ids ():
+	pool = IdPool (1, 10)
+	for id in (1, 2, 4):
+		pool.mark_used (id)
+
+	assert pool.num_free () == 7
+	assert pool.allocate () == [3]
+	assert pool.allocate (3) == [5, 6, 7]
+	assert not pool.is_free (5)
+	assert pool.is_free (8)
+	assert pool.num_free () == 3
+
+
+def test_ids_outside_pool ():
+	pool = IdPool (1, 10)
+	pool.mark_used (0)
+	pool.mark_used (11)
+
+	assert pool.num_free () == 10
+	assert not pool.is_free (0)
+	assert not pool.is_free (11)
+
+
+def test_pool_exhausted ():
+	pool = IdPool (5, 7)
+	pool.mark_used (6)
+
+	with pytest.raises (PoolExhaustedError):
+		pool.allocate (3)
+
+	# Nothing has been handed out
+	assert pool.allocate (2) == [5, 7]
+
+	with pytest.raises (PoolExhaustedError):
+		pool.allocate ()
+
+
+@pytest.mark.parametrize ('node_id', [NODE_ID_MIN, 9, 10, 12, 99, 100, 199, NODE_ID_MAX])
+def test_loopback_node_id (node_id):
+	assert loopback_node_id (LOOPBACK_IPV4 % node_id) == node_id
+	assert loopback_node_id (LOOPBACK_IPV6 % node_id) == node_id
+
+
+@pytest.mark.parametrize ('address', [
+	"10.132.254.12/32",
+	"2a03:2260:2342:fffe::12/128",
+	"2a03:2260:2342:ffff::1a/128",
+	"2a03:2260:2342:ffff::1:12/128",
+])
+def test_no_loopback (address):
+	assert loopback_node_id (address) is None
+
+
+def test_loopback_without_mask ():
+	assert loopback_node_id ("10.132.255.42") == 42
+	assert loopback_node_id ("2a03:2260:2342:ffff::42") == 42
@@ -0,0 +1,93 @@
+#
+# Integer prefix arithmetic of scriptutils.prefixes, checked against netaddr.
+#
+
+import ipaddress
+import random
+
+import pytest
+
+from scriptutils.prefixes import count_free_prefixes, first_free_prefix, merge_ranges
+
+
+def net_range (prefix):
+	net = ipaddress.ip_network (prefix)
+	return (int (net.network_address), int (net.broadcast_address))
+
+
+def ranges (prefixes):
+	return sorted (net_range (pfx) for pfx in prefixes)
+
+
+def test_first_free_prefix_v4 ():
+	first, last = net_range ("10.132.128.0/24")
+
+	assert first_free_prefix (first, last, [], 31, 4) == first
+	assert first_free_prefix (first, last, ranges (["10.132.128.0/31"]), 31, 4) == first + 2
+
+	# Partly used blocks and gaps too small for the prefix length are skipped
+	children = ranges (["10.132.128.0/31", "10.132.128.3/32", "10.132.128.4/31", "10.132.128.9/32"])
+	assert first_free_prefix (first, last, children, 32, 4) == first + 2
+	assert first_free_prefix (first, last, children, 31, 4) == first + 6
+	assert first_free_prefix (first, last, children, 30, 4) == first + 12
+
+	# Nested children
+	children = ranges (["10.132.128.0/25", "10.132.128.0/31", "10.132.128.126/31"])
+	assert first_free_prefix (first, last, children, 31, 4) == first + 128
+
+	assert first_free_prefix (first, last, ranges (["10.132.128.0/24"]), 31, 4) is None
+	assert first_free_prefix (first, last, [], 23, 4) is None
+
+
+def test_first_free_prefix_v6 ():
+	first, last = net_range ("2a03:2260:2342::/48")
+	children = ranges (["2a03:2260:2342::/64", "2a03:2260:2342:1::/64", "2a03:2260:2342:3::/64"])
+
+	free = first_free_prefix (first, last, children, 64, 6)
+	assert ipaddress.ip_address (free) == ipaddress.ip_address ("2a03:2260:2342:2::")
+
+
+def test_merge_ranges ():
+	assert merge_ranges ([]) == []
+	assert merge_ranges ([(0, 3), (2, 5), (6, 7), (9, 9), (10, 12), (11, 11)]) == [[0, 7], [9, 12]]
+
+
+def test_count_free_prefixes ():
+	first, last = net_range ("172.30.0.0/16")
+
+	assert count_free_prefixes (first, last, [], 24, 4) == (256, 256)
+
+	# Overlapping containers and their children are only counted once
+	children = ranges (["172.30.0.0/24", "172.30.2.0/23", "172.30.2.0/24", "172.30.4.128/25"])
+	assert count_free_prefixes (first, last, children, 24, 4) == (256, 252)
+
+
+# Compare against what Prefix.get_available_prefixes () does with netaddr
+def test_against_ipset ():
+	netaddr = pytest.importorskip ('netaddr')
+
+	rnd = random.Random (42)
+	for _ in range (200):
+		af, container_len = rnd.choice ([(4, 24), (6, 56)])
+		bits = 32 if af == 4 else 128
+		plen = container_len + rnd.randint (1, 8)
+
+		container = netaddr.IPNetwork ("10.132.128.0/24" if af == 4 else "2a03:2260:2342:fd00::/56")
+		children = []
+		for _ in range (rnd.randint (0, 20)):
+			child_len = rnd.randint (container_len + 1, min (bits, container_len + 10))
+			offset = rnd.randrange (container.size) & ~((1 << (bits - child_len)) - 1)
+			children.append (netaddr.IPNetwork ("%s/%d" % (netaddr.IPAddress (container.first + offset, af), child_len)))
+
+		available = netaddr.IPSet ([container]) - netaddr.IPSet (children)
+		size = 1 << (bits - plen)
+		free_blocks = [
+			block
+			for cidr in available.iter_cidrs () if cidr.prefixlen <= plen
+			for block in range (cidr.first, cidr.last + 1, size)
+		]
+
+		child_ranges = sorted ((child.first, child.last) for child in children)
+		expected_first = min (free_blocks) if free_blocks else None
+		assert first_free_prefix (container.first, container.last, child_ranges, plen, af) == expected_first
+		assert count_free_prefixes (container.first, container.last, child_ranges, plen, af) == (container.size // size, len (free_blocks))
@@ -0,0 +1,61 @@
+#
+# Rack unit placement of scriptutils.rackunits.
+#
+
+import pytest
+
+from scriptutils.rackunits import RackFullError, RackUnits
+
+
+# Patch panel, switch and BBR used to be put at u_height, u_height - 2 and u_height - 4
+@pytest.mark.parametrize ('u_height', [7, 9, 12, 42])
+def test_empty_rack_matches_old_layout (u_height):
+	units = RackUnits (u_height)
+
+	assert units.place ([(1, False)] * 3, 'front') == [u_height, u_height - 2, u_height - 4]
+
+
+def test_occupied_units_are_skipped ():
+	units = RackUnits (9)
+	units.occupy (9, 1, 'front')
+	units.occupy (6, 2, 'rear', full_depth = True)
+
+	# Unit 9 taken in front, 6 and 7 on both faces
+	assert units.place ([(1, False)] * 3, 'front') == [8, 5, 3]
+
+
+def test_faces ():
+	units = RackUnits (9)
+	units.occupy (9, 1, 'rear')
+
+	assert units.is_free (9, 1, 'front')
+	assert not units.is_free (9, 1, 'front', full_depth = True)
+	assert units.place ([(1, True)], 'front') == [8]
+
+
+def test_half_units ():
+	units = RackUnits (9)
+	units.occupy (8.5, 0.5, 'front')
+
+	assert not units.is_free (8, 1, 'front')
+	assert units.is_free (9, 1, 'front')
+	assert units.is_free (7, 1, 'front')
+	assert units.is_free (9.5, 0.5, 'front')
+	assert not units.is_free (9.5, 1, 'front')
+
+
+def test_starting_unit ():
+	units = RackUnits (4, starting_unit = 10)
+
+	assert not units.is_free (9, 1, 'front')
+	assert not units.is_free (13, 2, 'front')
+	assert units.place ([(2, False), (1, False)], 'front') == [12, 10]
+
+
+def test_gap_dropped_when_rack_is_tight ():
+	units = RackUnits (3)
+
+	assert units.place ([(1, False)] * 3, 'front') == [3, 1, 2]
+
+	with pytest.raises (RackFullError):
+		units.place ([(1, False)], 'front')
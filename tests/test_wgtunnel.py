@@ -0,0 +1,49 @@
+#
+# Interface naming of scriptutils.wgtunnel.
+#
+
+import pytest
+
+from scriptutils.wgtunnel import IFACE_NAME_MAX_LEN, IfaceNameError, get_hashed_iface_name, pick_iface_name
+
+PEER = ('vm', 1)
+OTHER_PEER = ('vm', 2)
+
+
+def test_short_names_are_used_as_is ():
+	assert pick_iface_name ({}, PEER, "gw01.in.ffho.net", False) == "wg-gw01"
+	assert pick_iface_name ({}, PEER, "gw01.in.ffho.net", True) == "oob-gw01"
+
+	# Existing interface of the same peer or not linked to any peer
+	assert pick_iface_name ({"wg-gw01" : PEER}, PEER, "gw01.in.ffho.net", False) == "wg-gw01"
+	assert pick_iface_name ({"wg-gw01" : None}, PEER, "gw01.in.ffho.net", False) == "wg-gw01"
+
+
+def test_short_name_linked_to_other_peer ():
+	with pytest.raises (IfaceNameError):
+		pick_iface_name ({"wg-gw01" : OTHER_PEER}, PEER, "gw01.in.ffho.net", False)
+
+
+def test_truncated_names_end_with_peer_hash ():
+	peers = ["bbr-paderborn-a.in.ffho.net", "bbr-paderborn-b.in.ffho.net"]
+
+	names = [pick_iface_name ({}, PEER, peer, False) for peer in peers]
+	assert names[0] != names[1]
+	assert all (len (name) <= IFACE_NAME_MAX_LEN for name in names)
+	assert all (name.startswith ("wg-bbr-pad") for name in names)
+
+	# The name only depends on the peer
+	assert pick_iface_name ({"wg-bbr-paderbor" : OTHER_PEER}, PEER, peers[0], False) == names[0]
+
+
+def test_truncated_name_collision_uses_longer_hash ():
+	peer = "bbr-paderborn-a.in.ffho.net"
+	short = get_hashed_iface_name ("wg-bbr-paderbor", peer, 4)
+	longer = get_hashed_iface_name ("wg-bbr-paderbor", peer, 5)
+
+	assert pick_iface_name ({short : OTHER_PEER}, PEER, peer, False) == longer
+	assert pick_iface_name ({short : PEER}, PEER, peer, False) == short
+
+	taken = {get_hashed_iface_name ("wg-bbr-paderbor", peer, n) : OTHER_PEER for n in range (4, 9)}
+	with pytest.raises (IfaceNameError):
+		pick_iface_name (taken, PEER, peer, False)